@@ -0,0 +1,10 @@
+"""
+Benchmarks de Claudio.
+
+Se ejecutan desde la raíz del proyecto como módulos, p.ej.:
+    python -m benchmarks.bench_worker_pool
+
+`fake_claude.py` sustituye al Claude CLI (`CLAUDE_CLI_PATH`) con salida
+sintética configurable; `bench_channels` lo usa para medir los canales bajo
+carga sin gastar tokens.
+"""
@@ -0,0 +1,386 @@
+"""
+Carga concurrente sobre los canales con el CLI falso (benchmarks/fake_claude.py).
+
+N usuarios envían M prompts cada uno, en paralelo entre usuarios y en serie
+dentro de cada usuario, contra uno de estos objetivos:
+
+- `telegram`, `slack`, `web`: `ClaudeCodeExecutor.execute_streaming` de cada canal
+- `slack-bot`: `process_message` del bot de Slack encolado en su
+  `message_executor`, como los eventos de Bolt, con una Web API de Slack falsa
+  en localhost (`SLACK_API_URL`)
+- `web-ws`: el endpoint `/ws/chat` de la web servido con uvicorn
+
+Para cada objetivo informa del throughput, los percentiles p50/p95/p99 del
+primer fragmento de salida y de la respuesta completa, y el pico de memoria
+del proceso y de su árbol (bot + procesos del CLI). Con `--target all` cada
+objetivo corre en su propio proceso para que la memoria no se mezcle.
+
+Los objetivos necesitan las dependencias del canal correspondiente
+(python-telegram-bot, slack-bolt, fastapi/uvicorn/websockets).
+
+Uso:
+    python -m benchmarks.bench_channels --target all --users 8 --requests 5
+    python -m benchmarks.bench_channels --target web-ws --users 32 --rate 0 --lines 2000
+"""
+
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import math
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Optional
+from urllib.parse import parse_qs
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+from channels.common.resource_limits import ResourceLimits, ResourceMonitor
+
+FAKE_CLAUDE = Path(__file__).resolve().parent / 'fake_claude.py'
+
+TARGETS = {
+    'telegram': 'channels.telegram.bot',
+    'slack': 'channels.slack.bot',
+    'web': 'channels.web.app',
+    'slack-bot': 'channels.slack.bot',
+    'web-ws': 'channels.web.app',
+}
+
+
+@dataclass
+class Sample:
+    first_output: Optional[float]
+    total: float
+    ok: bool
+
+
+# ============== Entorno ==============
+
+def configure_env(args, slack_api_url: Optional[str] = None):
+    """Configura los canales (antes de importarlos) para usar el CLI falso."""
+    state_dir = tempfile.mkdtemp(prefix='claudio-bench-')
+    env = {
+        'CLAUDE_CLI_PATH': str(FAKE_CLAUDE),
+        'WORKSPACE_PATH': str(ROOT),
+        'CLAUDE_OUTPUT_FORMAT': args.output_format,
+        'WORKER_POOL_SIZE': str(args.pool),
+        'ADMISSION_MAX_CONCURRENT': str(args.admission),
+        'ADMISSION_STATE_DIR': state_dir,
+        'SESSIONS_PATH': '',
+        'RESPONSE_CACHE_ENABLED': 'false',
+        'RATE_LIMIT_REQUESTS': '1000000',
+        'METRICS_PORT': '0',
+        'SLACK_ALLOWED_USER_IDS': '',
+        'SLACK_BOT_TOKEN': 'xoxb-bench',
+        'SLACK_APP_TOKEN': 'xapp-bench',
+        'FAKE_CLAUDE_STARTUP': str(args.startup),
+        'FAKE_CLAUDE_LINES': str(args.lines),
+        'FAKE_CLAUDE_LINE_LENGTH': str(args.line_length),
+        'FAKE_CLAUDE_RATE': str(args.rate),
+        'FAKE_CLAUDE_STDERR_LINES': str(args.stderr_lines),
+        'FAKE_CLAUDE_EXIT_CODE': str(args.exit_code),
+    }
+    if slack_api_url:
+        env['SLACK_API_URL'] = slack_api_url
+    os.environ.update(env)
+
+
+def load_channel(target: str, log_level: str):
+    module = importlib.import_module(TARGETS[target])
+    logging.getLogger().setLevel(log_level)
+    return module
+
+
+def wait_for_pool(pool, timeout: float):
+    """Espera a que el pool tenga todos sus workers pre-arrancados."""
+    deadline = time.monotonic() + timeout
+    while pool.size and pool.stats()['idle'] < pool.size and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+# ============== Objetivos ==============
+
+async def run_executor(module, target: str, args) -> list[Sample]:
+    """Llama a `ClaudeCodeExecutor.execute_streaming` del canal desde N usuarios."""
+    pool = module.get_worker_pool()
+    pool.start()
+    wait_for_pool(pool, args.startup + 5)
+    executor = module.ClaudeCodeExecutor()
+    samples = []
+
+    def user_id(i: int):
+        return 100000 + i if target == 'telegram' else f"bench{i:04d}"
+
+    async def user(i: int):
+        for _ in range(args.requests):
+            start = time.perf_counter()
+            first = None
+
+            async def on_output(text: str):
+                nonlocal first
+                if first is None:
+                    first = time.perf_counter() - start
+
+            async def on_error(text: str):
+                pass
+
+            result = await executor.execute_streaming(args.prompt, user_id(i), False, on_output, on_error)
+            samples.append(Sample(first, time.perf_counter() - start, bool(result.get('success'))))
+
+    try:
+        await asyncio.gather(*(user(i) for i in range(args.users)))
+    finally:
+        pool.shutdown()
+    return samples
+
+
+class FakeSlackAPI:
+    """Web API de Slack mínima: responde ok y anota cuándo llega la primera respuesta de cada canal."""
+
+    def __init__(self):
+        self.finished: dict[str, threading.Event] = {}
+        self.first_at: dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._ts = 0
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length).decode('utf-8') if length else ''
+                if 'json' in (self.headers.get('Content-Type') or ''):
+                    params = json.loads(raw or '{}')
+                else:
+                    params = {k: v[0] for k, v in parse_qs(raw).items()}
+                body = json.dumps(api.handle(self.path.rsplit('/', 1)[-1], params)).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', free_port()), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}/api/"
+
+    def expect(self, channel: str) -> threading.Event:
+        with self._lock:
+            event = self.finished[channel] = threading.Event()
+        return event
+
+    def done(self, channel: str, text: str):
+        # Los mensajes de estado ("⏳ Procesando...", "⏳ En cola...") no cuentan
+        if not (text or '').startswith('⏳'):
+            with self._lock:
+                event = self.finished.get(channel)
+                self.first_at.setdefault(channel, time.perf_counter())
+            if event:
+                event.set()
+
+    def handle(self, method: str, params: dict) -> dict:
+        if method == 'auth.test':
+            return {'ok': True, 'user_id': 'UBENCH', 'bot_id': 'BBENCH', 'team_id': 'TBENCH', 'user': 'claudio'}
+        if method == 'chat.postMessage':
+            with self._lock:
+                self._ts += 1
+                ts = f"{int(time.time())}.{self._ts:06d}"
+            self.done(params.get('channel'), params.get('text'))
+            return {'ok': True, 'channel': params.get('channel'), 'ts': ts}
+        if method == 'chat.update':
+            self.done(params.get('channel'), params.get('text'))
+            return {'ok': True, 'channel': params.get('channel'), 'ts': params.get('ts')}
+        return {'ok': True}
+
+
+async def run_slack_bot(module, api: FakeSlackAPI, args) -> list[Sample]:
+    """Encola `process_message` en el `message_executor` del bot (una tarea por mensaje) desde N usuarios."""
+    pool = module.get_worker_pool()
+    pool.start()
+    wait_for_pool(pool, args.startup + 5)
+    module.BOT_USER_ID = await module.get_bot_user_id()
+    samples = []
+
+    async def user(i: int):
+        user_id = f"U{i:05d}"
+        for n in range(args.requests):
+            channel = f"D{i:05d}{n:04d}"
+            answered = api.expect(channel)
+
+            async def say(text=None, thread_ts=None, **kwargs):
+                api.done(channel, text)
+
+            start = time.perf_counter()
+            task = module.message_executor.submit(module.process_message, user_id, args.prompt, say, channel)
+            try:
+                await asyncio.wait_for(task, timeout=args.timeout)
+                ok = True
+            except asyncio.TimeoutError:
+                ok = False
+            total = time.perf_counter() - start
+            # Primer mensaje que no es de estado: la primera edición en vivo con salida
+            first = api.first_at[channel] - start if answered.is_set() else None
+            samples.append(Sample(first, total, ok and answered.is_set()))
+
+    try:
+        await asyncio.gather(*(user(i) for i in range(args.users)))
+        await module.message_executor.shutdown(args.timeout)
+    finally:
+        pool.shutdown()
+    return samples
+
+
+async def run_web_ws(module, args) -> list[Sample]:
+    """Conecta N clientes WebSocket a `/ws/chat` de la web servida con uvicorn."""
+    import uvicorn
+    import websockets
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(module.app, host='127.0.0.1', port=port, log_level='warning'))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        await asyncio.sleep(0.05)
+    wait_for_pool(module.get_worker_pool(), args.startup + 5)
+
+    url = f"ws://127.0.0.1:{port}/ws/chat"
+    samples = []
+
+    async def user(i: int):
+        async with websockets.connect(url, max_size=None) as ws:
+            for _ in range(args.requests):
+                # Sesión nueva en cada prompt, como en los demás objetivos
+                await ws.send(json.dumps({'type': 'new_session'}))
+                start = time.perf_counter()
+                first = None
+                await ws.send(json.dumps({'type': 'message', 'content': args.prompt}))
+                while True:
+                    message = json.loads(await ws.recv())
+                    if message['type'] == 'chunk' and first is None:
+                        first = time.perf_counter() - start
+                    elif message['type'] == 'done':
+                        samples.append(Sample(first, time.perf_counter() - start, bool(message.get('success'))))
+                        break
+
+    try:
+        await asyncio.gather(*(user(i) for i in range(args.users)))
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
+    return samples
+
+
+# ============== Informe ==============
+
+def percentile(values: list, p: float) -> Optional[float]:
+    """Percentil por rango más cercano (sin interpolar)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def format_percentiles(values: list) -> str:
+    if not values:
+        return "sin datos"
+    return " · ".join(f"p{p} {percentile(values, p):.3f}s" for p in (50, 95, 99))
+
+
+def report(target: str, args, samples: list[Sample], wall: float, monitor: ResourceMonitor):
+    ok = sum(1 for s in samples if s.ok)
+    usage = monitor.usage()
+    # ru_maxrss está en KB en Linux y en bytes en macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    process_mb = maxrss / 1024 / (1024 if sys.platform == 'darwin' else 1)
+
+    print(
+        f"{target:<10} · {args.users} usuarios × {args.requests} = {len(samples)} peticiones "
+        f"({ok} ok) en {wall:.2f}s → {len(samples) / wall if wall else 0:.2f} req/s"
+    )
+    print(f"  primer fragmento  {format_percentiles([s.first_output for s in samples if s.first_output is not None])}")
+    print(f"  respuesta total   {format_percentiles([s.total for s in samples])}")
+    print(f"  memoria           proceso {process_mb:.0f} MB · árbol con CLIs {usage['peak_rss_mb']:.0f} MB "
+          f"(pico, {usage['peak_children']} hijos)")
+
+
+def run_target(args):
+    api = FakeSlackAPI() if args.target == 'slack-bot' else None
+    configure_env(args, slack_api_url=api.url if api else None)
+    module = load_channel(args.target, args.log_level)
+
+    monitor = ResourceMonitor(os.getpid(), ResourceLimits(sample_interval=0.2)).start()
+    start = time.perf_counter()
+    try:
+        if args.target == 'slack-bot':
+            samples = asyncio.run(run_slack_bot(module, api, args))
+        elif args.target == 'web-ws':
+            samples = asyncio.run(run_web_ws(module, args))
+        else:
+            samples = asyncio.run(run_executor(module, args.target, args))
+    finally:
+        monitor.stop()
+    report(args.target, args, samples, time.perf_counter() - start, monitor)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', choices=[*TARGETS, 'all'], default='all')
+    parser.add_argument('--users', type=int, default=4, help='Usuarios concurrentes')
+    parser.add_argument('--requests', type=int, default=5, help='Prompts por usuario')
+    parser.add_argument('--prompt', default='¿qué hay en el sprint actual?')
+    parser.add_argument('--pool', type=int, default=2, help='WORKER_POOL_SIZE del canal')
+    parser.add_argument('--admission', type=int, default=0, help='ADMISSION_MAX_CONCURRENT (0 = sin límite)')
+    parser.add_argument('--output-format', choices=['text', 'stream-json'], default='text')
+    parser.add_argument('--timeout', type=float, default=600, help='Espera máxima por respuesta (slack-bot)')
+    parser.add_argument('--log-level', default='WARNING')
+    fake = parser.add_argument_group('CLI falso')
+    fake.add_argument('--startup', type=float, default=0.5, help='Segundos de arranque del CLI')
+    fake.add_argument('--lines', type=int, default=20, help='Líneas de respuesta')
+    fake.add_argument('--line-length', type=int, default=80, help='Caracteres por línea')
+    fake.add_argument('--rate', type=float, default=50, help='Líneas por segundo (0 = sin pausa)')
+    fake.add_argument('--stderr-lines', type=int, default=0, help='Líneas de ruido en stderr')
+    fake.add_argument('--exit-code', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.target != 'all':
+        run_target(args)
+        return
+
+    # Un proceso por objetivo: cada uno importa su canal y mide su propia memoria
+    argv, rest = [], iter(sys.argv[1:])
+    for arg in rest:
+        if arg == '--target':
+            next(rest, None)
+        elif not arg.startswith('--target='):
+            argv.append(arg)
+    for target in TARGETS:
+        result = subprocess.run([sys.executable, '-m', 'benchmarks.bench_channels', '--target', target, *argv], cwd=ROOT)
+        if result.returncode != 0:
+            print(f"{target:<10} · falló (código {result.returncode}); ¿están instaladas sus dependencias?")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+Microbenchmark de la división de salidas largas en mensajes.
+
+Compara `split_markdown` (channels/common/chunker.py) con el `split_message`
+que tenían los bots (corte en el último salto de línea, sin mirar el
+Markdown) sobre una salida sintética de `--size` bytes con bloques de código,
+negritas que cruzan líneas y líneas más largas que un mensaje:
+
+- tiempo de dividir la salida completa
+- streaming: la salida llega en trozos de `--piece` caracteres, como las
+  líneas del CLI; el anterior acumula texto y vuelve a dividir todo lo
+  acumulado (lo que hacía `LiveMessage`), el nuevo alimenta un `MarkdownChunker`
+- mensajes que no se pueden parsear: bloques ``` o marcadores sin cerrar
+
+Uso:
+    python -m benchmarks.bench_chunker --size 1000000 --max-length 4096
+"""
+
+import argparse
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from channels.common.chunker import FENCE, MarkdownChunker, split_markdown
+
+
+def legacy_split(text: str, max_length: int) -> list:
+    """`split_message` tal como estaba en los bots de Telegram y Slack."""
+    if len(text) <= max_length:
+        return [text]
+    parts = []
+    current = text
+    while len(current) > max_length:
+        split_pos = current.rfind('\n', 0, max_length)
+        if split_pos == -1:
+            split_pos = max_length
+        parts.append(current[:split_pos])
+        current = current[split_pos:].lstrip()
+    if current:
+        parts.append(current)
+    return parts
+
+
+def generate(size: int, seed: int = 1) -> str:
+    """Salida tipo respuesta del CLI: prosa con *negritas*, listas, bloques y líneas larguísimas."""
+    rng = random.Random(seed)
+    words = ['sprint', 'ticket', 'deploy', 'revisión', 'bloqueo', 'cliente', 'pipeline', 'métrica', 'tarea']
+    out, length = [], 0
+    while length < size:
+        kind = rng.random()
+        if kind < 0.5:
+            line = ' '.join(rng.choice(words) for _ in range(rng.randint(5, 25)))
+            block = f"{line} *{rng.choice(words)} {rng.choice(words)}\n{line}* _{rng.choice(words)}_.\n\n"
+        elif kind < 0.7:
+            block = ''.join(f"• {rng.choice(words)} {rng.choice(words)}\n" for _ in range(rng.randint(3, 10))) + '\n'
+        elif kind < 0.95:
+            body = ''.join(f"    x_{i} = {i} * 2  # {rng.choice(words)}\n" for i in range(rng.randint(10, 120)))
+            block = f"{FENCE}python\n{body}{FENCE}\n\n"
+        else:
+            block = ' '.join(rng.choice(words) for _ in range(rng.randint(800, 1500))) + '\n\n'
+        out.append(block)
+        length += len(block)
+    return ''.join(out)[:size]
+
+
+def count_broken(chunks: list, markers: str) -> int:
+    """Mensajes con un bloque ``` abierto o un marcador en línea impar."""
+    marker_re = re.compile(f"(?<![A-Za-z0-9])[{re.escape(markers)}](?=\\S)|(?<=\\S)[{re.escape(markers)}](?![A-Za-z0-9])")
+    broken = 0
+    for chunk in chunks:
+        fences = sum(1 for line in chunk.split('\n') if line.lstrip().startswith(FENCE))
+        outside = ''.join(part for i, part in enumerate(chunk.split(FENCE)) if i % 2 == 0)
+        if fences % 2 or any(marker_re.findall(outside).count(m) % 2 for m in markers):
+            broken += 1
+    return broken
+
+
+def stream_legacy(pieces: list, max_length: int) -> int:
+    text, splits = '', 0
+    for piece in pieces:
+        text += piece
+        splits += len(legacy_split(text, max_length))
+    return splits
+
+
+def stream_chunker(pieces: list, max_length: int, markers: str) -> int:
+    chunker = MarkdownChunker(max_length, markers)
+    chunks = 0
+    for piece in pieces:
+        chunks += sum(1 for _ in chunker.feed(piece))
+    return chunks + sum(1 for _ in chunker.flush())
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=1_000_000, help='Bytes de salida sintética')
+    parser.add_argument('--max-length', type=int, default=4096, help='4096 Telegram, 3000 Slack')
+    parser.add_argument('--markers', default='*_', help="Marcadores en línea ('*_' Telegram, '*_~' Slack)")
+    parser.add_argument('--piece', type=int, default=80, help='Caracteres por trozo en streaming')
+    parser.add_argument('--stream-size', type=int, default=200_000,
+                        help='Bytes para el streaming (el anterior es cuadrático)')
+    args = parser.parse_args()
+
+    text = generate(args.size)
+    legacy, legacy_time = timed(legacy_split, text, args.max_length)
+    chunks, chunk_time = timed(lambda: list(split_markdown(text, args.max_length, args.markers)))
+    assert all(len(c) <= args.max_length for c in chunks), "split_markdown superó el límite"
+
+    print(f"{len(text) / 1e6:.1f} MB · mensajes de {args.max_length} caracteres\n")
+    print(f"{'':<16} {'tiempo':>10} {'mensajes':>9} {'rotos':>7}")
+    for name, parts, elapsed in (('split_message', legacy, legacy_time), ('split_markdown', chunks, chunk_time)):
+        print(f"{name:<16} {elapsed * 1e3:7.1f} ms {len(parts):9d} {count_broken(parts, args.markers):7d}")
+
+    stream_text = text[:args.stream_size]
+    pieces = [stream_text[i:i + args.piece] for i in range(0, len(stream_text), args.piece)]
+    _, legacy_stream = timed(stream_legacy, pieces, args.max_length)
+    _, chunker_stream = timed(stream_chunker, pieces, args.max_length, args.markers)
+    print(f"\nStreaming de {len(stream_text) / 1e3:.0f} KB en {len(pieces)} trozos de {args.piece}:")
+    print(f"  acumular y dividir  {legacy_stream * 1e3:9.1f} ms")
+    print(f"  MarkdownChunker     {chunker_stream * 1e3:9.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Decodificación de la salida del CLI: `read_stream` original vs `LineDecoder`.
+
+Alimenta salidas de una sola línea de varios MB (como el JSON de una
+herramienta o una tabla grande) en chunks, por el algoritmo original
+(decodificar todo el buffer en cada chunk) y por el decoder incremental, y
+comprueba además que un carácter multibyte partido entre chunks no se corrompe.
+
+Uso:
+    python -m benchmarks.bench_line_decoder --sizes 1,2,4 --read-size 1024
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from channels.common.line_decoder import LineDecoder
+
+
+def legacy_decode(chunks) -> list:
+    """Réplica del bucle de `read_stream` anterior (sin callbacks ni ANSI)."""
+    lines = []
+    buffer = b''
+    for chunk in chunks:
+        buffer += chunk
+        text = buffer.decode('utf-8', errors='replace')
+        while '\n' in text:
+            line, text = text.split('\n', 1)
+            lines.append(line)
+        buffer = text.encode('utf-8', errors='replace')
+    if buffer:
+        lines.append(buffer.decode('utf-8', errors='replace'))
+    return lines
+
+
+def incremental_decode(chunks) -> list:
+    decoder = LineDecoder()
+    lines = []
+    for chunk in chunks:
+        lines.extend(decoder.feed(chunk))
+    tail = decoder.flush()
+    if tail:
+        lines.append(tail)
+    return lines
+
+
+def make_payload(size_mb: float) -> bytes:
+    # Una sola línea JSON con caracteres multibyte (ñ, €, emoji) repartidos
+    unit = '{"nombre": "Señora Muñoz", "importe": "1.250 €", "estado": "🟢"}, '
+    repeat = int(size_mb * 1024 * 1024 / len(unit.encode('utf-8'))) + 1
+    return ('[' + unit * repeat + ']\n').encode('utf-8')
+
+
+def chunked(data: bytes, size: int) -> list:
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def timed(fn, chunks):
+    start = time.perf_counter()
+    result = fn(chunks)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='0.5,1,2', help='Tamaños en MB separados por coma')
+    parser.add_argument('--read-size', type=int, default=1024, help='Bytes por chunk (1024 = valor original)')
+    parser.add_argument('--skip-legacy-above', type=float, default=4.0,
+                        help='No ejecutar el algoritmo original por encima de este tamaño (MB)')
+    args = parser.parse_args()
+
+    print(f"Chunks de {args.read_size} bytes")
+    print(f"{'MB':>6} {'original':>12} {'incremental':>12} {'speedup':>9}  U+FFFD (orig/inc)")
+    for size_mb in (float(s) for s in args.sizes.split(',')):
+        payload = make_payload(size_mb)
+        chunks = chunked(payload, args.read_size)
+        expected = payload.decode('utf-8').split('\n')[0]
+
+        inc_time, inc_lines = timed(incremental_decode, chunks)
+        inc_bad = ''.join(inc_lines).count('�')
+        assert inc_lines[0] == expected, "LineDecoder produjo una línea distinta a la original"
+
+        if size_mb <= args.skip_legacy_above:
+            legacy_time, legacy_lines = timed(legacy_decode, chunks)
+            legacy_bad = ''.join(legacy_lines).count('�')
+            print(
+                f"{size_mb:>6.2f} {legacy_time:>11.3f}s {inc_time:>11.3f}s "
+                f"{legacy_time / inc_time:>8.1f}x  {legacy_bad}/{inc_bad}"
+            )
+        else:
+            print(f"{size_mb:>6.2f} {'(omitido)':>12} {inc_time:>11.3f}s {'-':>9}  -/{inc_bad}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""
+Microbenchmark del rate limiting con muchos usuarios.
+
+Compara `RateLimiter` (GCRA, channels/common/rate_limit.py) con la
+implementación anterior de los bots (lista de timestamps por usuario que se
+reconstruye en cada mensaje y nunca se expulsa) en tres escenarios:
+
+- `reparto`: `--users` usuarios envían mensajes por turnos, todos por debajo
+  del límite
+- `saturado`: los mismos usuarios con la cuota agotada (cada comprobación
+  rechaza y calcula la espera)
+- `inactivos`: tras la ventana, cuánta memoria sigue ocupando el estado de
+  usuarios que ya no escriben
+
+Para cada uno mide el coste por comprobación y la memoria del estado
+(tracemalloc). Con `--db` repite `RateLimiter` persistiendo en SQLite.
+
+Uso:
+    python -m benchmarks.bench_rate_limit --users 10000 --limit 10 --window 60
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from channels.common.rate_limit import RateLimiter
+
+
+class FakeClock:
+    """Reloj manual para simular el paso de la ventana sin esperar."""
+
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class LegacyRateLimiter:
+    """`check_rate_limit` tal como estaba en los bots de Telegram y Slack."""
+
+    def __init__(self, limit: int, window: float, clock=time.time):
+        self.limit = limit
+        self.window = window
+        self.clock = clock
+        self.tracker = {}
+
+    def check(self, user_id) -> tuple[bool, float]:
+        current_time = self.clock()
+        if user_id in self.tracker:
+            self.tracker[user_id] = [
+                ts for ts in self.tracker[user_id]
+                if current_time - ts < self.window
+            ]
+        else:
+            self.tracker[user_id] = []
+        if len(self.tracker[user_id]) >= self.limit:
+            oldest_timestamp = min(self.tracker[user_id])
+            return False, max(0, self.window - (current_time - oldest_timestamp))
+        self.tracker[user_id].append(current_time)
+        return True, 0
+
+    def __len__(self) -> int:
+        return len(self.tracker)
+
+
+def build(name: str, args, clock: FakeClock):
+    if name == 'legacy':
+        return LegacyRateLimiter(args.limit, args.window, clock=clock)
+    path = os.path.join(tempfile.mkdtemp(prefix='claudio-bench-rl-'), 'rate_limit.db') if name == 'gcra+sqlite' else None
+    return RateLimiter(args.limit, args.window, path=path, evict_interval=args.window, clock=clock)
+
+
+def run(name: str, args, trace: bool) -> dict:
+    """Tiempos sin `trace`; con `trace`, memoria (tracemalloc distorsiona los tiempos)."""
+    clock = FakeClock()
+    users = [100000 + i for i in range(args.users)]
+    if trace:
+        tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0] if trace else 0
+    limiter = build(name, args, clock)
+    step = args.window / (args.limit * 4)
+    results = {}
+
+    # Reparto: cada ronda todos los usuarios envían un mensaje; por debajo del límite
+    checks = 0
+    started = time.perf_counter()
+    for _ in range(args.limit):
+        for user_id in users:
+            limiter.check(user_id)
+        checks += len(users)
+        clock.now += step
+    results['reparto'] = (time.perf_counter() - started) / checks
+    results['memoria'] = tracemalloc.get_traced_memory()[0] - baseline if trace else 0
+
+    # Saturado: la cuota ya está agotada, todas las comprobaciones se rechazan
+    for user_id in users:
+        while limiter.check(user_id)[0]:
+            pass
+    rejected = 0
+    started = time.perf_counter()
+    for _ in range(args.rounds):
+        for user_id in users:
+            rejected += not limiter.check(user_id)[0]
+    results['saturado'] = (time.perf_counter() - started) / (args.rounds * len(users))
+    assert rejected == args.rounds * len(users), "el escenario saturado aceptó mensajes"
+
+    # Inactivos: pasa la ventana completa y un único usuario vuelve a escribir
+    clock.now += args.window * 2
+    limiter.check(users[0])
+    results['inactivos'] = tracemalloc.get_traced_memory()[0] - baseline if trace else 0
+    results['tracked'] = len(limiter)
+    if trace:
+        tracemalloc.stop()
+    if isinstance(limiter, RateLimiter):
+        limiter.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--limit', type=int, default=10, help='RATE_LIMIT_REQUESTS')
+    parser.add_argument('--window', type=float, default=60, help='RATE_LIMIT_WINDOW')
+    parser.add_argument('--rounds', type=int, default=5, help='Rondas del escenario saturado')
+    parser.add_argument('--db', action='store_true', help='Incluir RateLimiter con persistencia SQLite')
+    args = parser.parse_args()
+
+    names = ['legacy', 'gcra'] + (['gcra+sqlite'] if args.db else [])
+    print(f"{args.users} usuarios · límite {args.limit} cada {args.window:g}s\n")
+    print(f"{'':<12} {'reparto':>12} {'saturado':>12} {'memoria':>10} {'tras ventana':>14}")
+    for name in names:
+        r = run(name, args, trace=False)
+        r.update({k: v for k, v in run(name, args, trace=True).items() if k in ('memoria', 'inactivos')})
+        print(
+            f"{name:<12} {r['reparto'] * 1e9:9.0f} ns {r['saturado'] * 1e9:9.0f} ns "
+            f"{r['memoria'] / 1024:7.0f} KB {r['inactivos'] / 1024:8.0f} KB ({r['tracked']} usuarios)"
+        )
+
+
+if __name__ == '__main__':
+    main()
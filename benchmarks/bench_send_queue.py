@@ -0,0 +1,187 @@
+"""
+Llamadas a la API, 429 y tiempo de las respuestas en vivo con y sin `SendQueue`.
+
+Simula varios chats que reciben a la vez una respuesta en vivo como la de
+`LiveMessage` en Telegram: el mensaje "⏳ Procesando...", una edición cada
+`--edit-interval` segundos con el texto acumulado y nuevas partes cada
+`--part-every` ediciones. La API falsa aplica los límites de Telegram (un
+cubo de tokens por chat y otro global) y contesta 429 con `retry_after` en
+segundos enteros cuando se pasan:
+
+- `directo`: cada envío se hace en cuanto se produce y, ante un 429, espera
+  `retry_after` y reintenta (lo que hacía el bot antes de la cola)
+- `cola`: todo pasa por `SendQueue` (channels/common/send_queue.py) con los
+  mismos límites que la API; las ediciones pendientes del mismo mensaje se
+  sustituyen por la última
+
+Informa de llamadas, 429, tiempo hasta que cada chat muestra su texto final y
+chats que acabaron mostrando un texto que no era el último.
+
+Uso:
+    python -m benchmarks.bench_send_queue --chats 8 --edits 40 --edit-interval 0.1
+"""
+
+import argparse
+import asyncio
+import math
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from benchmarks.bench_channels import format_percentiles
+from channels.common.send_queue import SendQueue
+
+
+class RetryAfter(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"Too Many Requests: retry after {retry_after:g}")
+        self.retry_after = retry_after
+
+
+class FakeBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Consume un token; si no hay, devuelve los segundos que faltan (0 = concedido)."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class FakeBotAPI:
+    """sendMessage / editMessageText con los límites por chat y global de Telegram."""
+
+    def __init__(self, latency: float, chat_rate: float, chat_burst: int, global_rate: float):
+        self.latency = latency
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.global_bucket = FakeBucket(global_rate, max(1, int(global_rate)))
+        self.buckets: dict[int, FakeBucket] = {}
+        self.shown: dict[tuple[int, int], str] = {}  # (chat, mensaje) → texto visible
+        self.calls = 0
+        self.limited = 0
+        self._ids = 0
+
+    async def _call(self, chat_id: int):
+        await asyncio.sleep(self.latency)
+        self.calls += 1
+        bucket = self.buckets.setdefault(chat_id, FakeBucket(self.chat_rate, self.chat_burst))
+        wait = bucket.take() or self.global_bucket.take()
+        if wait:
+            self.limited += 1
+            raise RetryAfter(math.ceil(wait))
+
+    async def send(self, chat_id: int, text: str) -> int:
+        await self._call(chat_id)
+        self._ids += 1
+        self.shown[(chat_id, self._ids)] = text
+        return self._ids
+
+    async def edit(self, chat_id: int, message_id: int, text: str):
+        await self._call(chat_id)
+        self.shown[(chat_id, message_id)] = text
+
+
+def retry_delay(error: Exception, attempt: int):
+    return float(error.retry_after) if isinstance(error, RetryAfter) else None
+
+
+async def direct(send, *args):
+    while True:
+        try:
+            return await send(*args)
+        except RetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+
+
+async def live_reply(api: FakeBotAPI, queue, chat_id: int, args) -> tuple[float, dict]:
+    """Una respuesta en vivo; devuelve el tiempo hasta mostrarla entera y el texto final de cada mensaje."""
+    def call(chat, send, *call_args, key=None):
+        if queue is None:
+            return direct(send, *call_args)
+        return queue.submit(chat, lambda: send(*call_args), key=key)
+
+    started = time.perf_counter()
+    message_id = await call(chat_id, api.send, chat_id, '⏳ Procesando...')
+    expected, text, pending = {}, '', []
+    for n in range(args.edits):
+        await asyncio.sleep(args.edit_interval)
+        if n and n % args.part_every == 0:
+            # Mensaje lleno: se cierra y la salida sigue en uno nuevo
+            expected[message_id] = text
+            await asyncio.gather(*pending)
+            pending.clear()
+            message_id, text = await call(chat_id, api.send, chat_id, f"parte {n}"), f"parte {n}"
+            continue
+        text += f" línea {n}"
+        pending.append(asyncio.create_task(
+            call(chat_id, api.edit, chat_id, message_id, text, key=('edit', message_id))
+        ))
+    expected[message_id] = text
+    await asyncio.gather(*pending)
+    return time.perf_counter() - started, expected
+
+
+async def run(mode: str, args) -> dict:
+    api = FakeBotAPI(args.latency, args.chat_rate, args.chat_burst, args.global_rate)
+    queue = None
+    if mode == 'cola':
+        queue = SendQueue(
+            global_rate=args.global_rate,
+            global_burst=max(1, int(args.global_rate)),
+            chat_limits=lambda chat_id: (args.chat_rate, args.chat_burst),
+            retry_delay=retry_delay,
+        )
+    started = time.perf_counter()
+    results = await asyncio.gather(*(live_reply(api, queue, chat, args) for chat in range(1, args.chats + 1)))
+    wall = time.perf_counter() - started
+    stale = sum(
+        any(api.shown.get((chat, message_id)) != text for message_id, text in expected.items())
+        for chat, (_, expected) in enumerate(results, start=1)
+    )
+    return {
+        'calls': api.calls,
+        'limited': api.limited,
+        'wall': wall,
+        'times': [elapsed for elapsed, _ in results],
+        'stale': stale,
+        'superseded': queue.superseded if queue else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chats', type=int, default=8, help='Chats respondiendo a la vez')
+    parser.add_argument('--edits', type=int, default=40, help='Actualizaciones de la salida por respuesta')
+    parser.add_argument('--edit-interval', type=float, default=0.1, help='Segundos entre actualizaciones')
+    parser.add_argument('--part-every', type=int, default=15, help='Actualizaciones por mensaje antes de abrir otro')
+    parser.add_argument('--latency', type=float, default=0.03, help='Segundos por llamada a la API')
+    parser.add_argument('--chat-rate', type=float, default=1.0, help='Envíos por segundo y chat que acepta la API')
+    parser.add_argument('--chat-burst', type=int, default=3, help='Ráfaga por chat que acepta la API')
+    parser.add_argument('--global-rate', type=float, default=30.0, help='Envíos por segundo en total')
+    args = parser.parse_args()
+
+    print(
+        f"{args.chats} chats · {args.edits} actualizaciones cada {args.edit_interval * 1e3:.0f} ms · "
+        f"límite {args.chat_rate:g}/s por chat (ráfaga {args.chat_burst}), {args.global_rate:g}/s global\n"
+    )
+    for mode in ('directo', 'cola'):
+        r = asyncio.run(run(mode, args))
+        print(
+            f"{mode:<8} · {r['calls']} llamadas ({r['limited']} con 429) · {r['wall']:.2f}s en total · "
+            f"{r['superseded']} ediciones sustituidas · {r['stale']} chats con un texto final incorrecto"
+        )
+        print(f"  respuesta completa visible  {format_percentiles(r['times'])}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""
+Latencia y precisión de los backends de transcripción sobre audios locales.
+
+Cada fixture es un audio (`.ogg`, `.oga`, `.wav`, `.mp3`, `.m4a`) con su
+transcripción de referencia en un `.txt` del mismo nombre (ver
+benchmarks/fixtures/voice/README.md). Para cada backend y fixture mide:
+
+- el tiempo hasta el primer segmento de texto (en el modelo local llega antes
+  de terminar el audio; en la API coincide con el total)
+- el tiempo total de transcripción
+- el WER (tasa de error por palabras) frente a la referencia
+- los bytes que se envían al backend
+
+Con `--preprocess` el audio pasa antes por `AudioPreprocessor` (16 kHz mono,
+sin silencios en los extremos, trozos de `--split` segundos transcritos en
+paralelo por `TranscriptionPool`), como en el bot con VOICE_PREPROCESS=true.
+
+Backends: `local` (faster-whisper en CPU, necesita `pip install faster-whisper`)
+y `openai` (API de Whisper, necesita OPENAI_API_KEY). El modelo local se carga
+una sola vez antes de medir, como en el bot.
+
+Uso:
+    python -m benchmarks.bench_stt --backend local --model base
+    python -m benchmarks.bench_stt --backend local,openai --fixtures ~/notas --repeat 3
+    python -m benchmarks.bench_stt --backend openai --preprocess --split 30 --workers 4
+"""
+
+import argparse
+import asyncio
+import os
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from benchmarks.bench_channels import format_percentiles
+from channels.common.audio_preprocess import AudioPreprocessor, PreprocessError
+from channels.common.transcription import (
+    LocalWhisperBackend, OpenAIWhisperBackend, TranscriptionBackend, TranscriptionError, TranscriptionPool
+)
+
+DEFAULT_FIXTURES = Path(__file__).resolve().parent / 'fixtures' / 'voice'
+AUDIO_SUFFIXES = ('.ogg', '.oga', '.wav', '.mp3', '.m4a')
+
+
+def load_fixtures(directory: Path) -> list[tuple[Path, str]]:
+    """Pares (audio, referencia) del directorio, ordenados por nombre."""
+    fixtures = []
+    for audio in sorted(directory.iterdir()):
+        reference = audio.with_suffix('.txt')
+        if audio.suffix.lower() in AUDIO_SUFFIXES and reference.exists():
+            fixtures.append((audio, reference.read_text(encoding='utf-8').strip()))
+    return fixtures
+
+
+def words(text: str) -> list[str]:
+    return re.findall(r'\w+', text.casefold())
+
+
+def word_error_rate(reference: str, hypothesis: str) -> float:
+    """Distancia de edición por palabras dividida por las palabras de la referencia."""
+    ref, hyp = words(reference), words(hypothesis)
+    if not ref:
+        return 0.0 if not hyp else 1.0
+    previous = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        current = [i]
+        for j, h in enumerate(hyp, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (r != h)))
+        previous = current
+    return previous[-1] / len(ref)
+
+
+def build_backend(name: str, args) -> TranscriptionBackend:
+    if name == 'local':
+        return LocalWhisperBackend(args.model, compute_type=args.compute_type, cpu_threads=args.threads)
+    if name == 'openai':
+        return OpenAIWhisperBackend(os.getenv('OPENAI_API_KEY', '').strip())
+    raise ValueError(f"Backend desconocido: {name}")
+
+
+def measure(backend: TranscriptionBackend, audio: bytes, filename: str, language) -> tuple[float, float, str, int]:
+    """Devuelve (primer segmento, total, texto, bytes enviados)."""
+    started = time.monotonic()
+    first = None
+    parts = []
+    for text in backend.transcribe_segments(audio, filename, language):
+        if first is None:
+            first = time.monotonic() - started
+        parts.append(text)
+    total = time.monotonic() - started
+    return (first if first is not None else total), total, ' '.join(parts), len(audio)
+
+
+def measure_pool(pool: TranscriptionPool, audio: bytes, filename: str, language) -> tuple[float, float, str, int]:
+    """Como `measure`, pero preprocesando y transcribiendo los trozos en paralelo."""
+    sent_before = pool.preprocessor.bytes_out
+    started = time.monotonic()
+    first = []
+
+    def on_partial(text: str):
+        if not first:
+            first.append(time.monotonic() - started)
+
+    text = asyncio.run(pool.transcribe(audio, filename, language, on_partial=on_partial))
+    total = time.monotonic() - started
+    return (first[0] if first else total), total, text, pool.preprocessor.bytes_out - sent_before
+
+
+def run_backend(name: str, fixtures: list, args):
+    print(f"\n== {name} ==")
+    try:
+        started = time.monotonic()
+        backend = build_backend(name, args)
+    except TranscriptionError as e:
+        print(f"No disponible: {e}")
+        return
+    print(f"Backend: {backend.describe()} (carga {time.monotonic() - started:.1f}s)")
+
+    pool = None
+    if args.preprocess:
+        try:
+            preprocessor = AudioPreprocessor(max_chunk_seconds=args.split)
+        except PreprocessError as e:
+            print(f"Sin preprocesado: {e}")
+            return
+        pool = TranscriptionPool(backend, max_workers=args.workers, timeout=3600, preprocessor=preprocessor)
+
+    firsts, totals, errors = [], [], []
+    for path, reference in fixtures:
+        audio = path.read_bytes()
+        for _ in range(args.repeat):
+            if pool is not None:
+                first, total, text, sent = measure_pool(pool, audio, path.name, args.language or None)
+            else:
+                first, total, text, sent = measure(backend, audio, path.name, args.language or None)
+            firsts.append(first)
+            totals.append(total)
+        wer = word_error_rate(reference, text)
+        errors.append(wer)
+        print(f"  {path.name:<32} {len(audio) / 1024:7.0f} KB → {sent / 1024:7.0f} KB · "
+              f"primer texto {first:6.2f}s · total {total:6.2f}s · WER {wer:.1%}")
+
+    print(f"Primer texto: {format_percentiles(firsts)}")
+    print(f"Total:        {format_percentiles(totals)}")
+    print(f"WER medio:    {sum(errors) / len(errors):.1%}")
+    if pool is not None:
+        print(f"Preprocesado: {pool.preprocessor.format_stats()}")
+        pool.shutdown()
+    else:
+        backend.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backend', default='local', help='Backends separados por comas: local, openai')
+    parser.add_argument('--fixtures', type=Path, default=DEFAULT_FIXTURES, help='Directorio con audios y .txt')
+    parser.add_argument('--language', default='es', help='Idioma (vacío = detección automática)')
+    parser.add_argument('--repeat', type=int, default=1, help='Transcripciones por fixture')
+    parser.add_argument('--preprocess', action='store_true', help='Preprocesar con ffmpeg y trocear')
+    parser.add_argument('--split', type=float, default=60, help='Segundos máximos por trozo (--preprocess)')
+    parser.add_argument('--workers', type=int, default=2, help='Trozos en paralelo (--preprocess)')
+    local = parser.add_argument_group('modelo local')
+    local.add_argument('--model', default='base', help='tiny, base, small... o ruta a un modelo')
+    local.add_argument('--compute-type', default='int8')
+    local.add_argument('--threads', type=int, default=0, help='Hilos de CTranslate2 (0 = automático)')
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixtures.expanduser())
+    if not fixtures:
+        print(f"No hay fixtures en {args.fixtures} (audio + .txt con el mismo nombre)")
+        sys.exit(1)
+    print(f"{len(fixtures)} fixtures en {args.fixtures}")
+
+    for name in [b.strip() for b in args.backend.split(',') if b.strip()]:
+        run_backend(name, fixtures, args)
+
+
+if __name__ == '__main__':
+    main()
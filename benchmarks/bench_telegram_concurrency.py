@@ -0,0 +1,138 @@
+"""
+Bloqueo en cabeza de línea del bot de Telegram con varios usuarios a la vez.
+
+Arranca el bot real contra la Bot API falsa de `bench_telegram_modes` (modo
+polling) y con el CLI falso configurado para tardar `--heavy-seconds` por
+ejecución. Mientras unos usuarios tienen informes largos en marcha:
+
+- otros usuarios envían `/status` y un mensaje de texto, y se mide cuánto
+  tardan en recibir la primera respuesta
+- un usuario envía varios mensajes seguidos y se comprueba que sus respuestas
+  llegan en el mismo orden
+
+Se repite para cada valor de `--concurrency` (TELEGRAM_CONCURRENT_UPDATES):
+con 1 los updates se procesan de uno en uno, como antes.
+
+Necesita python-telegram-bot instalado.
+
+Uso:
+    python -m benchmarks.bench_telegram_concurrency --concurrency 1,64 --heavy-seconds 10
+"""
+
+import argparse
+import re
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from benchmarks.bench_channels import format_percentiles
+from benchmarks.bench_telegram_modes import FakeTelegramAPI, make_update, start_bot
+
+
+def run(concurrency: int, args):
+    api = FakeTelegramAPI()
+    heavy = [200000 + i for i in range(args.heavy_users)]
+    light = [300000 + i for i in range(args.light_users)]
+    ordered = 400000
+    lines = max(1, int(args.heavy_seconds * 10))
+    bot = start_bot('polling', api, args, heavy + light + [ordered], extra_env={
+        'TELEGRAM_CONCURRENT_UPDATES': str(concurrency),
+        'JOB_QUEUE_MODE': 'serialize',
+        'FAKE_CLAUDE_LINES': str(lines),
+        'FAKE_CLAUDE_RATE': '10',
+    })
+    ids = iter(range(1000, 10 ** 9))
+    ids_lock = threading.Lock()
+
+    def send(user_id: int, text: str) -> float:
+        with ids_lock:
+            update = make_update(next(ids), user_id, text)
+        sent = time.perf_counter()
+        api.enqueue(update)
+        return sent
+
+    try:
+        if not api.polling.wait(timeout=args.boot_timeout):
+            print(f"concurrencia {concurrency} · el bot no arrancó (¿python-telegram-bot instalado?)")
+            return
+        time.sleep(args.warmup)
+
+        # Informes largos en marcha
+        for user_id in heavy:
+            send(user_id, 'informe largo')
+        time.sleep(0.5)
+
+        latencies, lost = [], 0
+        lock = threading.Lock()
+
+        def light_user(user_id: int):
+            nonlocal lost
+            for text in ('/status', '¿qué hay en el sprint?'):
+                before = api.reply_count(user_id)
+                sent = send(user_id, text)
+                first, _ = api.wait_reply(user_id, before, args.heavy_seconds * 3 + 30)
+                with lock:
+                    if first is None:
+                        lost += 1
+                    else:
+                        latencies.append(first - sent)
+
+        threads = [threading.Thread(target=light_user, args=(u,)) for u in light]
+        for n in range(1, args.ordered + 1):
+            send(ordered, f'orden {n}')
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Orden de las respuestas del usuario que envió varios mensajes seguidos
+        deadline = time.monotonic() + args.heavy_seconds * (args.ordered + 2) + 30
+        seen: list[int] = []
+        while time.monotonic() < deadline:
+            seen = []
+            for text in api.texts(ordered):
+                for n in re.findall(r'«orden (\d+)»', text):
+                    if int(n) not in seen:
+                        seen.append(int(n))
+            if len(seen) >= args.ordered:
+                break
+            time.sleep(0.2)
+        in_order = seen == sorted(seen) and len(seen) == args.ordered
+
+        print(f"concurrencia {concurrency:<3} · {len(heavy)} informes de {args.heavy_seconds:.0f}s en marcha")
+        print(f"  otros usuarios → primera respuesta  {format_percentiles(latencies)}"
+              + (f" · máx {max(latencies):.3f}s" if latencies else "") + f" ({lost} sin respuesta)")
+        print(f"  mensajes seguidos de un usuario     {'en orden' if in_order else 'DESORDENADOS'} {seen}")
+    finally:
+        bot.terminate()
+        try:
+            bot.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            bot.kill()
+        api.server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', default='1,64', help='Valores de TELEGRAM_CONCURRENT_UPDATES separados por comas')
+    parser.add_argument('--heavy-users', type=int, default=2, help='Usuarios con un informe largo en marcha')
+    parser.add_argument('--heavy-seconds', type=float, default=10, help='Duración de cada ejecución del CLI falso')
+    parser.add_argument('--light-users', type=int, default=4, help='Usuarios que envían /status y un texto')
+    parser.add_argument('--ordered', type=int, default=3, help='Mensajes seguidos del usuario de orden')
+    parser.add_argument('--pool', type=int, default=2, help='WORKER_POOL_SIZE del bot')
+    parser.add_argument('--startup', type=float, default=0.2, help='Segundos de arranque del CLI falso')
+    parser.add_argument('--lines', type=int, default=3, help=argparse.SUPPRESS)
+    parser.add_argument('--warmup', type=float, default=1.0)
+    parser.add_argument('--boot-timeout', type=float, default=30)
+    parser.add_argument('--verbose', action='store_true', help='Mostrar los logs del bot')
+    args = parser.parse_args()
+
+    for value in args.concurrency.split(','):
+        run(int(value), args)
+
+
+if __name__ == '__main__':
+    main()
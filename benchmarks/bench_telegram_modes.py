@@ -0,0 +1,314 @@
+"""
+Latencia de extremo a extremo del bot de Telegram en modo polling y webhook.
+
+Arranca el bot real (`channels/telegram/bot.py`) en un subproceso contra una
+Bot API falsa en localhost (`TELEGRAM_API_URL`) y con el CLI falso. Para cada
+update mide el tiempo desde que "Telegram" lo entrega hasta que el bot envía
+su primera respuesta (el "⏳ Procesando..."):
+
+- `polling`: el update se encola en la API falsa y el bot lo recoge con su
+  `getUpdates` (long polling, como con Telegram)
+- `webhook`: el arnés hace POST del update al servidor embebido del bot con
+  la cabecera `X-Telegram-Bot-Api-Secret-Token`; además comprueba que un POST
+  sin el secreto se rechaza
+
+Necesita python-telegram-bot[webhooks] instalado.
+
+Uso:
+    python -m benchmarks.bench_telegram_modes --mode both --users 4 --requests 10
+"""
+
+import argparse
+import json
+import os
+import secrets
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Optional
+from urllib.parse import parse_qs
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from benchmarks.bench_channels import FAKE_CLAUDE, ROOT, format_percentiles, free_port
+
+BOT_TOKEN = '123456:bench'
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'Claudio', 'username': 'claudio_bench_bot'}
+
+
+class FakeTelegramAPI:
+    """Bot API mínima: getUpdates con long polling, webhooks y registro de respuestas."""
+
+    def __init__(self):
+        self.updates: list[dict] = []
+        self.webhook: dict = {}
+        self.polling = threading.Event()
+        self.webhook_set = threading.Event()
+        self._cond = threading.Condition()
+        self._replies: dict[int, list] = {}
+        self._message_id = 0
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length).decode('utf-8') if length else ''
+                if 'json' in (self.headers.get('Content-Type') or ''):
+                    params = json.loads(raw or '{}')
+                else:
+                    params = {k: v[0] for k, v in parse_qs(raw).items()}
+                result = api.handle(self.path.rsplit('/', 1)[-1], params)
+                body = json.dumps({'ok': True, 'result': result}).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', free_port()), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}/"
+
+    def handle(self, method: str, params: dict):
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'getUpdates':
+            self.polling.set()
+            return self._get_updates(int(params.get('offset') or 0), float(params.get('timeout') or 0))
+        if method == 'setWebhook':
+            self.webhook = params
+            self.webhook_set.set()
+            return True
+        if method in ('sendMessage', 'editMessageText'):
+            chat_id = int(params['chat_id'])
+            with self._cond:
+                self._replies.setdefault(chat_id, []).append((time.perf_counter(), params.get('text', '')))
+                self._message_id += 1
+                message_id = int(params.get('message_id') or self._message_id)
+                self._cond.notify_all()
+            return {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'from': BOT_USER,
+                'text': params.get('text', ''),
+            }
+        return True
+
+    def _get_updates(self, offset: int, timeout: float) -> list:
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                pending = [u for u in self.updates if u['update_id'] >= offset]
+                remaining = deadline - time.monotonic()
+                if pending or remaining <= 0:
+                    return pending
+                self._cond.wait(remaining)
+
+    def enqueue(self, update: dict):
+        """Entrega un update por getUpdates (modo polling)."""
+        with self._cond:
+            self.updates.append(update)
+            self._cond.notify_all()
+
+    def wait_reply(self, chat_id: int, after: int, timeout: float, final: bool = False):
+        """Espera la respuesta número `after` (o la primera sin "⏳" con `final`) y devuelve su instante."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                replies = self._replies.get(chat_id, [])[after:]
+                for at, text in replies:
+                    if not final or not text.startswith('⏳'):
+                        return at, len(self._replies[chat_id])
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None, len(self._replies.get(chat_id, []))
+                self._cond.wait(remaining)
+
+    def reply_count(self, chat_id: int) -> int:
+        with self._cond:
+            return len(self._replies.get(chat_id, []))
+
+    def texts(self, chat_id: int) -> list[str]:
+        """Textos enviados y editados en el chat, en orden."""
+        with self._cond:
+            return [text for _, text in self._replies.get(chat_id, [])]
+
+
+def make_update(update_id: int, user_id: int, text: str) -> dict:
+    user = {'id': user_id, 'is_bot': False, 'first_name': 'Bench', 'username': f'bench{user_id}'}
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private', 'first_name': 'Bench'},
+            'from': user,
+            'text': text,
+        },
+    }
+
+
+def post_update(url: str, update: dict, secret: str) -> int:
+    """POST de un update al webhook del bot; devuelve el código HTTP (0 si no hay conexión)."""
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(update).encode('utf-8'),
+        headers={'Content-Type': 'application/json', 'X-Telegram-Bot-Api-Secret-Token': secret},
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except (urllib.error.URLError, OSError):
+        return 0
+
+
+def start_bot(
+    mode: str,
+    api: FakeTelegramAPI,
+    args,
+    users: list[int],
+    port: int = 0,
+    secret: str = '',
+    extra_env: Optional[dict] = None,
+) -> subprocess.Popen:
+    """Arranca el bot real contra la API falsa; `extra_env` sobrescribe la configuración."""
+    state_dir = tempfile.mkdtemp(prefix='claudio-bench-tg-')
+    env = dict(os.environ)
+    env.update({
+        'TELEGRAM_BOT_TOKEN': BOT_TOKEN,
+        'TELEGRAM_API_URL': api.url,
+        'TELEGRAM_MODE': mode,
+        'TELEGRAM_WEBHOOK_URL': f"http://127.0.0.1:{port}",
+        'TELEGRAM_WEBHOOK_LISTEN': '127.0.0.1',
+        'TELEGRAM_WEBHOOK_PORT': str(port),
+        'TELEGRAM_WEBHOOK_PATH': 'telegram',
+        'TELEGRAM_WEBHOOK_SECRET': secret,
+        'ALLOWED_USER_IDS': ','.join(str(u) for u in users),
+        'CLAUDE_CLI_PATH': str(FAKE_CLAUDE),
+        'WORKSPACE_PATH': str(ROOT),
+        'WORKER_POOL_SIZE': str(args.pool),
+        'ADMISSION_STATE_DIR': state_dir,
+        'SESSIONS_PATH': '',
+        'RATE_LIMIT_REQUESTS': '1000000',
+        'METRICS_PORT': '0',
+        'TELEGRAM_SEND_RATE': '0',
+        'TELEGRAM_CHAT_SEND_RATE': '0',
+        'FAKE_CLAUDE_STARTUP': str(args.startup),
+        'FAKE_CLAUDE_LINES': str(args.lines),
+        'FAKE_CLAUDE_RATE': '0',
+        # Lock file propio para no chocar con un bot real en la misma máquina
+        'TMPDIR': state_dir,
+    })
+    env.update(extra_env or {})
+    return subprocess.Popen(
+        [sys.executable, str(ROOT / 'channels' / 'telegram' / 'bot.py')],
+        cwd=state_dir,
+        env=env,
+        stdout=None if args.verbose else subprocess.DEVNULL,
+        stderr=None if args.verbose else subprocess.DEVNULL,
+    )
+
+
+def run_mode(mode: str, args):
+    api = FakeTelegramAPI()
+    users = [100000 + i for i in range(args.users)]
+    port = free_port()
+    secret = secrets.token_urlsafe(16)
+    webhook_url = f"http://127.0.0.1:{port}/telegram"
+    bot = start_bot(mode, api, args, users, port, secret)
+
+    try:
+        ready = api.polling if mode == 'polling' else api.webhook_set
+        if not ready.wait(timeout=args.boot_timeout):
+            print(f"{mode:<8} · el bot no arrancó en {args.boot_timeout:.0f}s (¿python-telegram-bot[webhooks] instalado?)")
+            return
+        if mode == 'webhook':
+            # setWebhook llega antes de que el servidor escuche: esperar a que acepte conexiones
+            deadline = time.monotonic() + args.boot_timeout
+            while post_update(webhook_url, {}, 'secreto-incorrecto') not in (401, 403) and time.monotonic() < deadline:
+                time.sleep(0.1)
+            rejected = post_update(webhook_url, make_update(1, users[0], 'intruso'), 'secreto-incorrecto')
+            print(f"{mode:<8} · POST sin el secreto correcto → HTTP {rejected}")
+        time.sleep(args.warmup)
+
+        samples, lost = [], 0
+        lock = threading.Lock()
+        ids = iter(range(1000, 10 ** 9))
+
+        def user(user_id: int):
+            nonlocal lost
+            for _ in range(args.requests):
+                with lock:
+                    update = make_update(next(ids), user_id, args.prompt)
+                before = api.reply_count(user_id)
+                sent = time.perf_counter()
+                if mode == 'webhook':
+                    post_update(webhook_url, update, secret)
+                else:
+                    api.enqueue(update)
+                first, _ = api.wait_reply(user_id, before, args.timeout)
+                # Esperar a que acabe la ejecución para no medir la cola del propio usuario
+                api.wait_reply(user_id, before + 1, args.timeout, final=True)
+                with lock:
+                    if first is None:
+                        lost += 1
+                    else:
+                        samples.append(first - sent)
+
+        threads = [threading.Thread(target=user, args=(u,)) for u in users]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+
+        print(f"{mode:<8} · {len(samples)} updates en {wall:.2f}s ({lost} sin respuesta)")
+        print(f"  update → primera respuesta  {format_percentiles(samples)}")
+    finally:
+        bot.terminate()
+        try:
+            bot.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            bot.kill()
+        api.server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=['polling', 'webhook', 'both'], default='both')
+    parser.add_argument('--users', type=int, default=4, help='Usuarios simulados en paralelo')
+    parser.add_argument('--requests', type=int, default=10, help='Mensajes por usuario')
+    parser.add_argument('--prompt', default='¿qué hay en el sprint actual?')
+    parser.add_argument('--pool', type=int, default=2, help='WORKER_POOL_SIZE del bot')
+    parser.add_argument('--startup', type=float, default=0.2, help='Segundos de arranque del CLI falso')
+    parser.add_argument('--lines', type=int, default=3, help='Líneas de respuesta del CLI falso')
+    parser.add_argument('--warmup', type=float, default=1.0, help='Segundos de espera tras arrancar el bot')
+    parser.add_argument('--boot-timeout', type=float, default=30)
+    parser.add_argument('--timeout', type=float, default=60, help='Espera máxima por respuesta')
+    parser.add_argument('--verbose', action='store_true', help='Mostrar los logs del bot')
+    args = parser.parse_args()
+
+    for mode in (['polling', 'webhook'] if args.mode == 'both' else [args.mode]):
+        run_mode(mode, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+Llamadas a Slack y tiempo para montar el contexto de un hilo largo.
+
+Simula un hilo que crece turno a turno (un mensaje del usuario y la respuesta
+del bot) contra un `conversations.replies` falso con las reglas de Slack
+(padre siempre primero, `oldest` exclusivo, páginas de `limit` mensajes con
+`next_cursor`) y una latencia por llamada. En cada turno se monta el contexto:
+
+- `anterior`: lo que hacía `fetch_thread_context` (una llamada con
+  `limit=50`, sin paginar, formateando todo el hilo cada vez); en hilos de
+  más de 50 mensajes el contexto se queda con los 50 primeros
+- `incremental`: `ThreadContextCache` (channels/common/thread_context.py),
+  que solo pide las respuestas posteriores al último mensaje visto
+
+Con `--history` el hilo ya tiene mensajes antes del primer turno (p.ej. tras
+reiniciar el bot): la primera descarga incremental pagina todo el hilo.
+
+Informa de llamadas, mensajes descargados, tiempo por turno y turnos en los
+que al contexto le faltaban los mensajes más recientes.
+
+Uso:
+    python -m benchmarks.bench_thread_context --turns 100 --history 300 --latency 0.05
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from channels.common.thread_context import ThreadContextCache, ts_key
+
+
+class FakeReplies:
+    """`conversations.replies` de un único hilo en memoria."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.thread_ts = '1700000000.000000'
+        self.messages = [{'ts': self.thread_ts, 'user': 'U1', 'text': 'Hilo de prueba'}]
+        self.calls = 0
+        self.transferred = 0
+
+    def post(self, text: str, bot: bool = False):
+        ts = f"{1700000000 + len(self.messages)}.000000"
+        message = {'ts': ts, 'text': text, **({'bot_id': 'B1'} if bot else {'user': 'U1'})}
+        self.messages.append(message)
+        return ts
+
+    async def conversations_replies(self, channel, ts, oldest=None, cursor=None, limit=100, **kwargs):
+        await asyncio.sleep(self.latency)
+        self.calls += 1
+        replies = [m for m in self.messages[1:] if oldest is None or ts_key(m['ts']) > ts_key(oldest)]
+        start = int(cursor or 0)
+        page = replies[start:start + limit]
+        messages = ([self.messages[0]] if start == 0 else []) + page
+        self.transferred += len(messages)
+        more = start + limit < len(replies)
+        return {'messages': messages, 'response_metadata': {'next_cursor': str(start + limit) if more else ''}}
+
+
+def format_message(message: dict):
+    sender = 'Claudio' if message.get('bot_id') else f"Usuario <@{message.get('user')}>"
+    return f"{sender}: {message['text']}" if message.get('text') else None
+
+
+async def legacy_context(api: FakeReplies, current_ts: str) -> list:
+    result = await api.conversations_replies('C1', api.thread_ts, limit=50)
+    return [format_message(m) for m in result['messages'] if m['ts'] != current_ts]
+
+
+async def cached_context(api: FakeReplies, cache: ThreadContextCache, current_ts: str) -> list:
+    messages = await cache.refresh(api, 'C1', api.thread_ts, format_message)
+    return [text for ts, text in messages if ts != current_ts]
+
+
+async def run(mode: str, args) -> dict:
+    api = FakeReplies(args.latency)
+    cache = ThreadContextCache(page_size=args.page_size)
+    times, stale = [], 0
+    for n in range(args.history):
+        api.post(f"historial {n}", bot=n % 2 == 1)
+    for turn in range(args.turns):
+        current = api.post(f"pregunta {turn} " + 'x' * args.message_length)
+        started = time.perf_counter()
+        if mode == 'anterior':
+            context = await legacy_context(api, current)
+        else:
+            context = await cached_context(api, cache, current)
+        times.append(time.perf_counter() - started)
+        # La respuesta anterior del bot es lo más importante del contexto
+        if turn and not context[-1].startswith(f"Claudio: respuesta {turn - 1} "):
+            stale += 1
+        api.post(f"respuesta {turn} " + 'y' * args.message_length, bot=True)
+    return {
+        'calls': api.calls,
+        'transferred': api.transferred,
+        'avg_ms': sum(times) / len(times) * 1e3,
+        'last_ms': times[-1] * 1e3,
+        'stale': stale,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--turns', type=int, default=100, help='Turnos (pregunta + respuesta) del hilo')
+    parser.add_argument('--latency', type=float, default=0.05, help='Segundos por llamada a la API')
+    parser.add_argument('--history', type=int, default=300, help='Mensajes del hilo antes del primer turno')
+    parser.add_argument('--page-size', type=int, default=200, help='limit de cada llamada (incremental)')
+    parser.add_argument('--message-length', type=int, default=200, help='Caracteres por mensaje')
+    args = parser.parse_args()
+
+    total = args.history + 2 * args.turns + 1
+    print(f"Hilo de {total} mensajes ({args.turns} turnos) · {args.latency * 1e3:.0f} ms por llamada\n")
+    print(f"{'':<12} {'llamadas':>9} {'mensajes':>9} {'media/turno':>12} {'último':>10} {'sin lo último':>14}")
+    for mode in ('anterior', 'incremental'):
+        r = asyncio.run(run(mode, args))
+        print(
+            f"{mode:<12} {r['calls']:9d} {r['transferred']:9d} {r['avg_ms']:9.1f} ms "
+            f"{r['last_ms']:7.1f} ms {r['stale']:14d}"
+        )
+
+
+if __name__ == '__main__':
+    main()
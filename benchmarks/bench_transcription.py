@@ -0,0 +1,109 @@
+"""
+Notas de voz transcribiéndose vs mensajes de texto de otros usuarios.
+
+Simula el event loop del bot: varias notas de voz se transcriben mientras otros
+usuarios envían mensajes de texto a ritmo constante. La transcripción usa un
+backend local que bloquea como la API de Whisper (`time.sleep`), de dos formas:
+
+- `inline`: la llamada bloqueante dentro del handler async (como antes)
+- `pool`: `TranscriptionPool` con un pool acotado de hilos
+
+Para los mensajes de texto informa de la latencia de respuesta (p50/p95/p99 y
+máximo) y de cuántos se atendieron mientras había audios en curso.
+
+Uso:
+    python -m benchmarks.bench_transcription --voices 4 --seconds 2 --workers 2
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+from typing import Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from benchmarks.bench_channels import format_percentiles
+from channels.common.transcription import TranscriptionBackend, TranscriptionPool
+
+
+class SleepBackend(TranscriptionBackend):
+    """Backend local: tarda `seconds` bloqueando el hilo y devuelve un texto fijo."""
+
+    name = 'sleep'
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+
+    def transcribe(self, audio: bytes, filename: str = 'voice.ogg', language: Optional[str] = None) -> str:
+        time.sleep(self.seconds)
+        return f"transcripción de {len(audio)} bytes"
+
+
+async def run(mode: str, args) -> dict:
+    backend = SleepBackend(args.seconds)
+    pool = TranscriptionPool(backend, max_workers=args.workers, timeout=args.seconds * args.voices + 10)
+    audio = b'\0' * 16000
+
+    async def handle_voice():
+        if mode == 'inline':
+            return backend.transcribe(audio)
+        return await pool.transcribe(audio)
+
+    latencies = []
+    voices_done = asyncio.Event()
+
+    async def handle_text():
+        # Un handler de texto trivial: lo que mide es cuánto tarda el loop en atenderlo
+        await asyncio.sleep(0)
+
+    async def text_traffic():
+        while not voices_done.is_set():
+            sent = time.monotonic()
+            await asyncio.create_task(handle_text())
+            latencies.append(time.monotonic() - sent)
+            await asyncio.sleep(args.interval)
+
+    started = time.monotonic()
+    traffic = asyncio.create_task(text_traffic())
+    await asyncio.sleep(0)
+    voices = await asyncio.gather(*(handle_voice() for _ in range(args.voices)))
+    voice_wall = time.monotonic() - started
+    voices_done.set()
+    await traffic
+    pool.shutdown()
+
+    return {
+        'mode': mode,
+        'voices': len(voices),
+        'voice_wall': voice_wall,
+        'texts': len(latencies),
+        'latencies': latencies,
+    }
+
+
+def report(result: dict, args):
+    latencies = result['latencies']
+    expected = int(result['voice_wall'] / args.interval)
+    print(f"\n== {result['mode']} ==")
+    print(f"Notas de voz:   {result['voices']} en {result['voice_wall']:.2f}s")
+    print(f"Textos:         {result['texts']} atendidos (≈{expected} esperados sin bloqueo)")
+    print(f"Latencia texto: {format_percentiles(latencies)} · máx {max(latencies):.3f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=['inline', 'pool', 'both'], default='both')
+    parser.add_argument('--voices', type=int, default=4, help='Notas de voz simultáneas')
+    parser.add_argument('--seconds', type=float, default=2.0, help='Segundos por transcripción')
+    parser.add_argument('--workers', type=int, default=2, help='Hilos del pool de transcripción')
+    parser.add_argument('--interval', type=float, default=0.05, help='Segundos entre mensajes de texto')
+    args = parser.parse_args()
+
+    modes = ['inline', 'pool'] if args.mode == 'both' else [args.mode]
+    for mode in modes:
+        report(asyncio.run(run(mode, args)), args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Time-to-first-byte del Claude CLI con y sin pool de workers pre-arrancados.
+
+Lanza N prompts secuenciales contra `CLAUDE_CLI_PATH` primero en frío
+(pool de tamaño 0) y después con el pool, y compara el TTFB medio.
+
+Uso:
+    python -m benchmarks.bench_worker_pool --runs 5 --prompt "di hola"
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from channels.common.worker_pool import ClaudeWorkerPool
+
+
+def measure(pool: ClaudeWorkerPool, runs: int, prompt: str, warmup_wait: float) -> list:
+    ttfbs = []
+    for _ in range(runs):
+        # Dar tiempo al pool para reponer el worker consumido
+        time.sleep(warmup_wait)
+        worker = pool.acquire()
+        worker.run(prompt, timeout=600)
+        pool.release(worker)
+        if worker.ttfb is not None:
+            ttfbs.append(worker.ttfb)
+    return ttfbs
+
+
+def report(label: str, ttfbs: list):
+    if not ttfbs:
+        print(f"{label:>8}: sin datos")
+        return
+    print(
+        f"{label:>8}: media {statistics.mean(ttfbs):.3f}s · "
+        f"mín {min(ttfbs):.3f}s · máx {max(ttfbs):.3f}s (n={len(ttfbs)})"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cli', default=os.getenv('CLAUDE_CLI_PATH', 'claude'))
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--size', type=int, default=2, help='Tamaño del pool en la pasada con pool')
+    parser.add_argument('--prompt', default='Responde solo: ok')
+    parser.add_argument('--warmup-wait', type=float, default=3.0,
+                        help='Segundos entre prompts para que el pool se reponga')
+    args = parser.parse_args()
+
+    base_args = [args.cli, '--dangerously-skip-permissions', '-p']
+    cwd = os.getenv('WORKSPACE_PATH', os.getcwd())
+
+    cold_pool = ClaudeWorkerPool(base_args, cwd=cwd, size=0)
+    cold = measure(cold_pool, args.runs, args.prompt, warmup_wait=0)
+
+    warm_pool = ClaudeWorkerPool(base_args, cwd=cwd, size=args.size)
+    warm_pool.start()
+    try:
+        warm = measure(warm_pool, args.runs, args.prompt, warmup_wait=args.warmup_wait)
+    finally:
+        warm_pool.shutdown()
+
+    print(f"TTFB de {args.cli} ({args.runs} prompts)")
+    report('sin pool', cold)
+    report('con pool', warm)
+    if cold and warm:
+        print(f"  ahorro medio: {statistics.mean(cold) - statistics.mean(warm):.3f}s")
+
+
+if __name__ == '__main__':
+    main()
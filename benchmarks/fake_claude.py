@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Sustituto del Claude CLI para benchmarks (`CLAUDE_CLI_PATH=benchmarks/fake_claude.py`).
+
+Acepta los mismos argumentos que usan los canales (`-p`, `--resume`, `--session-id`,
+`--dangerously-skip-permissions`, `--allowedTools`, `--output-format
+stream-json`...), lee el prompt de stdin como el CLI real y genera una salida
+sintética configurable por variables de entorno:
+
+- FAKE_CLAUDE_STARTUP: segundos de arranque antes de leer stdin (def. 0.5);
+  con el pool de workers este tiempo queda oculto, como con el CLI real
+- FAKE_CLAUDE_LINES: líneas de respuesta (def. 20)
+- FAKE_CLAUDE_LINE_LENGTH: caracteres por línea (def. 80)
+- FAKE_CLAUDE_RATE: líneas por segundo (def. 50; 0 = sin pausa)
+- FAKE_CLAUDE_STDERR_LINES: líneas de ruido en stderr (def. 0)
+- FAKE_CLAUDE_EXIT_CODE: código de salida (def. 0)
+
+Con `--output-format stream-json` escribe NDJSON con el mismo esquema que el
+CLI (init, deltas de texto, resultado y uso de tokens). `--version` responde
+al momento, como el `/status` de los bots espera.
+"""
+
+import json
+import os
+import sys
+import time
+import uuid
+
+
+def env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, default))
+
+
+def main() -> int:
+    args = sys.argv[1:]
+    if '--version' in args:
+        print("0.0.0 (fake-claude)")
+        return 0
+    startup = env_float('FAKE_CLAUDE_STARTUP', 0.5)
+    lines = int(env_float('FAKE_CLAUDE_LINES', 20))
+    line_length = int(env_float('FAKE_CLAUDE_LINE_LENGTH', 80))
+    rate = env_float('FAKE_CLAUDE_RATE', 50)
+    stderr_lines = int(env_float('FAKE_CLAUDE_STDERR_LINES', 0))
+    exit_code = int(env_float('FAKE_CLAUDE_EXIT_CODE', 0))
+    stream_json = 'stream-json' in args
+
+    time.sleep(startup)
+    prompt = sys.stdin.read()
+    started = time.monotonic()
+    session_id = str(uuid.uuid4())
+    # Como el CLI: --session-id fija el id de la sesión nueva y --resume retoma la indicada
+    for flag in ('--session-id', '--resume'):
+        if flag in args[:-1]:
+            session_id = args[args.index(flag) + 1]
+    out = sys.stdout
+
+    def emit(message: dict):
+        out.write(json.dumps(message, ensure_ascii=False) + '\n')
+        out.flush()
+
+    if stream_json:
+        emit({'type': 'system', 'subtype': 'init', 'session_id': session_id, 'tools': [], 'mcp_servers': []})
+
+    # Texto con caracteres multibyte para ejercitar el decoder UTF-8
+    unit = f"respuesta a «{prompt.strip()[:20]}» · "
+    body = (unit * (line_length // max(len(unit), 1) + 1))[:line_length]
+    text = []
+    for i in range(lines):
+        line = f"{i:05d} {body}"[:line_length]
+        text.append(line)
+        if stream_json:
+            emit({
+                'type': 'stream_event',
+                'session_id': session_id,
+                'event': {'type': 'content_block_delta', 'index': 0,
+                          'delta': {'type': 'text_delta', 'text': line + '\n'}},
+            })
+        else:
+            out.write(line + '\n')
+            out.flush()
+        if i < stderr_lines:
+            sys.stderr.write(f"[fake-claude] aviso {i}\n")
+            sys.stderr.flush()
+        if rate > 0:
+            time.sleep(1 / rate)
+
+    for i in range(lines, stderr_lines):
+        sys.stderr.write(f"[fake-claude] aviso {i}\n")
+    sys.stderr.flush()
+
+    if stream_json:
+        emit({
+            'type': 'result',
+            'subtype': 'success' if exit_code == 0 else 'error_during_execution',
+            'is_error': exit_code != 0,
+            'result': '\n'.join(text),
+            'session_id': session_id,
+            'duration_ms': int((time.monotonic() - started) * 1000),
+            'num_turns': 1,
+            'total_cost_usd': 0.0,
+            'usage': {'input_tokens': len(prompt.split()), 'output_tokens': lines * line_length // 4},
+        })
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
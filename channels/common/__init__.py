@@ -0,0 +1,6 @@
+"""
+Módulos compartidos entre los canales de Claudio (Telegram, Slack y Web).
+
+Cada canal sigue siendo un script independiente; para importar estos módulos
+añaden la raíz del proyecto a `sys.path` y usan `from channels.common... import ...`.
+"""
@@ -0,0 +1,368 @@
+"""
+Control de admisión del Claude CLI para todo el host.
+
+Telegram, Slack, el dashboard web y los scripts de cron de scripts/ lanzan
+procesos del CLI en la misma máquina sin un límite común: con carga todo se
+ralentiza a la vez. `AdmissionScheduler` reparte un número fijo de huecos
+(`max_concurrent`) entre todos los procesos del host y, cuando no hay hueco,
+da prioridad por clase:
+
+- `interactive`: mensajes directos (DM de Telegram/Slack, chat web)
+- `mention`: menciones en canales y grupos
+- `batch`: reportes de cron
+
+Dentro de la misma clase se respeta el orden de llegada. Para que un reporte
+batch no espere para siempre, cada `aging` segundos de espera sube una clase.
+
+El estado (quién tiene hueco y quién espera) vive en un fichero JSON
+protegido con `flock` en `DEFAULT_STATE_DIR` (~/.claudio), así que lo
+comparten procesos distintos. No se usa el directorio temporal: en macOS cron
+y una sesión de usuario tienen `TMPDIR` distintos y no se verían entre sí. Las entradas
+de procesos muertos se limpian solas. Sin `fcntl` (Windows) el límite se
+aplica solo dentro del proceso.
+
+Uso desde cron (ver scripts/*.sh):
+
+    python3 -m channels.common.admission --priority batch -- claude -p "..."
+"""
+
+import argparse
+import asyncio
+import inspect
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+from typing import Callable, Optional
+
+try:
+    import fcntl
+    HAS_FCNTL = True
+except ImportError:
+    HAS_FCNTL = False
+
+logger = logging.getLogger(__name__)
+
+# Procesos del CLI simultáneos en el host si no se configura ADMISSION_MAX_CONCURRENT
+DEFAULT_MAX_CONCURRENT = 4
+
+# Directorio del fichero de estado compartido si no se configura ADMISSION_STATE_DIR
+DEFAULT_STATE_DIR = '~/.claudio'
+
+# Clase → rango (menor = más prioritaria)
+PRIORITIES = {'interactive': 0, 'mention': 1, 'batch': 2}
+
+# Una entrada en espera que no se refresca en este tiempo se considera abandonada
+WAITER_STALE_AFTER = 30.0
+
+
+class AdmissionCancelled(Exception):
+    """La espera por un hueco se canceló."""
+
+
+class Ticket:
+    """Un hueco pedido (y quizá concedido) al scheduler."""
+
+    def __init__(self, priority: str, label: str = ''):
+        if priority not in PRIORITIES:
+            raise ValueError(f"Prioridad desconocida: {priority!r} (opciones: {', '.join(PRIORITIES)})")
+        self.id = uuid.uuid4().hex
+        self.priority = priority
+        self.label = label
+        self.enqueued_at = time.time()
+        self.admitted_at: Optional[float] = None
+        self.position = 0  # Peticiones por delante en la última comprobación
+
+    @property
+    def waited(self) -> float:
+        return (self.admitted_at or time.time()) - self.enqueued_at
+
+
+class AdmissionScheduler:
+    """Limita los procesos del CLI en ejecución en todo el host."""
+
+    def __init__(
+        self,
+        max_concurrent: int = DEFAULT_MAX_CONCURRENT,
+        state_dir: Optional[str] = None,
+        poll_interval: float = 0.25,
+        aging: float = 300.0,
+    ):
+        """
+        Args:
+            max_concurrent: Procesos del CLI simultáneos en el host (0 = sin límite)
+            state_dir: Directorio del fichero de estado compartido (por defecto ~/.claudio)
+            poll_interval: Segundos entre comprobaciones mientras se espera
+            aging: Segundos de espera que hacen subir una clase de prioridad (0 = nunca)
+        """
+        self.max_concurrent = max_concurrent
+        state_dir = os.path.expanduser(state_dir or DEFAULT_STATE_DIR)
+        os.makedirs(state_dir, exist_ok=True)
+        self.state_path = os.path.join(state_dir, 'claudio_admission.json')
+        self.lock_path = os.path.join(state_dir, 'claudio_admission.lock')
+        self.poll_interval = poll_interval
+        self.aging = aging
+        self._thread_lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_concurrent > 0
+
+    # ---------- API ----------
+
+    def acquire(
+        self,
+        priority: str,
+        label: str = '',
+        on_position: Optional[Callable[[int], None]] = None,
+        cancelled: Optional[Callable[[], bool]] = None,
+    ) -> Ticket:
+        """
+        Espera (bloqueando) un hueco. `on_position` se llama cuando cambia la
+        posición en la cola del host, y con 0 al entrar si tuvo que esperar.
+
+        Raises:
+            AdmissionCancelled: si `cancelled()` devuelve True mientras espera
+        """
+        ticket = Ticket(priority, label)
+        if not self.enabled:
+            ticket.admitted_at = time.time()
+            return ticket
+
+        last_position = None
+        while True:
+            if cancelled and cancelled():
+                self.release(ticket)
+                raise AdmissionCancelled()
+            if self._poll(ticket):
+                if on_position and last_position:
+                    on_position(0)
+                return ticket
+            if on_position and ticket.position != last_position:
+                on_position(ticket.position)
+            last_position = ticket.position
+            time.sleep(self.poll_interval)
+
+    async def acquire_async(
+        self,
+        priority: str,
+        label: str = '',
+        on_position: Optional[Callable[[int], None]] = None,
+        cancelled: Optional[Callable[[], bool]] = None,
+    ) -> Ticket:
+        """Versión asyncio de `acquire()`; `on_position` puede ser una corrutina."""
+        ticket = Ticket(priority, label)
+        if not self.enabled:
+            ticket.admitted_at = time.time()
+            return ticket
+
+        loop = asyncio.get_running_loop()
+        last_position = None
+        try:
+            while True:
+                if cancelled and cancelled():
+                    raise AdmissionCancelled()
+                admitted = await loop.run_in_executor(None, self._poll, ticket)
+                if admitted and not last_position:
+                    return ticket
+                if on_position and ticket.position != last_position:
+                    result = on_position(ticket.position)
+                    if inspect.isawaitable(result):
+                        await result
+                if admitted:
+                    return ticket
+                last_position = ticket.position
+                await asyncio.sleep(self.poll_interval)
+        except BaseException:
+            # Cancelación, tarea cancelada o error en el callback: no dejar la entrada
+            await loop.run_in_executor(None, self.release, ticket)
+            raise
+
+    def release(self, ticket: Ticket):
+        """Libera el hueco (o la espera) del ticket."""
+        if not self.enabled:
+            return
+        with self._locked_state() as state:
+            state['holders'].pop(ticket.id, None)
+            state['waiting'].pop(ticket.id, None)
+
+    @contextmanager
+    def slot(self, priority: str, label: str = '', **kwargs):
+        """`with scheduler.slot('batch'):` ocupa un hueco mientras dura el bloque."""
+        ticket = self.acquire(priority, label, **kwargs)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    @asynccontextmanager
+    async def slot_async(self, priority: str, label: str = '', **kwargs):
+        ticket = await self.acquire_async(priority, label, **kwargs)
+        try:
+            yield ticket
+        finally:
+            await asyncio.get_running_loop().run_in_executor(None, self.release, ticket)
+
+    def stats(self) -> dict:
+        """Huecos ocupados y peticiones en espera por clase, en todo el host."""
+        if not self.enabled:
+            return {'max_concurrent': 0, 'running': 0, 'waiting': {}}
+        with self._locked_state() as state:
+            waiting = {name: 0 for name in PRIORITIES}
+            for entry in state['waiting'].values():
+                waiting[entry['priority']] = waiting.get(entry['priority'], 0) + 1
+            running = {name: 0 for name in PRIORITIES}
+            for entry in state['holders'].values():
+                running[entry['priority']] = running.get(entry['priority'], 0) + 1
+            return {
+                'max_concurrent': self.max_concurrent,
+                'running': sum(running.values()),
+                'running_by_class': running,
+                'waiting': waiting,
+            }
+
+    def format_stats(self) -> str:
+        """Resumen de una línea para los comandos de estado."""
+        s = self.stats()
+        if not self.enabled:
+            return "sin límite"
+        waiting = sum(s['waiting'].values())
+        detail = ', '.join(f"{n} {name}" for name, n in s['waiting'].items() if n)
+        return (
+            f"{s['running']}/{s['max_concurrent']} en uso · {waiting} en espera"
+            + (f" ({detail})" if detail else "")
+        )
+
+    # ---------- Interno ----------
+
+    def _poll(self, ticket: Ticket) -> bool:
+        """Registra/refresca el ticket y lo admite si le toca. Devuelve True si entra."""
+        now = time.time()
+        with self._locked_state() as state:
+            holders, waiting = state['holders'], state['waiting']
+            waiting[ticket.id] = {
+                'pid': os.getpid(),
+                'priority': ticket.priority,
+                'label': ticket.label,
+                'enqueued': ticket.enqueued_at,
+                'seen': now,
+            }
+            order = sorted(waiting, key=lambda tid: (self._rank(waiting[tid], now), waiting[tid]['enqueued']))
+            free = self.max_concurrent - len(holders)
+            index = order.index(ticket.id)
+
+            if index < free:
+                del waiting[ticket.id]
+                holders[ticket.id] = {
+                    'pid': os.getpid(),
+                    'priority': ticket.priority,
+                    'label': ticket.label,
+                    'since': now,
+                }
+                ticket.admitted_at = now
+                ticket.position = 0
+                if ticket.waited > 1:
+                    logger.info(
+                        f"[Admisión] {ticket.priority} '{ticket.label}' admitido tras {ticket.waited:.1f}s"
+                    )
+                return True
+
+            ticket.position = index - max(free, 0) + 1
+            return False
+
+    def _rank(self, entry: dict, now: float) -> float:
+        rank = PRIORITIES.get(entry['priority'], len(PRIORITIES))
+        if self.aging > 0:
+            rank -= (now - entry['enqueued']) // self.aging
+        return max(rank, 0)
+
+    @contextmanager
+    def _locked_state(self):
+        """Abre el fichero de estado con el lock del host tomado y lo guarda al salir."""
+        with self._thread_lock:
+            os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+            with open(self.lock_path, 'a') as lock_file:
+                if HAS_FCNTL:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                try:
+                    state = self._load()
+                    yield state
+                    self._save(state)
+                finally:
+                    if HAS_FCNTL:
+                        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _load(self) -> dict:
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        state.setdefault('holders', {})
+        state.setdefault('waiting', {})
+
+        # Limpiar entradas de procesos muertos y esperas abandonadas
+        now = time.time()
+        for tid, entry in list(state['holders'].items()):
+            if not _pid_alive(entry.get('pid')):
+                logger.warning(f"[Admisión] Liberando hueco de proceso muerto (PID {entry.get('pid')})")
+                del state['holders'][tid]
+        for tid, entry in list(state['waiting'].items()):
+            if not _pid_alive(entry.get('pid')) or now - entry.get('seen', 0) > WAITER_STALE_AFTER:
+                del state['waiting'][tid]
+        return state
+
+    def _save(self, state: dict):
+        tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+
+def _pid_alive(pid) -> bool:
+    if not isinstance(pid, int):
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def main(argv=None) -> int:
+    """Ejecuta un comando (p.ej. el CLI desde cron) dentro de un hueco del scheduler."""
+    parser = argparse.ArgumentParser(
+        description="Ejecuta un comando respetando el límite de procesos del CLI del host.",
+    )
+    parser.add_argument('--priority', choices=list(PRIORITIES), default='batch')
+    parser.add_argument('--label', default='', help="Nombre para logs y /status")
+    parser.add_argument('--max-concurrent', type=int,
+                        default=int(os.getenv('ADMISSION_MAX_CONCURRENT', str(DEFAULT_MAX_CONCURRENT))))
+    parser.add_argument('--state-dir', default=os.getenv('ADMISSION_STATE_DIR') or None)
+    parser.add_argument('command', nargs=argparse.REMAINDER, help="Comando a ejecutar (tras --)")
+    args = parser.parse_args(argv)
+
+    command = args.command[1:] if args.command[:1] == ['--'] else args.command
+    if not command:
+        parser.error("falta el comando a ejecutar")
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    scheduler = AdmissionScheduler(args.max_concurrent, args.state_dir)
+    label = args.label or os.path.basename(command[0])
+
+    def report(position: int):
+        logger.info(f"[Admisión] '{label}' en espera (posición {position})")
+
+    with scheduler.slot(args.priority, label, on_position=report):
+        return subprocess.call(command)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,58 @@
+"""
+Salidas largas como archivo adjunto.
+
+Un informe o un volcado de código de decenas de KB acababa en decenas de
+mensajes, cada uno una llamada a la API que cuenta para los límites de envío
+y que inunda el chat. Pasado un umbral (`OUTPUT_ATTACHMENT_THRESHOLD` en cada
+canal), los bots envían un resumen corto y la salida completa como un único
+documento (Telegram) o snippet (Slack): dos llamadas en vez de decenas.
+
+El archivo se sube desde un buffer en memoria (`output_buffer`), sin pasar por
+disco. Se crea uno nuevo en cada intento para que un reintento no lo
+encuentre ya leído.
+"""
+
+import io
+import time
+
+from channels.common.chunker import split_markdown
+
+# Caracteres de la salida que se muestran en el resumen
+PREVIEW_LENGTH = 800
+
+
+def should_attach(length: int, threshold: int) -> bool:
+    """True si una salida de `length` caracteres debe ir como archivo (umbral 0 = nunca)."""
+    return threshold > 0 and length > threshold
+
+
+def output_buffer(text: str) -> io.BytesIO:
+    """Salida en UTF-8 en un buffer en memoria listo para subir."""
+    return io.BytesIO(text.encode('utf-8'))
+
+
+def attachment_filename(prefix: str = 'claudio') -> str:
+    """Nombre del archivo adjunto, p.ej. claudio-20240131-120000.md"""
+    return f"{prefix}-{time.strftime('%Y%m%d-%H%M%S')}.md"
+
+
+def format_size(size: int) -> str:
+    if size < 1024:
+        return f"{size} B"
+    if size < 1024 * 1024:
+        return f"{size / 1024:.0f} KB"
+    return f"{size / (1024 * 1024):.1f} MB"
+
+
+def summarize_output(text: str, markers: str = '*_', preview_length: int = PREVIEW_LENGTH) -> str:
+    """
+    Mensaje que acompaña al archivo: el principio de la salida (con el
+    Markdown balanceado) y su tamaño.
+    """
+    preview = next(split_markdown(text, preview_length, markers), '')
+    lines = text.count('\n') + (not text.endswith('\n'))
+    note = (
+        f"📎 Respuesta completa en el archivo adjunto "
+        f"({lines} líneas, {format_size(len(text.encode('utf-8')))})."
+    )
+    return f"{preview}\n\n[…]\n\n{note}" if preview else note
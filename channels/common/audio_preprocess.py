@@ -0,0 +1,235 @@
+"""
+Preparación de las notas de voz antes de transcribirlas.
+
+Las notas de Telegram llegan en OGG/Opus a 48 kHz, con silencio al principio y
+al final. `AudioPreprocessor.process()`:
+
+1. Decodifica con ffmpeg a PCM de 16 bits, mono y 16 kHz (lo que usa Whisper).
+2. Recorta el silencio inicial y final (energía por tramos de 30 ms por debajo
+   de `silence_db`, con un margen para no comerse la primera sílaba).
+3. Si la nota dura más de `max_chunk_seconds`, la divide por las pausas
+   (silencios de al menos `min_pause` segundos) para transcribir los trozos en
+   paralelo.
+4. Codifica cada trozo de nuevo en OGG/Opus de voz a `bitrate`, mucho más
+   ligero de subir que el original.
+
+Necesita el binario `ffmpeg` y el paquete ffmpeg-python; sin ellos
+`FFMPEG_AVAILABLE` es False y los canales transcriben el audio tal cual.
+"""
+
+import logging
+import math
+import operator
+import shutil
+import threading
+import time
+from array import array
+from typing import Optional
+
+try:
+    import ffmpeg
+    FFMPEG_AVAILABLE = shutil.which('ffmpeg') is not None
+except ImportError:
+    ffmpeg = None
+    FFMPEG_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_WIDTH = 2  # PCM s16le
+FRAME_SECONDS = 0.03
+
+
+class PreprocessError(Exception):
+    """ffmpeg no pudo decodificar o codificar el audio."""
+
+
+def frame_levels(pcm: bytes, sample_rate: int, frame_seconds: float = FRAME_SECONDS) -> list[float]:
+    """Nivel RMS en dBFS de cada tramo de `frame_seconds` del PCM s16le mono."""
+    samples = array('h', pcm[:len(pcm) - len(pcm) % SAMPLE_WIDTH])
+    size = max(1, int(sample_rate * frame_seconds))
+    levels = []
+    for start in range(0, len(samples), size):
+        frame = samples[start:start + size]
+        energy = sum(map(operator.mul, frame, frame)) / len(frame)
+        levels.append(20 * math.log10(math.sqrt(energy) / 32768) if energy else -120.0)
+    return levels
+
+
+def speech_chunks(
+    levels: list[float],
+    silence_db: float = -40.0,
+    min_pause_frames: int = 17,
+    max_chunk_frames: int = 0,
+    padding_frames: int = 7,
+) -> list[tuple[int, int]]:
+    """
+    Rangos [inicio, fin) de tramos con voz: sin el silencio de los extremos y,
+    con `max_chunk_frames`, partidos por la mitad de las pausas.
+
+    Si no se detecta voz se devuelve el audio completo (mejor que descartarlo
+    por un umbral mal ajustado).
+    """
+    voiced = [i for i, level in enumerate(levels) if level > silence_db]
+    if not voiced:
+        return [(0, len(levels))] if levels else []
+    start = max(0, voiced[0] - padding_frames)
+    end = min(len(levels), voiced[-1] + 1 + padding_frames)
+    if not max_chunk_frames or end - start <= max_chunk_frames:
+        return [(start, end)]
+
+    # Puntos de corte: el centro de cada pausa suficientemente larga
+    cuts = []
+    run_start = None
+    for i in range(start, end):
+        if levels[i] <= silence_db:
+            if run_start is None:
+                run_start = i
+        elif run_start is not None:
+            if i - run_start >= min_pause_frames:
+                cuts.append((run_start + i) // 2)
+            run_start = None
+
+    chunks = []
+    chunk_start = start
+    while end - chunk_start > max_chunk_frames:
+        limit = chunk_start + max_chunk_frames
+        # La última pausa antes del límite; sin pausas, corte duro
+        candidates = [c for c in cuts if chunk_start < c <= limit]
+        cut = candidates[-1] if candidates else limit
+        chunks.append((chunk_start, cut))
+        chunk_start = cut
+    chunks.append((chunk_start, end))
+    return chunks
+
+
+class AudioPreprocessor:
+    """Decodifica, recorta, divide y recodifica notas de voz con ffmpeg."""
+
+    def __init__(
+        self,
+        sample_rate: int = 16000,
+        silence_db: float = -40.0,
+        min_pause: float = 0.5,
+        max_chunk_seconds: float = 60.0,
+        bitrate: str = '16k',
+        ffmpeg_timeout: float = 60.0,
+    ):
+        """
+        Args:
+            sample_rate: Frecuencia de muestreo de salida (Whisper trabaja a 16 kHz)
+            silence_db: Nivel (dBFS) por debajo del cual un tramo es silencio
+            min_pause: Segundos mínimos de silencio para poder cortar ahí
+            max_chunk_seconds: Duración máxima de cada trozo (0 = no dividir)
+            bitrate: Bitrate Opus de los trozos
+            ffmpeg_timeout: Segundos máximos por llamada a ffmpeg
+        """
+        if not FFMPEG_AVAILABLE:
+            raise PreprocessError("ffmpeg no está disponible. Instala ffmpeg y ffmpeg-python")
+        self.sample_rate = sample_rate
+        self.silence_db = silence_db
+        self.min_pause = min_pause
+        self.max_chunk_seconds = max_chunk_seconds
+        self.bitrate = bitrate
+        self.ffmpeg_timeout = ffmpeg_timeout
+        self._lock = threading.Lock()
+        self.processed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds_in = 0.0
+        self.seconds_out = 0.0
+
+    def process(self, audio: bytes) -> list[bytes]:
+        """
+        Devuelve los trozos OGG/Opus listos para transcribir, en orden.
+
+        Raises:
+            PreprocessError: Si ffmpeg falla
+        """
+        started = time.monotonic()
+        pcm = self.decode(audio)
+        levels = frame_levels(pcm, self.sample_rate)
+        frames = speech_chunks(
+            levels,
+            silence_db=self.silence_db,
+            min_pause_frames=max(1, round(self.min_pause / FRAME_SECONDS)),
+            max_chunk_frames=round(self.max_chunk_seconds / FRAME_SECONDS) if self.max_chunk_seconds else 0,
+        )
+        frame_bytes = int(self.sample_rate * FRAME_SECONDS) * SAMPLE_WIDTH
+        chunks = [self.encode(pcm[start * frame_bytes:end * frame_bytes]) for start, end in frames]
+
+        seconds_in = len(pcm) / (self.sample_rate * SAMPLE_WIDTH)
+        seconds_out = sum(end - start for start, end in frames) * FRAME_SECONDS
+        with self._lock:
+            self.processed += 1
+            self.bytes_in += len(audio)
+            self.bytes_out += sum(len(c) for c in chunks)
+            self.seconds_in += seconds_in
+            self.seconds_out += min(seconds_out, seconds_in)
+        logger.info(
+            f"[Audio] {len(audio)} → {sum(len(c) for c in chunks)} bytes, "
+            f"{seconds_in:.1f}s → {min(seconds_out, seconds_in):.1f}s en {len(chunks)} trozo(s) "
+            f"({time.monotonic() - started:.2f}s)"
+        )
+        return chunks
+
+    def decode(self, audio: bytes) -> bytes:
+        """Cualquier formato que entienda ffmpeg → PCM s16le mono a `sample_rate`."""
+        return self._run(
+            ffmpeg.input('pipe:0').output('pipe:1', format='s16le', acodec='pcm_s16le', ac=1, ar=self.sample_rate),
+            audio,
+        )
+
+    def encode(self, pcm: bytes) -> bytes:
+        """PCM s16le mono → OGG/Opus ajustado para voz."""
+        return self._run(
+            ffmpeg.input('pipe:0', format='s16le', ac=1, ar=self.sample_rate).output(
+                'pipe:1', format='ogg', acodec='libopus', application='voip', **{'b:a': self.bitrate}
+            ),
+            pcm,
+        )
+
+    def _run(self, stream, data: bytes) -> bytes:
+        process = stream.global_args('-nostdin', '-loglevel', 'error').run_async(
+            pipe_stdin=True, pipe_stdout=True, pipe_stderr=True
+        )
+        try:
+            out, err = process.communicate(input=data, timeout=self.ffmpeg_timeout)
+        except Exception as e:
+            process.kill()
+            process.communicate()
+            raise PreprocessError(f"ffmpeg no terminó: {e}") from e
+        if process.returncode != 0:
+            raise PreprocessError(f"ffmpeg salió con código {process.returncode}: {err.decode(errors='replace').strip()[:300]}")
+        return out
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'processed': self.processed,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'seconds_in': self.seconds_in,
+                'seconds_out': self.seconds_out,
+            }
+
+    def format_stats(self) -> str:
+        """Resumen de una línea para los comandos de estado."""
+        s = self.stats()
+        if not s['processed']:
+            return "sin audios todavía"
+        saved = 1 - s['bytes_out'] / s['bytes_in'] if s['bytes_in'] else 0.0
+        return (
+            f"{s['processed']} audios · {s['bytes_in'] / 1024:.0f} → {s['bytes_out'] / 1024:.0f} KB "
+            f"({saved:.0%} menos) · {s['seconds_in'] - s['seconds_out']:.0f}s de silencio recortado"
+        )
+
+
+def prepare(preprocessor: Optional[AudioPreprocessor], audio: bytes) -> list[bytes]:
+    """`preprocessor.process(audio)`, o el audio original si no hay preprocesado o falla."""
+    if preprocessor is None:
+        return [audio]
+    try:
+        return preprocessor.process(audio) or [audio]
+    except PreprocessError as e:
+        logger.warning(f"[Audio] Se transcribe el audio original: {e}")
+        return [audio]
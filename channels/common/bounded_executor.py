@@ -0,0 +1,168 @@
+"""
+Concurrencia limitada para procesar mensajes, con cola acotada y cierre ordenado.
+
+Una ráfaga de menciones no debe lanzar tantas ejecuciones como mensajes.
+`BoundedExecutor` procesa como mucho `max_workers` mensajes a la vez en el
+event loop del bot:
+
+- los mensajes que no tienen hueco esperan en orden de llegada, como mucho
+  `max_queue`; con la cola llena `submit()` lanza `QueueFull` para que el
+  canal conteste "ocupado" en vez de acumular trabajo
+- `stats()` da los mensajes en proceso, la longitud de la cola y la espera
+  media y máxima de los últimos mensajes (también como métricas de Prometheus)
+- `shutdown()` deja de aceptar mensajes y espera a que terminen los que están
+  en proceso y en cola (p.ej. al recibir SIGTERM)
+
+Cada mensaje es una tarea de asyncio, no un hilo: esperar al CLI no ocupa
+ningún hilo del proceso.
+"""
+
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+from channels.common.metrics import MESSAGE_POOL_METRICS, MessagePoolMetrics
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """Todos los huecos están ocupados y la cola de espera está llena."""
+
+
+class BoundedExecutor:
+    """Ejecuta corrutinas con como mucho `max_workers` a la vez y una cola de espera acotada."""
+
+    def __init__(
+        self,
+        max_workers: int,
+        max_queue: int,
+        name: str = 'messages',
+        metrics: Optional[MessagePoolMetrics] = MESSAGE_POOL_METRICS,
+    ):
+        """
+        Args:
+            max_workers: Mensajes procesándose a la vez como mucho
+            max_queue: Mensajes como mucho esperando hueco (0 = sin espera)
+            name: Etiqueta `pool` de las métricas y prefijo de los logs
+            metrics: Métricas de Prometheus (None = sin métricas)
+        """
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+        self.name = name
+        self.metrics = metrics
+        self._slots: Optional[asyncio.Semaphore] = None  # Se crea en el loop del primer submit()
+        self._tasks: set[asyncio.Task] = set()
+        self._ids = itertools.count()
+        self._waiting: dict[int, float] = {}  # Mensajes en cola → instante de llegada
+        self._running = 0
+        self._closed = False
+        self._waits: deque[float] = deque(maxlen=100)  # Esperas de los últimos mensajes
+        self.completed = 0
+        self.rejected = 0
+
+    # ---------- API ----------
+
+    def submit(self, fn: Callable[..., Awaitable], *args, **kwargs) -> asyncio.Task:
+        """
+        Programa `await fn(*args, **kwargs)` en cuanto haya hueco.
+
+        Raises:
+            QueueFull: si no hay hueco y la cola está llena
+            RuntimeError: si el executor ya se está cerrando
+        """
+        if self._closed:
+            raise RuntimeError(f"[{self.name}] El executor se está cerrando")
+        if self._running + len(self._waiting) >= self.max_workers + self.max_queue:
+            self.rejected += 1
+            if self.metrics:
+                self.metrics.rejected.inc(pool=self.name)
+            raise QueueFull(f"{self._running} en proceso y {len(self._waiting)} en cola")
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_workers)
+
+        key = next(self._ids)
+        self._waiting[key] = time.monotonic()
+        self._update_gauges()
+        task = asyncio.get_running_loop().create_task(self._run(key, fn, args, kwargs))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def shutdown(self, timeout: Optional[float] = None) -> bool:
+        """
+        Deja de aceptar trabajo y espera a que terminen los mensajes en proceso y en cola.
+
+        Returns:
+            True si todo terminó antes de `timeout` segundos
+        """
+        self._closed = True
+        tasks = set(self._tasks)
+        if not tasks:
+            return True
+        logger.info(f"[{self.name}] Esperando a {len(tasks)} mensaje(s) en proceso o en cola...")
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        if pending:
+            logger.warning(f"[{self.name}] {len(pending)} mensaje(s) sin terminar tras {timeout:g}s")
+        return not pending
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiting)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        # La espera de lo que sigue en cola también cuenta (si no, una cola atascada no se vería)
+        waits = list(self._waits) + [now - since for since in self._waiting.values()]
+        return {
+            'max_workers': self.max_workers,
+            'max_queue': self.max_queue,
+            'running': self._running,
+            'queued': len(self._waiting),
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'wait_avg': sum(waits) / len(waits) if waits else 0.0,
+            'wait_max': max(waits, default=0.0),
+            'closed': self._closed,
+        }
+
+    def format_stats(self) -> str:
+        """Resumen de una línea para los comandos de estado."""
+        s = self.stats()
+        return (
+            f"{s['running']}/{s['max_workers']} en proceso · {s['queued']}/{s['max_queue']} en cola · "
+            f"espera media {s['wait_avg']:.1f}s (máx {s['wait_max']:.1f}s) · {s['rejected']} rechazados"
+        )
+
+    # ---------- Interno ----------
+
+    def _update_gauges(self):
+        if self.metrics:
+            self.metrics.queued.set(len(self._waiting), pool=self.name)
+            self.metrics.running.set(self._running, pool=self.name)
+
+    async def _run(self, key: int, fn: Callable[..., Awaitable], args: tuple, kwargs: dict):
+        try:
+            await self._slots.acquire()
+        finally:
+            # Sale de la cola tanto si entra como si se cancela esperando
+            enqueued = self._waiting.pop(key)
+        try:
+            self._running += 1
+            wait = time.monotonic() - enqueued
+            self._waits.append(wait)
+            self._update_gauges()
+            if self.metrics:
+                self.metrics.wait_seconds.observe(wait, pool=self.name)
+            return await fn(*args, **kwargs)
+        except Exception as e:
+            # Nadie espera el resultado: sin el log el error se perdería
+            logger.error(f"[{self.name}] Error procesando mensaje: {e}", exc_info=True)
+        finally:
+            self._running -= 1
+            self.completed += 1
+            self._update_gauges()
+            self._slots.release()
@@ -0,0 +1,218 @@
+"""
+División de salidas largas en mensajes sin romper el Markdown.
+
+Telegram (4096) y Slack (3000) limitan el tamaño de cada mensaje. Cortar la
+salida del CLI en un salto de línea cualquiera deja bloques ``` sin cerrar y
+`*negritas*` a medias: el parse de Markdown falla y el mensaje acaba en texto
+plano. `MarkdownChunker` corta por líneas y, en cada corte:
+
+- cierra el bloque de código abierto y lo reabre (con su lenguaje) al
+  principio del siguiente mensaje
+- cierra los marcadores en línea abiertos (`*`, `_`, `` ` ``, y `~` en Slack)
+  y los reabre en el mismo orden
+
+Funciona en streaming: `feed()` devuelve los mensajes que ya se han llenado y
+`current` es el mensaje en curso, así que sirve tanto para dividir una salida
+completa (`split_markdown`) como para la respuesta en vivo de Telegram. Cada
+carácter se procesa una vez: no se recorta el resto de la salida en cada corte.
+"""
+
+import re
+from typing import Iterator, Optional
+
+FENCE = '```'
+FENCE_CLOSE = '\n' + FENCE
+
+
+class MarkdownChunker:
+    """Divide Markdown en trozos de como mucho `max_length` caracteres, en un solo pase."""
+
+    def __init__(self, max_length: int, markers: str = '*_'):
+        """
+        Args:
+            max_length: Caracteres máximos por mensaje (marcadores de cierre incluidos)
+            markers: Marcadores en línea que se cierran y reabren en los cortes
+                (el `` ` `` de código en línea siempre se sigue)
+        """
+        self.max_length = max_length
+        self.markers = markers
+        self._marker_re = re.compile(r'\\.|`' + (f'|[{re.escape(markers)}]' if markers else ''))
+        # Peor caso de cierre: todos los marcadores más el de código en línea
+        self._inline_reserve = len(markers) + 1
+        self._fence: Optional[str] = None   # Línea que abrió el bloque de código abierto
+        self._inline: list[str] = []        # Marcadores en línea abiertos, en orden
+        self._at_line_start = True
+        self._partial = ''                  # Línea incompleta (aún sin '\n')
+        self._start_chunk()
+        self.chunks = 0
+
+    # ---------- API ----------
+
+    def feed(self, text: str) -> Iterator[str]:
+        """Agrega salida; devuelve los mensajes que quedan completos."""
+        if not text:
+            return
+        lines = (self._partial + text).split('\n')
+        self._partial = lines.pop()
+        for line in lines:
+            yield from self._add(line + '\n')
+        # La línea incompleta también tiene que caber en el mensaje en curso
+        if self._length + len(self._partial) + self._reserve() > self.max_length:
+            partial, start = self._partial, 0
+            while start < len(partial) and len(partial) - start + self._length + self._reserve() > self.max_length:
+                if self._content:
+                    yield self._emit()
+                    continue
+                end = self._cut(partial, start, self._avail())
+                yield from self._add(partial[start:end])
+                start = end
+            self._partial = partial[start:]
+
+    def flush(self) -> Iterator[str]:
+        """Devuelve el último mensaje (cerrando lo que quede abierto) y reinicia el estado."""
+        if self._partial:
+            partial, self._partial = self._partial, ''
+            yield from self._add(partial)
+        if self._content:
+            yield self._emit()
+        self._fence = None
+        self._inline = []
+        self._at_line_start = True
+        self._start_chunk()
+
+    @property
+    def current(self) -> str:
+        """Mensaje en curso, tal cual (sin cerrar marcadores)."""
+        return ''.join(self._parts) + self._partial
+
+    # ---------- Internos ----------
+
+    def _start_chunk(self):
+        if self._fence is not None:
+            prefix = self._reopen_fence(self._fence)
+        else:
+            prefix = ''.join(self._inline)
+        self._parts = [prefix] if prefix else []
+        self._length = len(prefix)
+        self._content = False
+
+    def _reopen_fence(self, fence: str) -> str:
+        """Cabecera del bloque para el mensaje siguiente, dejando sitio para el contenido."""
+        # Cabecera, salto de línea, al menos un carácter y el cierre
+        room = self.max_length - len(FENCE_CLOSE) - 2
+        if len(fence) > room:
+            # Una línea de apertura larga (título, o una línea entera pegada al ```)
+            # se reduce al lenguaje, o a ``` si tampoco cabe
+            info = fence[len(FENCE):].split(maxsplit=1)
+            fence = FENCE + info[0] if info and len(FENCE + info[0]) <= room else FENCE
+        return fence + '\n' if len(fence) <= room else ''
+
+    def _emit(self) -> str:
+        text = ''.join(self._parts).rstrip('\n')
+        if self._fence is not None:
+            text += FENCE_CLOSE
+        elif self._inline:
+            text = text.rstrip() + ''.join(reversed(self._inline))
+        self.chunks += 1
+        self._start_chunk()
+        return text
+
+    def _reserve(self) -> int:
+        return len(FENCE_CLOSE) if self._fence is not None else self._inline_reserve
+
+    def _avail(self) -> int:
+        return max(1, self.max_length - self._length - self._reserve())
+
+    @staticmethod
+    def _closing(state: tuple) -> int:
+        fence, inline = state
+        return len(FENCE_CLOSE) if fence is not None else len(inline)
+
+    def _cut(self, text: str, start: int, avail: int) -> int:
+        """Fin del trozo que empieza en `start`: en un espacio si hay uno en la segunda mitad."""
+        end = start + avail
+        if end >= len(text):
+            return len(text)
+        space = text.rfind(' ', start + avail // 2, end)
+        return space + 1 if space > start else end
+
+    def _add(self, line: str) -> Iterator[str]:
+        # Líneas en blanco al principio de un mensaje (fuera de un bloque) no se muestran
+        if not self._content and self._fence is None and not line.strip():
+            self._at_line_start = line.endswith('\n')
+            return
+        state = self._scan(line)
+        if self._length + len(line) + self._closing(state) <= self.max_length:
+            self._append(line, state)
+            return
+        if self._content:
+            yield self._emit()
+            state = self._scan(line)
+            if self._length + len(line) + self._closing(state) <= self.max_length:
+                self._append(line, state)
+                return
+        # La línea no cabe ni en un mensaje vacío: cortarla en trozos
+        start = 0
+        while start < len(line):
+            end = self._cut(line, start, self._avail())
+            state = self._scan(line[start:end])
+            # El trozo puede abrir un bloque cuyo cierre es más largo que lo reservado
+            over = self._length + end - start + self._closing(state) - self.max_length
+            if over > 0:
+                end = max(start + 1, end - over)
+                state = self._scan(line[start:end])
+            piece = line[start:end]
+            self._append(piece, state)
+            start = end
+            if start < len(line):
+                yield self._emit()
+
+    def _append(self, text: str, state: tuple):
+        self._parts.append(text)
+        self._length += len(text)
+        self._content = True
+        self._fence, self._inline = state
+        self._at_line_start = text.endswith('\n')
+
+    def _scan(self, text: str) -> tuple:
+        """Estado (bloque abierto, marcadores abiertos) tras agregar `text`."""
+        fence, inline = self._fence, self._inline
+        if self._at_line_start and text.lstrip().startswith(FENCE):
+            stripped = text.strip()
+            if fence is not None:
+                return None, inline
+            if len(stripped) > len(FENCE) and stripped.endswith(FENCE):
+                return None, inline  # ```código``` en una sola línea
+            # Los marcadores abiertos antes del bloque no siguen dentro
+            return stripped, []
+        if fence is not None:
+            return fence, inline
+        opened = list(inline)
+        for match in self._marker_re.finditer(text):
+            token = match.group()
+            if token[0] == '\\':
+                continue
+            if token != '`':
+                if '`' in opened:
+                    continue
+                i = match.start()
+                before = text[i - 1] if i else ' '
+                after = text[i + 1] if i + 1 < len(text) else ' '
+                # Dentro de una palabra (snake_case, 2*3) no es un marcador; tampoco
+                # uno que abre seguido de espacio (viñetas, 2 * 3) o cierra tras un espacio
+                if before.isalnum() and after.isalnum():
+                    continue
+                if (after.isspace() if token not in opened else before.isspace()):
+                    continue
+            if token in opened:
+                opened.remove(token)
+            else:
+                opened.append(token)
+        return None, opened
+
+
+def split_markdown(text: str, max_length: int, markers: str = '*_') -> Iterator[str]:
+    """Divide una salida completa en mensajes de como mucho `max_length` caracteres."""
+    chunker = MarkdownChunker(max_length, markers)
+    yield from chunker.feed(text)
+    yield from chunker.flush()
@@ -0,0 +1,187 @@
+"""
+Cola de ejecuciones del Claude CLI por usuario, con cancelación.
+
+Cada mensaje de un usuario se registra como un `Job` antes de llegar al
+executor. Según el modo, la cola decide cuándo puede arrancar:
+
+- `serialize`: un job a la vez por usuario; el resto espera en orden FIFO.
+- `supersede`: un mensaje nuevo cancela (mata) lo que el usuario tenga en
+  marcha o en espera y ocupa su lugar.
+- `parallel`: hasta `max_parallel` jobs simultáneos por usuario.
+
+Cancelar un job en espera lo saca de la cola; cancelar uno en ejecución mata
+su proceso del CLI. La espera se implementa con `concurrent.futures.Future`,
+así que la misma cola sirve a código asyncio (`run()`) y a hilos (`run_sync()`).
+"""
+
+import asyncio
+import concurrent.futures
+import itertools
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+MODES = ('serialize', 'supersede', 'parallel')
+
+
+class JobCancelled(Exception):
+    """El job se canceló antes de empezar a ejecutarse."""
+
+
+class Job:
+    """Una ejecución pedida por un usuario."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, user_id: Hashable, label: str = ''):
+        self.id = next(self._ids)
+        self.user_id = user_id
+        self.label = label
+        self.created_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.position = 0  # Jobs por delante al encolarse (0 = arranca ya)
+        self.cancelled = False
+        self.ready: concurrent.futures.Future = concurrent.futures.Future()
+        self._worker = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self.started_at is not None
+
+    def attach(self, worker):
+        """Asocia el proceso del CLI al job; si ya estaba cancelado, lo mata."""
+        with self._lock:
+            self._worker = worker
+            cancelled = self.cancelled
+        if cancelled:
+            worker.kill()
+
+    def cancel(self) -> bool:
+        """Marca el job como cancelado y mata su proceso si lo tiene."""
+        with self._lock:
+            if self.cancelled:
+                return False
+            self.cancelled = True
+            worker = self._worker
+        try:
+            self.ready.set_exception(JobCancelled())
+        except concurrent.futures.InvalidStateError:
+            pass  # Ya estaba en ejecución
+        if worker is not None and worker.is_alive():
+            logger.info(f"[Cola] Cancelando job {self.id} de {self.user_id} (PID {worker.pid})")
+            worker.kill()
+        return True
+
+
+class UserJobQueue:
+    """Ordena y limita las ejecuciones de cada usuario."""
+
+    def __init__(self, mode: str = 'serialize', max_parallel: int = 2):
+        if mode not in MODES:
+            raise ValueError(f"Modo de cola desconocido: {mode!r} (opciones: {', '.join(MODES)})")
+        self.mode = mode
+        self.limit = max(1, max_parallel) if mode == 'parallel' else 1
+        self._running: dict[Hashable, list[Job]] = defaultdict(list)
+        self._waiting: dict[Hashable, deque[Job]] = defaultdict(deque)
+        self._lock = threading.Lock()
+
+    # ---------- API ----------
+
+    def submit(self, user_id: Hashable, label: str = '') -> Job:
+        """Registra un job. `job.ready` se resuelve cuando puede ejecutarse."""
+        job = Job(user_id, label)
+        if self.mode == 'supersede':
+            superseded = self.cancel(user_id)
+            if superseded:
+                logger.info(f"[Cola] Usuario {user_id}: {superseded} job(s) reemplazados por uno nuevo")
+
+        with self._lock:
+            waiting = self._waiting[user_id]
+            if len(self._running[user_id]) < self.limit and not waiting:
+                self._start(job)
+            else:
+                job.position = len(waiting) + 1
+                waiting.append(job)
+        return job
+
+    def finish(self, job: Job):
+        """Libera el hueco del job y arranca el siguiente en espera."""
+        with self._lock:
+            running = self._running.get(job.user_id, [])
+            if job in running:
+                running.remove(job)
+            else:
+                waiting = self._waiting.get(job.user_id)
+                if waiting and job in waiting:
+                    waiting.remove(job)
+            self._promote(job.user_id)
+
+    def cancel(self, user_id: Hashable) -> int:
+        """Cancela todos los jobs (en marcha y en espera) de un usuario."""
+        with self._lock:
+            jobs = list(self._waiting.pop(user_id, ())) + list(self._running.get(user_id, ()))
+        return sum(1 for job in jobs if job.cancel())
+
+    def status(self, user_id: Hashable) -> tuple[int, int]:
+        """(jobs en ejecución, jobs en espera) de un usuario."""
+        with self._lock:
+            return len(self._running.get(user_id, ())), len(self._waiting.get(user_id, ()))
+
+    @asynccontextmanager
+    async def run(self, user_id: Hashable, label: str = '', job: Optional[Job] = None):
+        """
+        `async with queue.run(user_id) as job:` espera turno y libera al salir.
+
+        Se puede pasar un `job` ya obtenido con `submit()` (p.ej. para avisar
+        al usuario de su posición antes de esperar).
+
+        Raises:
+            JobCancelled: si el job se cancela mientras espera
+        """
+        job = job or self.submit(user_id, label)
+        try:
+            await asyncio.wrap_future(job.ready)
+            yield job
+        finally:
+            self.finish(job)
+
+    @contextmanager
+    def run_sync(self, user_id: Hashable, label: str = '', job: Optional[Job] = None):
+        """Versión bloqueante de `run()` para hilos."""
+        job = job or self.submit(user_id, label)
+        try:
+            job.ready.result()
+            yield job
+        finally:
+            self.finish(job)
+
+    # ---------- Interno (con self._lock tomado) ----------
+
+    def _start(self, job: Job) -> bool:
+        try:
+            job.ready.set_result(job)
+        except concurrent.futures.InvalidStateError:
+            return False  # Cancelado mientras esperaba
+        job.started_at = time.monotonic()
+        self._running[job.user_id].append(job)
+        return True
+
+    def _promote(self, user_id: Hashable):
+        running = self._running.get(user_id, [])
+        waiting = self._waiting.get(user_id)
+        while waiting and len(running) < self.limit:
+            job = waiting.popleft()
+            if self._start(job):
+                running = self._running[user_id]
+        for index, job in enumerate(waiting or (), start=1):
+            job.position = index
+        if not running:
+            self._running.pop(user_id, None)
+        if waiting is not None and not waiting:
+            self._waiting.pop(user_id, None)
@@ -0,0 +1,85 @@
+"""
+Decodificación incremental de la salida del Claude CLI en líneas UTF-8.
+
+El `read_stream` original concatenaba cada chunk a un buffer de bytes, lo
+decodificaba entero, partía las líneas y re-codificaba el resto. Con líneas
+largas sin salto (JSON de herramientas, tablas) eso es cuadrático, y un
+carácter multibyte partido entre dos chunks acababa convertido en U+FFFD.
+
+`LineDecoder` usa un decoder incremental de `codecs` (que guarda los bytes de
+un carácter incompleto hasta el siguiente chunk) y acumula los fragmentos de
+la línea en curso en una lista, así que cada byte se procesa una sola vez.
+"""
+
+import codecs
+from typing import AsyncIterator, Callable, Optional
+
+# Tamaño de lectura por defecto del stream del CLI
+DEFAULT_READ_SIZE = 65536
+
+
+class LineDecoder:
+    """Convierte chunks de bytes en líneas de texto completas."""
+
+    def __init__(self, encoding: str = 'utf-8', errors: str = 'replace'):
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors=errors)
+        self._pending: list[str] = []
+
+    def feed(self, data: bytes) -> list[str]:
+        """
+        Procesa un chunk y devuelve las líneas que completa (sin el '\\n').
+
+        Los bytes de una línea todavía abierta quedan pendientes hasta el
+        siguiente `feed()` o hasta `flush()`.
+        """
+        text = self._decoder.decode(data)
+        if '\n' not in text:
+            if text:
+                self._pending.append(text)
+            return []
+
+        lines = text.split('\n')
+        if self._pending:
+            self._pending.append(lines[0])
+            lines[0] = ''.join(self._pending)
+            self._pending = []
+        rest = lines.pop()
+        if rest:
+            self._pending.append(rest)
+        return lines
+
+    def flush(self) -> str:
+        """Devuelve el texto restante (línea final sin '\\n') y reinicia el decoder."""
+        tail = self._decoder.decode(b'', final=True)
+        if tail:
+            self._pending.append(tail)
+        text = ''.join(self._pending)
+        self._pending = []
+        return text
+
+
+async def read_lines(
+    stream,
+    read_size: int = DEFAULT_READ_SIZE,
+    on_data: Optional[Callable[[bytes], None]] = None,
+) -> AsyncIterator[tuple[str, bool]]:
+    """
+    Lee un `asyncio.StreamReader` y produce `(línea, terminada)`.
+
+    `terminada` es False solo para el último fragmento si el stream acaba
+    sin salto de línea. `on_data` se llama con cada chunk crudo (p.ej. para
+    medir el time-to-first-byte).
+    """
+    decoder = LineDecoder()
+    while True:
+        chunk = await stream.read(read_size)
+        if not chunk:
+            break
+        if on_data:
+            on_data(chunk)
+        for line in decoder.feed(chunk):
+            yield line, True
+
+    tail = decoder.flush()
+    if tail:
+        yield tail, False
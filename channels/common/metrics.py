@@ -0,0 +1,352 @@
+"""
+Métricas de los executors del Claude CLI en formato de texto de Prometheus.
+
+Cada ejecución se registra con la etiqueta `channel` (telegram, slack, web):
+
+- `claudio_executor_spawn_seconds`: desde que se pide el proceso hasta que
+  tiene el prompt (≈0 con worker pre-arrancado)
+- `claudio_executor_first_output_seconds`: hasta el primer byte de stdout
+- `claudio_executor_duration_seconds`: duración total de la ejecución
+- `claudio_executor_output_bytes`: bytes de stdout por ejecución
+- `claudio_executor_runs_total{outcome}`: success, error, timeout,
+  cancelled, limit (límite de recursos) o cached
+- `claudio_executor_active_processes`: procesos del CLI en ejecución
+
+Y, por cola de mensajes con concurrencia limitada (`BoundedExecutor`, etiqueta `pool`):
+
+- `claudio_message_pool_queued` / `claudio_message_pool_running`: mensajes
+  esperando un hilo libre y en proceso
+- `claudio_message_pool_wait_seconds`: espera en la cola hasta tener hilo
+- `claudio_message_pool_rejected_total`: mensajes rechazados con la cola llena
+
+Sin dependencias: `Registry.render()` genera el texto que sirve `/metrics`
+en la web, y `start_http_server()` levanta un listener mínimo para los bots.
+"""
+
+import bisect
+import functools
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_labels(labelnames: Sequence[str], values: tuple, extra: str = '') -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: se esperaban las etiquetas {self.labelnames}, no {tuple(labels)}")
+        return tuple(labels[name] for name in self.labelnames)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            return [
+                f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in sorted(self._values.items())
+            ]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        # key -> [conteo por bucket (no acumulado), suma, total]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def _samples(self) -> list[str]:
+        lines = []
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    le = f'le="{_format_value(bound)}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    """Conjunto de métricas que se exponen juntas."""
+
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets=()) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class ExecutionRecord:
+    """Mediciones de una ejecución en curso; se cierra con `finish()`."""
+
+    def __init__(self, metrics: 'ExecutorMetrics', channel: str):
+        self.metrics = metrics
+        self.channel = channel
+        self.started_at = time.monotonic()
+        self.spawn_started_at: Optional[float] = None
+        self.spawn_seconds: Optional[float] = None
+        self.worker = None
+        self._finished = False
+
+    def spawn_started(self):
+        """Justo antes de pedir el proceso al pool."""
+        self.spawn_started_at = time.monotonic()
+
+    def spawned(self, worker):
+        """El proceso ya tiene el prompt; `worker` aporta el primer byte y los bytes de salida."""
+        now = time.monotonic()
+        self.spawn_seconds = now - (self.spawn_started_at or now)
+        self.worker = worker
+        self.metrics.active_processes.inc(channel=self.channel)
+
+    def finish(self, result: Optional[dict]):
+        """Registra el resultado de la ejecución (None = excepción)."""
+        if self._finished:
+            return
+        self._finished = True
+        m = self.metrics
+        outcome = outcome_of(result)
+        m.runs.inc(channel=self.channel, outcome=outcome)
+
+        if self.worker is None:
+            return
+        m.active_processes.dec(channel=self.channel)
+        m.spawn_seconds.observe(self.spawn_seconds, channel=self.channel)
+        first_byte_at = self.worker.first_byte_at
+        if first_byte_at is not None and self.spawn_started_at is not None:
+            m.first_output_seconds.observe(first_byte_at - self.spawn_started_at, channel=self.channel)
+        m.duration_seconds.observe(time.monotonic() - (self.spawn_started_at or self.started_at), channel=self.channel)
+        m.output_bytes.observe(self.worker.stdout_bytes, channel=self.channel)
+
+
+def outcome_of(result: Optional[dict]) -> str:
+    if not result:
+        return 'error'
+    if result.get('cached'):
+        return 'cached'
+    if result.get('cancelled'):
+        return 'cancelled'
+    if result.get('timeout'):
+        return 'timeout'
+    if result.get('limit_exceeded'):
+        return 'limit'
+    return 'success' if result.get('success') else 'error'
+
+
+class ExecutorMetrics:
+    """Métricas comunes de `ClaudeCodeExecutor` en los tres canales."""
+
+    def __init__(self, registry: Registry = REGISTRY):
+        self.registry = registry
+        self.spawn_seconds = registry.histogram(
+            'claudio_executor_spawn_seconds',
+            'Tiempo hasta tener un proceso del CLI con el prompt enviado.',
+            ('channel',), (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+        )
+        self.first_output_seconds = registry.histogram(
+            'claudio_executor_first_output_seconds',
+            'Tiempo hasta el primer byte de stdout del CLI.',
+            ('channel',), (0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300),
+        )
+        self.duration_seconds = registry.histogram(
+            'claudio_executor_duration_seconds',
+            'Duración total de una ejecución del CLI.',
+            ('channel',), (1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800),
+        )
+        self.output_bytes = registry.histogram(
+            'claudio_executor_output_bytes',
+            'Bytes de stdout por ejecución del CLI.',
+            ('channel',), (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304),
+        )
+        self.runs = registry.counter(
+            'claudio_executor_runs_total',
+            'Ejecuciones del CLI por resultado (success, error, timeout, cancelled, limit, cached).',
+            ('channel', 'outcome'),
+        )
+        self.active_processes = registry.gauge(
+            'claudio_executor_active_processes',
+            'Procesos del CLI ejecutando un prompt ahora mismo.',
+            ('channel',),
+        )
+
+    def start(self, channel: str) -> ExecutionRecord:
+        return ExecutionRecord(self, channel)
+
+    def instrument(self, channel: str):
+        """
+        Decorador para `execute_streaming`: crea un `ExecutionRecord`, lo pasa
+        como argumento `record` y lo cierra con el dict de resultado.
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                record = self.start(channel)
+                kwargs['record'] = record
+                result = None
+                try:
+                    result = await func(*args, **kwargs)
+                    return result
+                finally:
+                    record.finish(result)
+            return wrapper
+        return decorator
+
+
+EXECUTOR_METRICS = ExecutorMetrics()
+
+
+class MessagePoolMetrics:
+    """Métricas de las colas de mensajes con concurrencia limitada (`BoundedExecutor`)."""
+
+    def __init__(self, registry: Registry = REGISTRY):
+        self.queued = registry.gauge(
+            'claudio_message_pool_queued',
+            'Mensajes esperando un hilo libre.',
+            ('pool',),
+        )
+        self.running = registry.gauge(
+            'claudio_message_pool_running',
+            'Mensajes en proceso.',
+            ('pool',),
+        )
+        self.wait_seconds = registry.histogram(
+            'claudio_message_pool_wait_seconds',
+            'Espera en la cola hasta tener un hilo libre.',
+            ('pool',), (0.01, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900),
+        )
+        self.rejected = registry.counter(
+            'claudio_message_pool_rejected_total',
+            'Mensajes rechazados con la cola llena.',
+            ('pool',),
+        )
+
+
+MESSAGE_POOL_METRICS = MessagePoolMetrics()
+
+
+def start_http_server(port: int, host: str = '127.0.0.1', registry: Registry = REGISTRY) -> ThreadingHTTPServer:
+    """Sirve `GET /metrics` en un hilo daemon (para los bots, que no tienen servidor web)."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/metrics', '/'):
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(f"[Métricas] {self.address_string()} {format % args}")
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True)
+    thread.start()
+    logger.info(f"[Métricas] Escuchando en http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,237 @@
+"""
+Rate limiting por usuario compartido por los canales.
+
+`RateLimiter` aplica "como mucho `limit` mensajes cada `window` segundos" con
+GCRA (Generic Cell Rate Algorithm), el equivalente de un token bucket que
+guarda un único número por usuario: el instante teórico (TAT) en que su cubo
+vuelve a estar lleno. Cada mensaje aceptado lo adelanta `window / limit`
+segundos y se rechaza si quedaría más de `window` por delante de ahora.
+
+Frente a la lista de timestamps de antes:
+
+- `check()` es O(1) y no crea listas ni recorre timestamps
+- se permite una ráfaga de `limit` mensajes y después uno cada
+  `window / limit` segundos, en vez de esperar a que caduque el más antiguo
+- los usuarios con el cubo lleno no aportan nada y se expulsan cada
+  `evict_interval` segundos (un usuario sin entrada tiene la cuota completa)
+- `remaining()` y `retry_after()` dicen cuánto le queda a cada usuario
+
+Con `path` el estado se guarda en SQLite para que los límites sobrevivan a un
+reinicio. Las escrituras se agrupan cada `flush_interval` segundos y en
+`close()`, así que `check()` no toca disco en cada mensaje.
+"""
+
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """GCRA por clave, seguro entre hilos, con expulsión de inactivos y persistencia opcional."""
+
+    def __init__(
+        self,
+        limit: int,
+        window: float,
+        path: Optional[str] = None,
+        evict_interval: float = 60.0,
+        flush_interval: float = 5.0,
+        clock: Callable[[], float] = time.time,
+    ):
+        """
+        Args:
+            limit: Mensajes permitidos por ventana (0 o menos = sin límite)
+            window: Segundos de la ventana
+            path: Fichero SQLite donde persistir el estado (None = solo en memoria)
+            evict_interval: Cada cuántos segundos se expulsan los usuarios inactivos
+            flush_interval: Cada cuántos segundos se escriben los cambios en SQLite
+            clock: Reloj en segundos; de pared por defecto para que el estado
+                persistido siga siendo válido tras reiniciar
+        """
+        self.limit = limit
+        self.window = window
+        self.interval = window / limit if limit > 0 else 0.0
+        self.evict_interval = evict_interval
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self.path = path
+
+        self._tat: dict[str, float] = {}
+        self._dirty: set[str] = set()
+        self._lock = threading.Lock()
+        now = clock()
+        self._last_evict = now
+        self._last_flush = now
+        self._next_maintenance = now + min(evict_interval, flush_interval)
+
+        self.allowed = 0
+        self.rejected = 0
+        self.evicted = 0
+
+        self._db: Optional[sqlite3.Connection] = None
+        if path and limit > 0:
+            self._open(path, now)
+
+    # ---------- API ----------
+
+    def check(self, key: Hashable) -> tuple[bool, float]:
+        """
+        Registra un mensaje de `key` si le queda cuota.
+
+        Returns:
+            Tupla (is_allowed, retry_after): si se acepta y, si no, los
+            segundos hasta que pueda enviar el siguiente
+        """
+        if self.limit <= 0:
+            return True, 0.0
+        key = str(key)
+        with self._lock:
+            now = self.clock()
+            tat = self._tat.get(key, now)
+            if tat < now:
+                tat = now
+            tat += self.interval
+            if tat - now > self.window + 1e-9:
+                self.rejected += 1
+                return False, tat - self.window - now
+            self._tat[key] = tat
+            self._dirty.add(key)
+            self.allowed += 1
+            if now >= self._next_maintenance:
+                self._maintain(now)
+            return True, 0.0
+
+    def remaining(self, key: Hashable) -> int:
+        """Mensajes que `key` puede enviar ahora mismo sin ser rechazado."""
+        if self.limit <= 0:
+            return self.limit
+        with self._lock:
+            now = self.clock()
+            used = max(self._tat.get(str(key), now), now) - now
+        return max(0, min(self.limit, math.floor((self.window - used) / self.interval + 1e-9)))
+
+    def retry_after(self, key: Hashable) -> float:
+        """Segundos hasta que `key` pueda enviar un mensaje (0 si ya puede)."""
+        if self.limit <= 0:
+            return 0.0
+        with self._lock:
+            now = self.clock()
+            tat = max(self._tat.get(str(key), now), now)
+        return max(0.0, tat + self.interval - self.window - now)
+
+    def reset(self, key: Hashable):
+        """Devuelve a `key` la cuota completa."""
+        key = str(key)
+        with self._lock:
+            if self._tat.pop(key, None) is not None:
+                self._dirty.add(key)
+
+    def evict_idle(self) -> int:
+        """Expulsa las claves con el cubo ya lleno; devuelve cuántas."""
+        with self._lock:
+            return self._evict(self.clock())
+
+    def flush(self):
+        """Escribe en SQLite los cambios pendientes."""
+        with self._lock:
+            self._flush(self.clock())
+
+    def close(self):
+        """Guarda el estado y cierra la base de datos."""
+        with self._lock:
+            if self._db is None:
+                return
+            self._flush(self.clock())
+            self._db.close()
+            self._db = None
+
+    def __len__(self) -> int:
+        return len(self._tat)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'limit': self.limit,
+                'window': self.window,
+                'tracked': len(self._tat),
+                'allowed': self.allowed,
+                'rejected': self.rejected,
+                'evicted': self.evicted,
+                'persistent': self._db is not None,
+            }
+
+    def format_stats(self) -> str:
+        """Resumen de una línea para los comandos de estado."""
+        s = self.stats()
+        if s['limit'] <= 0:
+            return "sin límite"
+        return (
+            f"{s['limit']} cada {s['window']:g}s · {s['tracked']} usuarios con cuota gastada · "
+            f"{s['allowed']} aceptados, {s['rejected']} rechazados"
+            f"{' · persistente' if s['persistent'] else ''}"
+        )
+
+    # ---------- Internos (con self._lock tomado) ----------
+
+    def _maintain(self, now: float):
+        if now - self._last_evict >= self.evict_interval:
+            self._evict(now)
+        if self._db is not None and now - self._last_flush >= self.flush_interval:
+            self._flush(now)
+        self._next_maintenance = min(
+            self._last_evict + self.evict_interval,
+            self._last_flush + self.flush_interval if self._db is not None else math.inf,
+        )
+
+    def _evict(self, now: float) -> int:
+        self._last_evict = now
+        idle = [key for key, tat in self._tat.items() if tat <= now]
+        for key in idle:
+            del self._tat[key]
+        # Sin entrada equivale a cubo lleno: en SQLite basta con borrar las caducadas
+        self._dirty.difference_update(idle)
+        if self._db is not None:
+            try:
+                self._db.execute('DELETE FROM rate_limit WHERE tat <= ?', (now,))
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"[RateLimit] No se pudo limpiar {self.path}: {e}")
+        self.evicted += len(idle)
+        return len(idle)
+
+    def _flush(self, now: float):
+        self._last_flush = now
+        if self._db is None or not self._dirty:
+            return
+        upserts = [(key, self._tat[key]) for key in self._dirty if key in self._tat]
+        deletes = [(key,) for key in self._dirty if key not in self._tat]
+        try:
+            self._db.executemany('INSERT OR REPLACE INTO rate_limit (key, tat) VALUES (?, ?)', upserts)
+            self._db.executemany('DELETE FROM rate_limit WHERE key = ?', deletes)
+            self._db.commit()
+            self._dirty.clear()
+        except sqlite3.Error as e:
+            logger.warning(f"[RateLimit] No se pudo guardar en {self.path}: {e}")
+
+    def _open(self, path: str, now: float):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute('CREATE TABLE IF NOT EXISTS rate_limit (key TEXT PRIMARY KEY, tat REAL NOT NULL)')
+            db.execute('DELETE FROM rate_limit WHERE tat <= ?', (now,))
+            db.commit()
+            self._tat.update(db.execute('SELECT key, tat FROM rate_limit'))
+        except (sqlite3.Error, OSError) as e:
+            logger.warning(f"[RateLimit] Sin persistencia, no se pudo abrir {self.path}: {e}")
+            return
+        self._db = db
+        logger.info(f"[RateLimit] {len(self._tat)} usuarios restaurados de {self.path}")
@@ -0,0 +1,273 @@
+"""
+Límites y contabilidad de recursos por ejecución del Claude CLI.
+
+Una sesión patológica del CLI (y los servidores MCP de npx que lanza) puede
+comerse la memoria o la CPU de la máquina y dejar sin recursos a los bots.
+Cada ejecución corre con:
+
+- `ResourceLimits.wrap_command`: RLIMIT_CPU del kernel, puesto con
+  `ulimit -t` por un `sh` que luego hace `exec` del CLI (mismo PID, y cada
+  proceso hijo lo hereda). No se usa `preexec_fn`: no es seguro con hilos y
+  los bots lanzan procesos desde varios.
+- `ResourceMonitor`: un hilo que muestrea el árbol de procesos (el CLI y sus
+  descendientes) cada `sample_interval` segundos, guarda el pico de RSS, el
+  tiempo de CPU y el número de hijos, y mata el árbol entero si supera
+  `max_memory_mb`, `max_cpu_seconds` o `max_children`.
+
+La memoria se limita por muestreo de RSS y no con RLIMIT_AS porque node
+reserva varios GB de espacio virtual al arrancar. El muestreo lee /proc en
+Linux y `ps` en macOS.
+
+El tiempo de CPU cuenta desde que arranca el proceso, no desde que recibe el
+prompt: en un worker pre-arrancado del pool incluye el arranque del CLI y lo
+que gastó esperando (poco, bloqueado leyendo stdin).
+"""
+
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+_PROC_AVAILABLE = os.path.isdir('/proc/self')
+_CLK_TCK = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+class ResourceLimits:
+    """Límites de una ejecución (0 = sin límite)."""
+
+    def __init__(
+        self,
+        max_memory_mb: int = 0,
+        max_cpu_seconds: int = 0,
+        max_children: int = 0,
+        sample_interval: float = 1.0,
+    ):
+        """
+        Args:
+            max_memory_mb: RSS máximo del árbol de procesos (CLI + MCPs), en MB
+            max_cpu_seconds: Tiempo de CPU máximo del árbol, en segundos
+            max_children: Procesos descendientes vivos a la vez como máximo
+            sample_interval: Segundos entre muestras del árbol de procesos
+        """
+        self.max_memory_mb = max_memory_mb
+        self.max_cpu_seconds = max_cpu_seconds
+        self.max_children = max_children
+        self.sample_interval = sample_interval
+
+    def wrap_command(self, argv: list[str]) -> list[str]:
+        """`argv` lanzado a través de `sh` con los rlimits aplicados (igual si no hay ninguno)."""
+        # Sin /bin/sh (Windows) no hay rlimits: solo queda el muestreo
+        if sys.platform == 'win32' or self.max_cpu_seconds <= 0:
+            return argv
+        cpu = int(self.max_cpu_seconds)
+        # SIGXCPU al pasar el límite blando, SIGKILL unos segundos después. Si
+        # `ulimit` falla el CLI arranca igual: ResourceMonitor limita la CPU por muestreo
+        script = f'ulimit -S -t {cpu} 2>/dev/null; ulimit -H -t {cpu + 5} 2>/dev/null; exec "$@"'
+        return ['/bin/sh', '-c', script, 'sh', *argv]
+
+    def describe(self) -> str:
+        parts = []
+        if self.max_memory_mb:
+            parts.append(f"{self.max_memory_mb} MB")
+        if self.max_cpu_seconds:
+            parts.append(f"{self.max_cpu_seconds}s CPU")
+        if self.max_children:
+            parts.append(f"{self.max_children} hijos")
+        return ', '.join(parts) or 'sin límites'
+
+
+class ResourceMonitor:
+    """Muestrea y limita el árbol de procesos de una ejecución."""
+
+    def __init__(self, pid: int, limits: ResourceLimits, on_exceeded: Optional[Callable[[str], None]] = None):
+        self.pid = pid
+        self.limits = limits
+        self.on_exceeded = on_exceeded
+        self.started_at = time.monotonic()
+        self.ended_at: Optional[float] = None
+
+        self.peak_rss = 0          # bytes
+        self.peak_children = 0     # descendientes vivos a la vez
+        self.exceeded: Optional[str] = None  # 'memory', 'cpu' o 'children'
+        self._cpu_by_pid: dict[int, float] = {}
+        self._descendants: set[int] = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'resource-monitor-{pid}', daemon=True)
+
+    # ---------- API ----------
+
+    def start(self) -> 'ResourceMonitor':
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Detiene el muestreo y fija la duración de la ejecución."""
+        if self.ended_at is None:
+            self.ended_at = time.monotonic()
+        self._stopped.set()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join(timeout=2)
+
+    def note_returncode(self, returncode: Optional[int]):
+        """Detecta si el kernel mató al proceso por RLIMIT_CPU."""
+        if self.exceeded is None and returncode is not None and hasattr(signal, 'SIGXCPU'):
+            if returncode == -signal.SIGXCPU:
+                self.exceeded = 'cpu'
+
+    def descendants(self) -> set[int]:
+        with self._lock:
+            return set(self._descendants)
+
+    @property
+    def cpu_seconds(self) -> float:
+        with self._lock:
+            return sum(self._cpu_by_pid.values())
+
+    def usage(self) -> dict:
+        """Recursos consumidos por la ejecución, para el dict de resultado."""
+        with self._lock:
+            return {
+                'peak_rss_mb': round(self.peak_rss / (1024 * 1024), 1),
+                'cpu_seconds': round(sum(self._cpu_by_pid.values()), 2),
+                'peak_children': self.peak_children,
+                'processes': len(self._cpu_by_pid),
+                'wall_seconds': round((self.ended_at or time.monotonic()) - self.started_at, 2),
+                'limit_exceeded': self.exceeded,
+            }
+
+    # ---------- Interno ----------
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self._sample()
+            except Exception as e:
+                logger.debug(f"[Recursos] Error muestreando PID {self.pid}: {e}")
+            self._stopped.wait(self.limits.sample_interval)
+
+    def _sample(self):
+        table = process_table()
+        if self.pid not in table:
+            return
+
+        tree = {self.pid}
+        children_of: dict[int, list[int]] = {}
+        for pid, (ppid, _, _) in table.items():
+            children_of.setdefault(ppid, []).append(pid)
+        pending = [self.pid]
+        while pending:
+            for child in children_of.get(pending.pop(), ()):
+                if child not in tree:
+                    tree.add(child)
+                    pending.append(child)
+
+        rss = sum(table[pid][1] for pid in tree)
+        with self._lock:
+            for pid in tree:
+                # El CPU de un proceso solo crece; guardar el máximo visto conserva
+                # el consumo de los hijos que ya terminaron
+                self._cpu_by_pid[pid] = max(self._cpu_by_pid.get(pid, 0.0), table[pid][2])
+            self._descendants = tree - {self.pid}
+            self.peak_rss = max(self.peak_rss, rss)
+            self.peak_children = max(self.peak_children, len(tree) - 1)
+            cpu = sum(self._cpu_by_pid.values())
+
+        limits = self.limits
+        reason = None
+        if limits.max_memory_mb and rss > limits.max_memory_mb * 1024 * 1024:
+            reason = 'memory'
+        elif limits.max_cpu_seconds and cpu > limits.max_cpu_seconds:
+            reason = 'cpu'
+        elif limits.max_children and len(tree) - 1 > limits.max_children:
+            reason = 'children'
+
+        if reason and self.exceeded is None:
+            self.exceeded = reason
+            logger.warning(
+                f"[Recursos] PID {self.pid} superó el límite de {reason} "
+                f"(RSS {rss / 1048576:.0f} MB, CPU {cpu:.1f}s, {len(tree) - 1} hijos); matando el árbol"
+            )
+            kill_tree(self.pid, tree - {self.pid})
+            if self.on_exceeded:
+                self.on_exceeded(reason)
+            self._stopped.set()
+
+
+def kill_tree(pid: int, descendants) -> None:
+    """SIGKILL a un proceso y a los descendientes indicados (ignorando los que ya no existen)."""
+    for target in [pid, *descendants]:
+        try:
+            os.kill(target, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+
+def process_table() -> dict[int, tuple[int, int, float]]:
+    """{pid: (ppid, rss en bytes, segundos de CPU)} de todos los procesos visibles."""
+    if _PROC_AVAILABLE:
+        return _proc_table()
+    if sys.platform != 'win32':
+        return _ps_table()
+    return {}
+
+
+def _proc_table() -> dict[int, tuple[int, int, float]]:
+    table = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat', 'rb') as f:
+                stat = f.read().decode('utf-8', errors='replace')
+        except OSError:
+            continue
+        # El nombre (campo 2) va entre paréntesis y puede contener espacios
+        fields = stat[stat.rfind(')') + 2:].split()
+        try:
+            ppid = int(fields[1])
+            cpu = (int(fields[11]) + int(fields[12])) / _CLK_TCK
+            rss = int(fields[21]) * _PAGE_SIZE
+        except (IndexError, ValueError):
+            continue
+        table[int(entry)] = (ppid, rss, cpu)
+    return table
+
+
+def _ps_table() -> dict[int, tuple[int, int, float]]:
+    try:
+        output = subprocess.run(
+            ['ps', '-A', '-o', 'pid=,ppid=,rss=,time='],
+            capture_output=True, text=True, timeout=5,
+        ).stdout
+    except (OSError, subprocess.SubprocessError):
+        return {}
+    table = {}
+    for line in output.splitlines():
+        parts = line.split()
+        if len(parts) < 4:
+            continue
+        try:
+            table[int(parts[0])] = (int(parts[1]), int(parts[2]) * 1024, _parse_cputime(parts[3]))
+        except ValueError:
+            continue
+    return table
+
+
+def _parse_cputime(value: str) -> float:
+    """Convierte el formato de `ps` ([dd-][hh:]mm:ss[.cc]) a segundos."""
+    days = 0
+    if '-' in value:
+        day_part, value = value.split('-', 1)
+        days = int(day_part)
+    seconds = 0.0
+    for part in value.split(':'):
+        seconds = seconds * 60 + float(part)
+    return days * 86400 + seconds
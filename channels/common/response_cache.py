@@ -0,0 +1,182 @@
+"""
+Caché de respuestas del Claude CLI para preguntas repetidas.
+
+Preguntas como "qué hay en el sprint actual" o "lista los workflows" llegan
+una y otra vez por los tres canales, y cada una lanza una sesión completa del
+CLI con sus llamadas a MCPs. `ResponseCache` guarda la salida de las
+ejecuciones que abren sesión nueva (sin `-c`) y la devuelve si llega el mismo
+prompt:
+
+- La clave es el prompt normalizado (mayúsculas y espacios) más una huella
+  de CLAUDE.md y docs/ (ruta, tamaño y mtime de cada fichero): si cambia el
+  contexto del workspace, las entradas anteriores dejan de coincidir.
+- Las entradas caducan tras `ttl` segundos y se expulsan por LRU cuando el
+  total supera `max_bytes`.
+- Un mensaje que empieza por `!nocache` se ejecuta siempre (ver `split_bypass`).
+
+Es opt-in: cada canal la activa con RESPONSE_CACHE_ENABLED.
+"""
+
+import hashlib
+import os
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+# Prefijo para saltarse la caché en una consulta concreta
+BYPASS_PREFIX = '!nocache'
+
+# Rutas del workspace que forman parte de la huella por defecto
+DEFAULT_FINGERPRINT_PATHS = ('CLAUDE.md', 'docs')
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Normaliza el prompt para que variaciones triviales compartan entrada."""
+    text = unicodedata.normalize('NFKC', prompt).casefold()
+    return ' '.join(text.split())
+
+
+def split_bypass(prompt: str) -> tuple[str, bool]:
+    """Quita el prefijo `!nocache` si está: devuelve (prompt, saltar_caché)."""
+    stripped = prompt.lstrip()
+    if stripped[:len(BYPASS_PREFIX)].lower() == BYPASS_PREFIX:
+        return stripped[len(BYPASS_PREFIX):].lstrip(), True
+    return prompt, False
+
+
+class ResponseCache:
+    """Caché LRU con TTL y límite en bytes, segura entre hilos."""
+
+    def __init__(
+        self,
+        root: str,
+        ttl: float = 3600.0,
+        max_bytes: int = 5_000_000,
+        fingerprint_paths: Iterable[str] = DEFAULT_FINGERPRINT_PATHS,
+        fingerprint_interval: float = 30.0,
+    ):
+        """
+        Args:
+            root: Directorio del workspace (donde están CLAUDE.md y docs/)
+            ttl: Segundos de validez de una entrada
+            max_bytes: Tamaño máximo total de las respuestas guardadas
+            fingerprint_paths: Ficheros/directorios (relativos a root) de la huella
+            fingerprint_interval: Segundos que se reutiliza la huella antes de recalcularla
+        """
+        self.root = root
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.fingerprint_paths = tuple(fingerprint_paths)
+        self.fingerprint_interval = fingerprint_interval
+
+        self._entries: OrderedDict[str, tuple[float, str, int]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._fingerprint: Optional[str] = None
+        self._fingerprint_at = 0.0
+
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    # ---------- API ----------
+
+    def get(self, prompt: str) -> Optional[str]:
+        """Devuelve la respuesta guardada para el prompt, o None."""
+        key = self._key(prompt)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] > self.ttl:
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, prompt: str, response: str):
+        """Guarda una respuesta (se ignora si por sí sola supera max_bytes)."""
+        size = len(response.encode('utf-8'))
+        if not response.strip() or size > self.max_bytes:
+            return
+        key = self._key(prompt)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic(), response, size)
+            self._bytes += size
+            self.stores += 1
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'stores': self.stores,
+                'evictions': self.evictions,
+            }
+
+    def format_stats(self) -> str:
+        """Resumen de una línea para los comandos de estado."""
+        s = self.stats()
+        return (
+            f"{s['entries']} entradas ({s['bytes'] / 1024:.0f} KB) · "
+            f"{s['hits']} aciertos / {s['misses']} fallos ({s['hit_rate']:.0%})"
+        )
+
+    # ---------- Interno ----------
+
+    def _key(self, prompt: str) -> str:
+        raw = f"{self._workspace_fingerprint()}\0{normalize_prompt(prompt)}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _workspace_fingerprint(self) -> str:
+        now = time.monotonic()
+        if self._fingerprint is not None and now - self._fingerprint_at < self.fingerprint_interval:
+            return self._fingerprint
+
+        digest = hashlib.sha256()
+        for rel in self.fingerprint_paths:
+            path = os.path.join(self.root, rel)
+            if os.path.isdir(path):
+                for dirpath, dirnames, filenames in os.walk(path):
+                    dirnames.sort()
+                    for name in sorted(filenames):
+                        self._hash_file(digest, os.path.join(dirpath, name))
+            else:
+                self._hash_file(digest, path)
+
+        self._fingerprint = digest.hexdigest()
+        self._fingerprint_at = now
+        return self._fingerprint
+
+    def _hash_file(self, digest, path: str):
+        try:
+            st = os.stat(path)
+            digest.update(f"{os.path.relpath(path, self.root)}:{st.st_size}:{st.st_mtime_ns}\n".encode())
+        except OSError:
+            digest.update(f"{os.path.relpath(path, self.root)}:-\n".encode())
+
+    def _drop(self, key: str):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
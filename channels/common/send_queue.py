@@ -0,0 +1,222 @@
+"""
+Cola de envíos salientes con ritmo por chat y global.
+
+Los bots envían y editan mensajes en ráfagas (respuestas largas, varias
+ejecuciones a la vez) y las plataformas responden con 429 / RetryAfter en
+cuanto se pasa de su límite. `SendQueue` centraliza todos los envíos:
+
+- Cada chat tiene su propia cola (el orden dentro del chat se respeta) y su
+  cubo de tokens; además hay un cubo global para todo el bot.
+- Si la plataforma pide esperar (`retry_delay` devuelve segundos), se
+  reintenta solo el envío que falló, tras la espera indicada.
+- Una edición pendiente con la misma `key` que una nueva se sustituye (solo
+  importa el último texto del mensaje).
+
+Los textos largos no se fusionan aquí: `MarkdownChunker` ya llena cada parte
+hasta el límite del mensaje. `benchmarks/bench_send_queue.py` compara
+llamadas, 429 y tiempo con y sin la cola.
+
+El cliente de cada plataforma se pasa como funciones async; la cola no
+depende de ninguna librería de bots.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Cubo de tokens asyncio: `rate` envíos por segundo con ráfagas de hasta `burst`."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """Espera hasta tener un token y lo consume (en orden de llegada)."""
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Vacía el cubo para que el siguiente token llegue dentro de `seconds`."""
+        if self.rate <= 0:
+            return
+        self._refill()
+        self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+
+    @property
+    def idle(self) -> bool:
+        """True si el cubo está lleno (se puede descartar sin perder estado)."""
+        self._refill()
+        return self.tokens >= self.burst
+
+
+class _Item:
+    """Un envío en cola; el llamante puede cambiar si se sustituye."""
+
+    def __init__(self, send: Callable[[], Awaitable], future: asyncio.Future, key: Optional[Hashable] = None):
+        self.send = send
+        self.future = future
+        self.key = key
+
+    def resolve(self, result: Any = None, error: Optional[BaseException] = None):
+        if self.future.done():
+            return
+        if error is not None:
+            self.future.set_exception(error)
+        else:
+            self.future.set_result(result)
+
+
+class SendQueue:
+    """Cola de envíos por chat con cubos de tokens, reintentos y sustitución de ediciones."""
+
+    def __init__(
+        self,
+        global_rate: float = 25.0,
+        global_burst: int = 25,
+        chat_limits: Optional[Callable[[Hashable], tuple[float, int]]] = None,
+        retry_delay: Optional[Callable[[BaseException, int], Optional[float]]] = None,
+        max_retries: int = 5,
+    ):
+        """
+        Args:
+            global_rate: Envíos por segundo de todo el bot (0 = sin límite)
+            global_burst: Ráfaga máxima global
+            chat_limits: Función chat_id -> (envíos por segundo, ráfaga) del chat
+            retry_delay: Función (error, intento) -> segundos antes de reintentar,
+                o None si el error no se reintenta
+            max_retries: Reintentos máximos por envío
+        """
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.chat_limits = chat_limits or (lambda chat_id: (1.0, 3))
+        self.retry_delay = retry_delay or (lambda error, attempt: None)
+        self.max_retries = max_retries
+
+        self._queues: dict[Hashable, deque[_Item]] = {}
+        self._buckets: dict[Hashable, TokenBucket] = {}
+        self._tasks: dict[Hashable, asyncio.Task] = {}
+
+        self.sent = 0
+        self.retried = 0
+        self.superseded = 0
+        self.failed = 0
+
+    # ---------- API ----------
+
+    async def submit(self, chat_id: Hashable, send: Callable[[], Awaitable], key: Optional[Hashable] = None) -> Any:
+        """
+        Encola `send()` para el chat y devuelve su resultado.
+
+        Con `key`, sustituye un envío pendiente con la misma clave (p.ej. la
+        edición de un mensaje): el llamante sustituido recibe None.
+
+        Raises:
+            La excepción de `send()` si no es reintentable o se agotan los reintentos
+        """
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues.setdefault(chat_id, deque())
+
+        if key is not None:
+            for item in queue:
+                if item.key == key:
+                    item.resolve(None)
+                    item.send = send
+                    item.future = future
+                    self.superseded += 1
+                    return await future
+
+        queue.append(_Item(send, future, key))
+        self._ensure_worker(chat_id)
+        return await future
+
+    def stats(self) -> dict:
+        return {
+            'pending': sum(len(q) for q in self._queues.values()),
+            'chats': len(self._queues),
+            'sent': self.sent,
+            'retried': self.retried,
+            'superseded': self.superseded,
+            'failed': self.failed,
+        }
+
+    def format_stats(self) -> str:
+        """Resumen de una línea para los comandos de estado."""
+        s = self.stats()
+        return (
+            f"{s['sent']} enviados · {s['pending']} en cola · {s['retried']} reintentos · "
+            f"{s['superseded']} ediciones sustituidas · {s['failed']} fallidos"
+        )
+
+    # ---------- Interno ----------
+
+    def _ensure_worker(self, chat_id: Hashable):
+        if chat_id not in self._tasks:
+            self._tasks[chat_id] = asyncio.create_task(self._drain(chat_id))
+
+    def _bucket(self, chat_id: Hashable) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            # Olvidar los chats inactivos con el cubo ya lleno
+            for other in [c for c, b in self._buckets.items() if c not in self._queues and b.idle]:
+                del self._buckets[other]
+            rate, burst = self.chat_limits(chat_id)
+            bucket = self._buckets[chat_id] = TokenBucket(rate, burst)
+        return bucket
+
+    async def _drain(self, chat_id: Hashable):
+        queue = self._queues[chat_id]
+        bucket = self._bucket(chat_id)
+        try:
+            while queue:
+                # El envío sigue en la cola mientras espera tokens: aún se puede
+                # sustituir por una edición posterior
+                await bucket.acquire()
+                await self.global_bucket.acquire()
+                item = queue.popleft()
+                item.key = None
+                await self._deliver(chat_id, item, bucket)
+        finally:
+            self._tasks.pop(chat_id, None)
+            if not queue:
+                self._queues.pop(chat_id, None)
+
+    async def _deliver(self, chat_id: Hashable, item: _Item, bucket: TokenBucket):
+        attempt = 0
+        while True:
+            try:
+                result = await item.send()
+            except Exception as e:
+                delay = self.retry_delay(e, attempt) if attempt < self.max_retries else None
+                if delay is None:
+                    self.failed += 1
+                    item.resolve(error=e)
+                    return
+                attempt += 1
+                self.retried += 1
+                logger.warning(f"[Envíos] Chat {chat_id}: {type(e).__name__}, reintento {attempt} en {delay:.1f}s")
+                bucket.pause(delay)
+                await asyncio.sleep(delay)
+                continue
+            self.sent += 1
+            item.resolve(result)
+            return
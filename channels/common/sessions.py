@@ -0,0 +1,148 @@
+"""
+Sesiones del Claude CLI por conversación.
+
+Con `-c` el CLI retoma la conversación más reciente del workspace, que es
+compartido: si dos usuarios escriben a la vez, cada uno continúa la del otro.
+`SessionStore` guarda el session id de cada conversación (usuario de
+Telegram, hilo de Slack, pestaña del chat web) y los canales la retoman con
+`--resume <id>` (ver `resume_args`).
+
+El id de una sesión nueva se conoce antes de lanzar el CLI: el pool de workers
+arranca cada proceso con `--session-id <uuid>` (`ClaudeWorkerPool(...,
+session_ids=True)`). En modo stream-json el evento `init` lo confirma y manda
+sobre el asignado.
+
+Con `path` el mapa se guarda en JSON (escritura atómica) en cada cambio para
+que las conversaciones sobrevivan a un reinicio del bot. Son unas pocas
+decenas de entradas, así que la escritura es inmediata.
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Flag del CLI para retomar una sesión concreta
+RESUME_FLAG = '--resume'
+
+
+def resume_args(session_id: Optional[str]) -> list[str]:
+    """Argumentos para retomar `session_id` (vacío si no hay sesión)."""
+    return [RESUME_FLAG, session_id] if session_id else []
+
+
+class SessionStore:
+    """Mapa conversación → session id del CLI, seguro entre hilos, LRU y opcionalmente persistido."""
+
+    def __init__(self, path: Optional[str] = None, max_entries: int = 1000):
+        """
+        Args:
+            path: Fichero JSON donde persistir el mapa (None = solo memoria)
+            max_entries: Conversaciones recordadas antes de olvidar la más antigua
+        """
+        self.path = os.path.abspath(os.path.expanduser(path)) if path else None
+        self.max_entries = max(1, max_entries)
+        self._sessions: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self.resumed = 0
+        if self.path:
+            self._load()
+
+    def get(self, key: Hashable) -> Optional[str]:
+        """Session id de la conversación, o None si no hay."""
+        with self._lock:
+            session_id = self._sessions.get(str(key))
+            if session_id is not None:
+                self._sessions.move_to_end(str(key))
+                self.resumed += 1
+            return session_id
+
+    def set(self, key: Hashable, session_id: str):
+        """Asocia la conversación a `session_id` (se ignora si no hay id)."""
+        if not session_id:
+            return
+        with self._lock:
+            if self._sessions.get(str(key)) == session_id:
+                self._sessions.move_to_end(str(key))
+                return
+            self._sessions[str(key)] = session_id
+            self._sessions.move_to_end(str(key))
+            while len(self._sessions) > self.max_entries:
+                self._sessions.popitem(last=False)
+        self._persist()
+
+    def pop(self, key: Hashable) -> Optional[str]:
+        """Olvida la conversación (p.ej. /new); devuelve el id que tenía."""
+        with self._lock:
+            session_id = self._sessions.pop(str(key), None)
+        if session_id is not None:
+            self._persist()
+        return session_id
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return str(key) in self._sessions
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'max_entries': self.max_entries,
+                'resumed': self.resumed,
+                'persistent': bool(self.path),
+            }
+
+    def format_stats(self) -> str:
+        """Resumen de una línea para los comandos de estado."""
+        s = self.stats()
+        return (
+            f"{s['sessions']} conversaciones · {s['resumed']} retomadas"
+            f"{' · persistente' if s['persistent'] else ''}"
+        )
+
+    def _persist(self):
+        if not self.path:
+            return
+        # La foto se toma dentro del lock de escritura: nunca se pisa una más nueva
+        with self._save_lock:
+            with self._lock:
+                snapshot = list(self._sessions.items())
+            directory = os.path.dirname(self.path)
+            try:
+                os.makedirs(directory, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.sessions-')
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(snapshot, f)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                logger.warning(f"[Sesiones] No se pudo guardar {self.path}: {e}")
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                items = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"[Sesiones] No se pudo leer {self.path}: {e}")
+            return
+        # JSON válido pero con otra forma (editado a mano, otra versión): como si estuviera corrupto
+        if not isinstance(items, list) or not all(
+            isinstance(item, list) and len(item) == 2 and all(isinstance(v, str) for v in item) for item in items
+        ):
+            logger.warning(f"[Sesiones] No se pudo leer {self.path}: se esperaba una lista de pares de textos")
+            return
+        # El fichero guarda las conversaciones de la menos a la más reciente
+        for key, session_id in items[-self.max_entries:]:
+            self._sessions[key] = session_id
+        logger.info(f"[Sesiones] {len(self._sessions)} conversaciones restauradas de {self.path}")
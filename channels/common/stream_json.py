@@ -0,0 +1,166 @@
+"""
+Parser de la salida `--output-format stream-json` del Claude CLI.
+
+En modo texto el executor solo ve stdout plano (con códigos ANSI) y no
+distingue la respuesta del asistente de las llamadas a herramientas ni del
+resultado final. Con `--output-format stream-json --verbose
+--include-partial-messages` el CLI escribe un objeto JSON por línea (NDJSON);
+`StreamJsonParser` los convierte en eventos tipados para los callbacks de
+los canales:
+
+- `init`: arranque de la sesión (`session_id`)
+- `text_delta`: fragmento de texto del asistente (`text`)
+- `tool_use_start` / `tool_use_end`: llamada a una herramienta o MCP (`tool`, `tool_id`)
+- `result`: fin de la ejecución (`text` con la respuesta completa, `is_error`)
+- `usage`: tokens y coste de la ejecución (`data`)
+- `raw`: línea que no es JSON (avisos del CLI), se pasa tal cual en `text`
+"""
+
+import json
+from dataclasses import dataclass, field
+from typing import Optional
+
+# Flags del CLI para activar este modo
+STREAM_JSON_FLAGS = ['--output-format', 'stream-json', '--verbose', '--include-partial-messages']
+
+
+@dataclass
+class StreamEvent:
+    kind: str
+    text: str = ''
+    tool: Optional[str] = None
+    tool_id: Optional[str] = None
+    is_error: bool = False
+    session_id: Optional[str] = None
+    data: dict = field(default_factory=dict)
+
+
+class StreamJsonParser:
+    """Convierte líneas NDJSON del CLI en `StreamEvent`s."""
+
+    def __init__(self):
+        self.session_id: Optional[str] = None
+        # Si el CLI emite deltas parciales, los mensajes `assistant` completos
+        # repiten el mismo texto y se ignoran
+        self._partial = False
+        self._tool_names: dict[str, str] = {}
+
+    def feed_line(self, line: str) -> list[StreamEvent]:
+        line = line.strip()
+        if not line:
+            return []
+        try:
+            message = json.loads(line)
+        except json.JSONDecodeError:
+            return [StreamEvent('raw', text=line)]
+        if not isinstance(message, dict):
+            return [StreamEvent('raw', text=line)]
+
+        if message.get('session_id'):
+            self.session_id = message['session_id']
+
+        handler = getattr(self, f"_on_{message.get('type', '')}", None)
+        return handler(message) if handler else []
+
+    # ---------- Tipos de mensaje ----------
+
+    def _on_system(self, message: dict) -> list[StreamEvent]:
+        if message.get('subtype') != 'init':
+            return []
+        return [StreamEvent('init', session_id=message.get('session_id'), data=message)]
+
+    def _on_stream_event(self, message: dict) -> list[StreamEvent]:
+        self._partial = True
+        event = message.get('event') or {}
+        event_type = event.get('type')
+
+        if event_type == 'content_block_delta':
+            delta = event.get('delta') or {}
+            if delta.get('type') == 'text_delta' and delta.get('text'):
+                return [StreamEvent('text_delta', text=delta['text'])]
+        elif event_type == 'content_block_start':
+            block = event.get('content_block') or {}
+            if block.get('type') in ('tool_use', 'server_tool_use', 'mcp_tool_use'):
+                return [self._tool_start(block)]
+        return []
+
+    def _on_assistant(self, message: dict) -> list[StreamEvent]:
+        if self._partial:
+            return []
+        events = []
+        for block in (message.get('message') or {}).get('content') or []:
+            if block.get('type') == 'text' and block.get('text'):
+                events.append(StreamEvent('text_delta', text=block['text']))
+            elif block.get('type') == 'tool_use':
+                events.append(self._tool_start(block))
+        return events
+
+    def _on_user(self, message: dict) -> list[StreamEvent]:
+        content = (message.get('message') or {}).get('content')
+        if not isinstance(content, list):
+            return []
+        events = []
+        for block in content:
+            if block.get('type') == 'tool_result':
+                tool_id = block.get('tool_use_id')
+                events.append(StreamEvent(
+                    'tool_use_end',
+                    tool=self._tool_names.pop(tool_id, None),
+                    tool_id=tool_id,
+                    is_error=bool(block.get('is_error')),
+                ))
+        return events
+
+    def _on_result(self, message: dict) -> list[StreamEvent]:
+        is_error = bool(message.get('is_error')) or message.get('subtype') not in (None, 'success')
+        events = [StreamEvent(
+            'result',
+            text=message.get('result') or '',
+            is_error=is_error,
+            session_id=message.get('session_id'),
+            data=message,
+        )]
+        usage = dict(message.get('usage') or {})
+        for key in ('total_cost_usd', 'duration_ms', 'duration_api_ms', 'num_turns'):
+            if key in message:
+                usage[key] = message[key]
+        if usage:
+            events.append(StreamEvent('usage', session_id=message.get('session_id'), data=usage))
+        return events
+
+    # ---------- Interno ----------
+
+    def _tool_start(self, block: dict) -> StreamEvent:
+        tool_id = block.get('id')
+        name = block.get('name')
+        if tool_id:
+            self._tool_names[tool_id] = name
+        return StreamEvent('tool_use_start', tool=name, tool_id=tool_id, data=block.get('input') or {})
+
+
+def extract_text(output: str) -> tuple[str, list[StreamEvent]]:
+    """Procesa una salida stream-json completa: devuelve (texto del asistente, eventos)."""
+    parser = StreamJsonParser()
+    events = []
+    for line in output.splitlines():
+        events.extend(parser.feed_line(line))
+
+    # Los deltas seguidos son un mismo turno; cualquier otro evento (herramientas,
+    # líneas sueltas) lo cierra. Los turnos y las líneas van en líneas distintas
+    turns, current = [], []
+    for event in events:
+        if event.kind == 'text_delta':
+            current.append(event.text)
+            continue
+        if current:
+            turns.append(''.join(current))
+            current = []
+        if event.kind == 'raw':
+            turns.append(event.text)
+    if current:
+        turns.append(''.join(current))
+    text = '\n'.join(turns)
+    if not text.strip():
+        # Sin deltas (p.ej. el CLI solo devolvió el resultado final)
+        text = next((e.text for e in events if e.kind == 'result'), '')
+    return text, events
@@ -0,0 +1,235 @@
+"""
+Caché incremental del contexto de los hilos de Slack.
+
+Cada mensaje en un hilo se responde con el contexto de los mensajes
+anteriores. Descargar el hilo entero con `conversations.replies` en cada
+turno repite la descarga de los mismos mensajes, y sin paginar un hilo largo
+se queda sin los más recientes. `ThreadContextCache` guarda, por
+`(canal, thread_ts)`, los mensajes ya formateados y el `ts` del último, y en
+cada turno descarga solo los nuevos (normalmente en una llamada, como antes):
+
+- `refresh()` pide solo las respuestas posteriores a ese `ts` (`oldest`) y
+  sigue `response_metadata.next_cursor` hasta el final, así que un hilo de
+  más de una página llega completo
+- los hilos que no se usan se expulsan por LRU pasados `max_threads`, y de
+  cada hilo se guardan como mucho los `max_messages` más recientes
+- `forget_since()` descarta los mensajes desde un `ts`: las respuestas del bot
+  se editan en vivo y una copia descargada a medias no debe quedarse. Cada
+  hilo lleva una generación que `forget_since()` incrementa; si cambia
+  mientras `refresh()` espera a la API, la página se descarta y se vuelve a
+  pedir desde el nuevo cursor
+
+Las ediciones posteriores de mensajes ya guardados no se ven hasta que el
+hilo sale de la caché.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Callable, Iterable, Optional
+
+# Mensajes por llamada a conversations.replies (Slack recomienda como mucho 200)
+PAGE_SIZE = 200
+
+
+def ts_key(ts: str) -> tuple:
+    """`ts` de Slack ("1712345678.000100") como tupla comparable sin perder precisión."""
+    seconds, _, micros = (ts or '0').partition('.')
+    return int(seconds or 0), int(micros or 0)
+
+
+class _Thread:
+    __slots__ = ('latest', 'messages', 'generation')
+
+    def __init__(self):
+        self.latest: Optional[str] = None          # ts del último mensaje visto (el cursor)
+        self.messages: list[tuple[str, str]] = []  # (ts, texto formateado), en orden
+        self.generation = 0                        # Se incrementa en cada forget_since()
+
+
+class ThreadContextCache:
+    """Mensajes formateados de cada hilo, con descarga incremental y expulsión LRU."""
+
+    def __init__(self, max_threads: int = 500, max_messages: int = 500, page_size: int = PAGE_SIZE):
+        """
+        Args:
+            max_threads: Hilos guardados como mucho (se expulsa el usado hace más tiempo)
+            max_messages: Mensajes guardados por hilo (los más recientes)
+            page_size: Mensajes por llamada a conversations.replies
+        """
+        self.max_threads = max(1, max_threads)
+        self.max_messages = max(1, max_messages)
+        self.page_size = page_size
+        self._threads: OrderedDict[tuple[str, str], _Thread] = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0        # Turnos en hilos que ya estaban en la caché
+        self.misses = 0
+        self.api_calls = 0
+        self.fetched = 0     # Mensajes nuevos descargados
+        self.discarded = 0   # Páginas descartadas por un forget_since() durante la descarga
+        self.evictions = 0
+
+    # ---------- API ----------
+
+    async def refresh(
+        self,
+        client,
+        channel: str,
+        thread_ts: str,
+        format_message: Callable[[dict], Optional[str]],
+    ) -> list[tuple[str, str]]:
+        """
+        Descarga las respuestas nuevas del hilo y devuelve todos sus mensajes.
+
+        Args:
+            client: `AsyncWebClient` de Slack (o cualquier objeto con `conversations_replies`)
+            channel: ID del canal
+            thread_ts: ts del mensaje padre del hilo
+            format_message: Mensaje de la API → texto para el contexto (None = no incluirlo)
+
+        Returns:
+            Lista de (ts, texto) en orden. Si una llamada falla, la excepción se
+            propaga y lo ya descargado queda guardado.
+        """
+        oldest, generation = self._begin(channel, thread_ts, count=True)
+        cursor = None
+        while True:
+            result = await client.conversations_replies(
+                channel=channel,
+                ts=thread_ts,
+                oldest=oldest,
+                cursor=cursor,
+                limit=self.page_size,
+            )
+            self.api_calls += 1
+            # Con `oldest` Slack devuelve igualmente el mensaje padre: extend() lo ignora
+            stored = self.extend(channel, thread_ts, (
+                (message.get('ts', ''), format_message(message)) for message in result.get('messages', [])
+            ), generation=generation)
+            if not stored:
+                # forget_since() durante la llamada: la página puede traer una
+                # respuesta a medio editar, volver a pedir desde el nuevo cursor
+                oldest, generation = self._begin(channel, thread_ts, count=False)
+                cursor = None
+                continue
+            cursor = (result.get('response_metadata') or {}).get('next_cursor')
+            if not cursor:
+                break
+        return self.messages(channel, thread_ts)
+
+    def cursor(self, channel: str, thread_ts: str) -> Optional[str]:
+        """ts del último mensaje guardado del hilo (None si no está en la caché)."""
+        with self._lock:
+            thread = self._threads.get((channel, thread_ts))
+            return thread.latest if thread else None
+
+    def extend(
+        self,
+        channel: str,
+        thread_ts: str,
+        messages: Iterable[tuple[str, Optional[str]]],
+        generation: Optional[int] = None,
+    ) -> bool:
+        """
+        Agrega mensajes (ts, texto) en orden; se ignoran los que no son posteriores al cursor.
+
+        Con `generation`, no guarda nada si el hilo cambió de generación (o salió
+        de la caché) desde que se leyó el cursor.
+
+        Returns:
+            True si se guardaron los mensajes
+        """
+        key = (channel, thread_ts)
+        with self._lock:
+            thread = self._threads.get(key)
+            if generation is not None and (thread is None or thread.generation != generation):
+                self.discarded += 1
+                return False
+            if thread is None:
+                thread = self._add(key)
+            self._threads.move_to_end(key)
+            latest = ts_key(thread.latest) if thread.latest else None
+            for ts, text in messages:
+                if not ts or (latest is not None and ts_key(ts) <= latest):
+                    continue
+                latest = ts_key(ts)
+                thread.latest = ts
+                self.fetched += 1
+                if text:
+                    thread.messages.append((ts, text))
+            del thread.messages[:-self.max_messages]
+            return True
+
+    def messages(self, channel: str, thread_ts: str) -> list[tuple[str, str]]:
+        with self._lock:
+            thread = self._threads.get((channel, thread_ts))
+            return list(thread.messages) if thread else []
+
+    def forget_since(self, channel: str, thread_ts: str, ts: str):
+        """Descarta los mensajes del hilo desde `ts` (inclusive) para volver a descargarlos."""
+        with self._lock:
+            thread = self._threads.get((channel, thread_ts))
+            if thread is None:
+                return
+            # Aunque aún no se haya guardado nada desde `ts`, una descarga en
+            # curso puede traerlo a medias
+            thread.generation += 1
+            if thread.latest is None or ts_key(thread.latest) < ts_key(ts):
+                return
+            since = ts_key(ts)
+            thread.messages = [m for m in thread.messages if ts_key(m[0]) < since]
+            # Sin mensajes previos no se sabe hasta dónde llega lo descartado: descargar de nuevo
+            thread.latest = thread.messages[-1][0] if thread.messages else None
+
+    def clear(self):
+        with self._lock:
+            self._threads.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'threads': len(self._threads),
+                'max_threads': self.max_threads,
+                'messages': sum(len(t.messages) for t in self._threads.values()),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'api_calls': self.api_calls,
+                'fetched': self.fetched,
+                'discarded': self.discarded,
+                'evictions': self.evictions,
+            }
+
+    def format_stats(self) -> str:
+        """Resumen de una línea para los comandos de estado."""
+        s = self.stats()
+        return (
+            f"{s['threads']}/{s['max_threads']} hilos ({s['messages']} mensajes) · "
+            f"{s['hits']} aciertos / {s['misses']} fallos ({s['hit_rate']:.0%}) · "
+            f"{s['fetched']} mensajes descargados en {s['api_calls']} llamadas"
+        )
+
+    # ---------- Interno ----------
+
+    def _add(self, key: tuple[str, str]) -> _Thread:
+        thread = self._threads[key] = _Thread()
+        while len(self._threads) > self.max_threads:
+            self._threads.popitem(last=False)
+            self.evictions += 1
+        return thread
+
+    def _begin(self, channel: str, thread_ts: str, count: bool) -> tuple[Optional[str], int]:
+        """Cursor y generación del hilo; lo registra si no estaba para seguir su generación."""
+        key = (channel, thread_ts)
+        with self._lock:
+            thread = self._threads.get(key)
+            if count:
+                if thread is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+            if thread is None:
+                thread = self._add(key)
+            self._threads.move_to_end(key)
+            return thread.latest, thread.generation
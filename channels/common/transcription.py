@@ -0,0 +1,428 @@
+"""
+Transcripción de notas de voz fuera del event loop.
+
+Llamar a la API de Whisper dentro de un handler async bloquea el loop: mientras
+una nota de voz se transcribe, ningún otro usuario recibe respuesta. Aquí la
+transcripción se separa en dos piezas:
+
+- `TranscriptionBackend`: interfaz síncrona `transcribe(audio, filename,
+  language) -> str`. `OpenAIWhisperBackend` reutiliza un único cliente de
+  OpenAI (y su pool de conexiones HTTP) para todas las llamadas;
+  `LocalWhisperBackend` transcribe en la CPU con faster-whisper (modelo
+  cuantizado, cargado una sola vez) y entrega el texto por segmentos. En
+  pruebas y benchmarks se puede usar cualquier otra implementación local.
+- `TranscriptionPool`: ejecuta el backend en un pool acotado de hilos con un
+  timeout por audio y limita los audios en espera. Desde async basta con
+  `await pool.transcribe(audio)`. Con un `AudioPreprocessor` (ver
+  audio_preprocess.py) el audio se recorta y los trozos de una nota larga se
+  transcriben en paralelo.
+
+`TranscriptionCache` guarda las transcripciones por un identificador estable
+del audio (en Telegram, `file_unique_id`), de modo que una nota reenviada no se
+vuelve a transcribir.
+"""
+
+import asyncio
+import concurrent.futures
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Iterator, Optional
+
+from channels.common.audio_preprocess import AudioPreprocessor, prepare
+
+try:
+    from openai import OpenAI
+    OPENAI_AVAILABLE = True
+except ImportError:
+    OpenAI = None
+    OPENAI_AVAILABLE = False
+
+try:
+    from faster_whisper import WhisperModel
+    FASTER_WHISPER_AVAILABLE = True
+except ImportError:
+    WhisperModel = None
+    FASTER_WHISPER_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+
+class TranscriptionError(Exception):
+    """La transcripción falló, superó el timeout o no había sitio en la cola."""
+
+
+class TranscriptionBackend:
+    """Motor de transcripción. `transcribe()` es bloqueante y se llama desde hilos."""
+
+    name = 'base'
+    # True si `transcribe_segments` entrega texto antes de terminar todo el audio
+    streaming = False
+
+    def transcribe(self, audio: bytes, filename: str = 'voice.ogg', language: Optional[str] = None) -> str:
+        raise NotImplementedError
+
+    def transcribe_segments(self, audio: bytes, filename: str = 'voice.ogg', language: Optional[str] = None) -> Iterator[str]:
+        """Texto por segmentos según se transcribe; por defecto, todo de una vez."""
+        yield self.transcribe(audio, filename, language)
+
+    def describe(self) -> str:
+        """Descripción corta para los comandos de estado."""
+        return self.name
+
+    def close(self):
+        """Libera los recursos del backend (conexiones, modelos)."""
+
+
+class OpenAIWhisperBackend(TranscriptionBackend):
+    """Whisper vía la API de OpenAI con un cliente compartido entre hilos."""
+
+    name = 'openai'
+
+    def __init__(self, api_key: str, model: str = 'whisper-1', timeout: float = 120.0, max_retries: int = 1):
+        if not OPENAI_AVAILABLE:
+            raise TranscriptionError("OpenAI no está instalado. Instala con: pip install openai")
+        if not api_key:
+            raise TranscriptionError("Falta la API key de OpenAI")
+        self.model = model
+        # El cliente de OpenAI es seguro entre hilos y mantiene las conexiones abiertas
+        self.client = OpenAI(api_key=api_key, timeout=timeout, max_retries=max_retries)
+
+    def transcribe(self, audio: bytes, filename: str = 'voice.ogg', language: Optional[str] = None) -> str:
+        kwargs = {'language': language} if language else {}
+        transcript = self.client.audio.transcriptions.create(
+            model=self.model,
+            file=(filename, audio),
+            **kwargs
+        )
+        return transcript.text.strip()
+
+    def describe(self) -> str:
+        return f"OpenAI {self.model}"
+
+    def close(self):
+        self.client.close()
+
+
+class LocalWhisperBackend(TranscriptionBackend):
+    """Whisper en la CPU con faster-whisper (CTranslate2, pesos cuantizados a int8)."""
+
+    name = 'local'
+    streaming = True
+
+    def __init__(
+        self,
+        model: str = 'base',
+        device: str = 'cpu',
+        compute_type: str = 'int8',
+        cpu_threads: int = 0,
+        beam_size: int = 1,
+        vad_filter: bool = True,
+    ):
+        """
+        Args:
+            model: Tamaño del modelo (tiny, base, small...) o ruta a uno convertido
+            device: cpu o cuda
+            compute_type: Cuantización de los pesos (int8 es la más rápida en CPU)
+            cpu_threads: Hilos de CTranslate2 por transcripción (0 = automático)
+            beam_size: 1 = decodificación greedy, la más rápida
+            vad_filter: Saltar los tramos sin voz antes de decodificar
+        """
+        if not FASTER_WHISPER_AVAILABLE:
+            raise TranscriptionError("faster-whisper no está instalado. Instala con: pip install faster-whisper")
+        self.model_name = model
+        self.compute_type = compute_type
+        self.beam_size = beam_size
+        self.vad_filter = vad_filter
+        # Cargar el modelo cuesta segundos: se hace una vez y se comparte entre hilos
+        started = time.monotonic()
+        self.model = WhisperModel(model, device=device, compute_type=compute_type, cpu_threads=cpu_threads)
+        logger.info(f"[Transcripción] Modelo local {model} ({compute_type}) cargado en {time.monotonic() - started:.1f}s")
+
+    def transcribe_segments(self, audio: bytes, filename: str = 'voice.ogg', language: Optional[str] = None) -> Iterator[str]:
+        # faster-whisper decodifica de 30 en 30 segundos y genera los segmentos bajo demanda
+        segments, _ = self.model.transcribe(
+            io.BytesIO(audio),
+            language=language,
+            beam_size=self.beam_size,
+            vad_filter=self.vad_filter,
+        )
+        for segment in segments:
+            text = segment.text.strip()
+            if text:
+                yield text
+
+    def transcribe(self, audio: bytes, filename: str = 'voice.ogg', language: Optional[str] = None) -> str:
+        return ' '.join(self.transcribe_segments(audio, filename, language))
+
+    def describe(self) -> str:
+        return f"local {self.model_name} ({self.compute_type})"
+
+
+class TranscriptionPool:
+    """Pool acotado de hilos que ejecuta un `TranscriptionBackend` con timeout."""
+
+    def __init__(
+        self,
+        backend: TranscriptionBackend,
+        max_workers: int = 2,
+        timeout: float = 120.0,
+        max_pending: int = 16,
+        preprocessor: Optional[AudioPreprocessor] = None,
+    ):
+        """
+        Args:
+            backend: Motor de transcripción
+            max_workers: Transcripciones simultáneas (también trozos de un mismo audio)
+            timeout: Segundos máximos por audio (incluida la espera en cola)
+            max_pending: Audios en curso o en espera antes de rechazar nuevos
+            preprocessor: Recorta y divide el audio antes de transcribirlo (None = tal cual)
+        """
+        self.backend = backend
+        self.preprocessor = preprocessor
+        self.max_workers = max(1, max_workers)
+        self.timeout = timeout
+        self.max_pending = max(self.max_workers, max_pending)
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix='transcription'
+        )
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.total_seconds = 0.0
+
+    async def transcribe(
+        self,
+        audio: bytes,
+        filename: str = 'voice.ogg',
+        language: Optional[str] = None,
+        on_partial: Optional[Callable[[str], None]] = None,
+    ) -> str:
+        """
+        Transcribe `audio` en un hilo del pool sin bloquear el event loop.
+
+        Con `preprocessor`, el audio se recorta y los trozos se transcriben en
+        paralelo. Con `on_partial`, se llama en el event loop con el texto
+        acumulado cada vez que termina un trozo o, con un backend `streaming`,
+        un segmento.
+
+        Raises:
+            TranscriptionError: Si el backend falla, se supera el timeout o la cola está llena
+        """
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise TranscriptionError(f"Hay {self.pending} audios transcribiéndose, intenta en un momento")
+            self.pending += 1
+
+        started = time.monotonic()
+        stop = threading.Event()
+        try:
+            text = await asyncio.wait_for(
+                self._run(audio, filename, language, on_partial, stop),
+                timeout=self.timeout
+            )
+        except asyncio.TimeoutError:
+            # El hilo no se puede interrumpir: el backend acaba por su propio timeout
+            stop.set()
+            self.timeouts += 1
+            raise TranscriptionError(f"La transcripción superó {self.timeout:g}s")
+        except asyncio.CancelledError:
+            stop.set()
+            raise
+        except Exception as e:
+            self.failed += 1
+            raise TranscriptionError(str(e)) from e
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+        elapsed = time.monotonic() - started
+        self.completed += 1
+        self.total_seconds += elapsed
+        logger.info(f"[Transcripción] {len(audio)} bytes en {elapsed:.2f}s con {self.backend.describe()}")
+        return text
+
+    async def _run(
+        self,
+        audio: bytes,
+        filename: str,
+        language: Optional[str],
+        on_partial: Optional[Callable[[str], None]],
+        stop: threading.Event,
+    ) -> str:
+        loop = asyncio.get_running_loop()
+        chunks = [audio]
+        if self.preprocessor is not None:
+            chunks = await loop.run_in_executor(self._executor, prepare, self.preprocessor, audio)
+            if chunks[0] is not audio:
+                # Los trozos salen recodificados en OGG/Opus
+                filename = os.path.splitext(filename)[0] + '.ogg'
+
+        def transcribe_chunk(chunk: bytes, emit: Optional[Callable[[str], None]]) -> str:
+            # Un trozo que aún esperaba hilo cuando venció el timeout ya no se transcribe
+            if stop.is_set():
+                return ''
+            if emit is None:
+                return self.backend.transcribe(chunk, filename, language)
+            parts = []
+            for text in self.backend.transcribe_segments(chunk, filename, language):
+                # Los backends por segmentos se pueden cortar entre segmento y segmento
+                if stop.is_set():
+                    break
+                parts.append(text)
+                loop.call_soon_threadsafe(emit, ' '.join(parts))
+            return ' '.join(parts)
+
+        if len(chunks) == 1:
+            emit = on_partial if self.backend.streaming else None
+            return await loop.run_in_executor(self._executor, transcribe_chunk, chunks[0], emit)
+
+        # Varios trozos en paralelo; el texto parcial es el de los trozos iniciales ya terminados
+        texts: list[Optional[str]] = [None] * len(chunks)
+        shown = 0
+
+        async def run_chunk(index: int):
+            nonlocal shown
+            texts[index] = await loop.run_in_executor(self._executor, transcribe_chunk, chunks[index], None)
+            ready = 0
+            while ready < len(texts) and texts[ready] is not None:
+                ready += 1
+            if on_partial is not None and ready > shown:
+                shown = ready
+                on_partial(' '.join(t for t in texts[:ready] if t))
+
+        await asyncio.gather(*(run_chunk(i) for i in range(len(chunks))))
+        return ' '.join(t for t in texts if t)
+
+    def stats(self) -> dict:
+        return {
+            'backend': self.backend.describe(),
+            'workers': self.max_workers,
+            'pending': self.pending,
+            'completed': self.completed,
+            'failed': self.failed,
+            'timeouts': self.timeouts,
+            'rejected': self.rejected,
+            'avg_seconds': self.total_seconds / self.completed if self.completed else 0.0,
+        }
+
+    def format_stats(self) -> str:
+        """Resumen de una línea para los comandos de estado."""
+        s = self.stats()
+        return (
+            f"{s['backend']} · {s['pending']}/{s['workers']} en curso · {s['completed']} hechas "
+            f"({s['avg_seconds']:.1f}s media) · {s['failed'] + s['timeouts']} fallidas"
+        )
+
+    def shutdown(self):
+        """Descarta los audios en espera y libera el backend."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        try:
+            self.backend.close()
+        except Exception as e:
+            logger.debug(f"[Transcripción] Error cerrando el backend: {e}")
+
+
+class TranscriptionCache:
+    """Caché LRU de transcripciones, segura entre hilos y opcionalmente persistida en JSON."""
+
+    def __init__(self, max_entries: int = 256, path: Optional[str] = None):
+        """
+        Args:
+            max_entries: Transcripciones guardadas antes de expulsar la menos usada
+            path: Fichero JSON donde persistir la caché entre reinicios (None = solo memoria)
+        """
+        self.max_entries = max(1, max_entries)
+        self.path = path
+        self._entries: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if path:
+            self._load()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            text = self._entries.get(key)
+            if text is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return text
+
+    def put(self, key: str, text: str):
+        """Guarda una transcripción; con `path`, reescribe el fichero (llamar fuera del event loop)."""
+        if not text:
+            return
+        with self._lock:
+            self._entries[key] = text
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        if self.path:
+            # La foto se toma dentro del lock de escritura: nunca se pisa una más nueva
+            with self._save_lock:
+                with self._lock:
+                    snapshot = list(self._entries.items())
+                self._save(snapshot)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'evictions': self.evictions,
+                'persistent': bool(self.path),
+            }
+
+    def format_stats(self) -> str:
+        """Resumen de una línea para los comandos de estado."""
+        s = self.stats()
+        return f"{s['entries']}/{s['max_entries']} audios · {s['hits']} aciertos ({s['hit_rate']:.0%})"
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                items = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"[Transcripción] No se pudo leer la caché {self.path}: {e}")
+            return
+        # JSON válido pero con otra forma (editado a mano, otra versión): como si estuviera corrupto
+        if not isinstance(items, list) or not all(
+            isinstance(item, list) and len(item) == 2 and all(isinstance(v, str) for v in item) for item in items
+        ):
+            logger.warning(f"[Transcripción] No se pudo leer la caché {self.path}: se esperaba una lista de pares de textos")
+            return
+        # El fichero guarda las entradas de la menos a la más usada
+        for key, text in items[-self.max_entries:]:
+            self._entries[key] = text
+
+    def _save(self, items: list):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.transcriptions-')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(items, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"[Transcripción] No se pudo guardar la caché {self.path}: {e}")
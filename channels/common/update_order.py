@@ -0,0 +1,80 @@
+"""
+Orden por usuario para updates que se procesan en paralelo.
+
+Con varios updates a la vez, dos mensajes seguidos del mismo usuario podrían
+adelantarse (p.ej. un texto que llega mientras se transcribe la nota de voz
+anterior). `KeyedOrdering.run(key, coroutine)` ejecuta los updates de una misma
+clave en orden de llegada; los de claves distintas no se esperan entre sí.
+
+El orden solo hace falta hasta que el update entra en la cola de ejecuciones
+del usuario (que ya mantiene el suyo): el handler llama a `release_order()` en
+ese punto y el siguiente update del usuario puede empezar aunque la ejecución
+dure minutos. Si no lo llama, el turno se libera al terminar el handler.
+"""
+
+import asyncio
+import contextvars
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+_release: contextvars.ContextVar[Optional[Callable[[], None]]] = contextvars.ContextVar(
+    'update_order_release', default=None
+)
+
+
+def release_order():
+    """Cede el turno del update actual al siguiente de la misma clave (idempotente)."""
+    release = _release.get()
+    if release is not None:
+        release()
+
+
+class KeyedOrdering:
+    """Cerrojos FIFO por clave que se crean al llegar el primer update y se borran con el último."""
+
+    def __init__(self):
+        self._locks: dict[Hashable, asyncio.Lock] = {}
+        self._pending: dict[Hashable, int] = {}
+
+    async def run(self, key: Hashable, coroutine: Awaitable) -> Any:
+        """Espera el turno de `key` y ejecuta `coroutine` con `release_order()` disponible."""
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._pending[key] = self._pending.get(key, 0) + 1
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                lock.release()
+
+        try:
+            try:
+                # asyncio.Lock despierta a los que esperan en orden de llegada
+                await lock.acquire()
+            except BaseException:
+                if asyncio.iscoroutine(coroutine):
+                    coroutine.close()
+                raise
+            token = _release.set(release)
+            try:
+                return await coroutine
+            finally:
+                _release.reset(token)
+                release()
+        finally:
+            self._pending[key] -= 1
+            if not self._pending[key]:
+                del self._pending[key]
+                del self._locks[key]
+
+    def pending(self, key: Hashable) -> int:
+        """Updates de `key` en curso o esperando turno."""
+        return self._pending.get(key, 0)
+
+    def stats(self) -> dict:
+        return {
+            'keys': len(self._pending),
+            'pending': sum(self._pending.values()),
+        }
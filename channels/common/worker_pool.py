@@ -0,0 +1,400 @@
+"""
+Pool de procesos Claude CLI pre-arrancados.
+
+Cada mensaje lanzaba un `claude` nuevo y la respuesta tenía que esperar a que
+el CLI arrancara antes de leer el prompt. El pool mantiene procesos ya
+arrancados con `-p` sin prompt, bloqueados leyendo stdin, y los entrega en
+cuanto llega un mensaje: el prompt se envía por stdin (igual que hacía Slack
+para evitar el bug de `-p` con MCPs).
+
+Un proceso `claude -p` responde a un único prompt y termina, así que cada
+worker se usa una sola vez y el pool lo repone en segundo plano. Los workers
+que llevan más de `idle_ttl` segundos sin usarse se matan y se reemplazan
+para no servir procesos con configuración o credenciales antiguas.
+
+Solo se pre-arrancan procesos para el comando base (sesión nueva); los
+comandos con otros argumentos (p.ej. `--resume <id>`) se lanzan en frío al
+pedirlos. Con `session_ids=True` cada proceso del comando base arranca con su
+propio `--session-id <uuid>` (`worker.session_id`), así el canal sabe qué
+sesión abrió cada mensaje sin depender de la salida del CLI.
+
+El pool usa `subprocess.Popen` y es thread-safe, de modo que sirve tanto a los
+executors asyncio (Telegram, Web) como a los hilos del bot de Slack.
+
+Cada worker entregado lleva un `ResourceMonitor` que contabiliza (y, con
+`limits`, limita) la memoria, la CPU y los procesos hijos de su ejecución.
+El límite de CPU se fija al lanzar el proceso, así que en los workers
+pre-arrancados incluye el tiempo que pasaron esperando en el pool.
+"""
+
+import asyncio
+import logging
+import subprocess
+import threading
+import time
+import uuid
+from typing import Callable, Optional, Sequence
+
+from channels.common.resource_limits import ResourceLimits, ResourceMonitor, kill_tree
+
+logger = logging.getLogger(__name__)
+
+
+class PooledWorker:
+    """Proceso Claude CLI entregado por el pool para ejecutar un prompt."""
+
+    def __init__(self, process: subprocess.Popen, args: tuple, warm: bool, session_id: Optional[str] = None):
+        self.process = process
+        self.args = args
+        self.warm = warm
+        self.session_id = session_id
+        self.spawned_at = time.monotonic()
+        self.acquired_at: Optional[float] = None
+        self.first_byte_at: Optional[float] = None
+        self.stdout_bytes = 0
+        self.monitor: Optional[ResourceMonitor] = None
+        self._transports = []
+
+    @property
+    def pid(self) -> int:
+        return self.process.pid
+
+    @property
+    def returncode(self) -> Optional[int]:
+        return self.process.poll()
+
+    def is_alive(self) -> bool:
+        return self.process.poll() is None
+
+    @property
+    def ttfb(self) -> Optional[float]:
+        """Segundos desde que se pidió el worker hasta el primer byte de stdout."""
+        if self.acquired_at is None or self.first_byte_at is None:
+            return None
+        return self.first_byte_at - self.acquired_at
+
+    def mark_first_byte(self):
+        if self.first_byte_at is None:
+            self.first_byte_at = time.monotonic()
+
+    def note_output(self, chunk: bytes):
+        """Registra un bloque leído de stdout (primer byte y bytes totales)."""
+        self.mark_first_byte()
+        self.stdout_bytes += len(chunk)
+
+    def start_monitor(self, limits: ResourceLimits):
+        """Empieza a contabilizar (y limitar) los recursos de la ejecución."""
+        self.monitor = ResourceMonitor(self.pid, limits).start()
+
+    @property
+    def limit_exceeded(self) -> Optional[str]:
+        """'memory', 'cpu' o 'children' si la ejecución se mató por superar un límite."""
+        return self.monitor.exceeded if self.monitor else None
+
+    def usage(self) -> Optional[dict]:
+        """Pico de RSS, CPU y procesos hijos de la ejecución (ver ResourceMonitor.usage)."""
+        return self.monitor.usage() if self.monitor else None
+
+    def send_prompt(self, prompt: str):
+        """Escribe el prompt en stdin y lo cierra para que el CLI empiece."""
+        try:
+            self.process.stdin.write(prompt.encode('utf-8'))
+            self.process.stdin.close()
+        except BrokenPipeError:
+            # El proceso murió antes de leer el prompt; el returncode lo reflejará
+            logger.warning(f"[Pool] Worker {self.pid} cerró stdin antes de recibir el prompt")
+
+    async def open_streams(self) -> tuple[asyncio.StreamReader, asyncio.StreamReader]:
+        """Conecta stdout/stderr al event loop actual como StreamReaders."""
+        loop = asyncio.get_running_loop()
+        readers = []
+        for pipe in (self.process.stdout, self.process.stderr):
+            reader = asyncio.StreamReader(loop=loop)
+            transport, _ = await loop.connect_read_pipe(
+                lambda r=reader: asyncio.StreamReaderProtocol(r, loop=loop), pipe
+            )
+            self._transports.append(transport)
+            readers.append(reader)
+        return readers[0], readers[1]
+
+    async def wait(self) -> int:
+        """Espera a que el proceso termine sin bloquear el event loop."""
+        loop = asyncio.get_running_loop()
+        returncode = await loop.run_in_executor(None, self.process.wait)
+        self.close_streams()
+        self._stop_monitor(returncode)
+        return returncode
+
+    def run(
+        self,
+        prompt: str,
+        timeout: float,
+        on_stdout: Optional[Callable[[bytes], None]] = None,
+    ) -> tuple[str, str, int]:
+        """
+        Versión síncrona para hilos: envía el prompt y recoge toda la salida.
+
+        Con `on_stdout` cada chunk de stdout se entrega a medida que llega (desde
+        el hilo lector) y no se acumula: el stdout devuelto es ''.
+
+        Raises:
+            subprocess.TimeoutExpired: si el proceso supera `timeout` (ya está muerto)
+        """
+        stdout_chunks, stderr_chunks = [], []
+
+        def pump(pipe, sink, is_stdout):
+            for chunk in iter(lambda: pipe.read1(65536), b''):
+                if is_stdout:
+                    self.note_output(chunk)
+                    if on_stdout is not None:
+                        try:
+                            on_stdout(chunk)
+                        except Exception as e:
+                            logger.error(f"[Pool] Error procesando la salida del worker {self.pid}: {e}", exc_info=True)
+                        continue
+                sink.append(chunk)
+
+        readers = [
+            threading.Thread(target=pump, args=(self.process.stdout, stdout_chunks, True), daemon=True),
+            threading.Thread(target=pump, args=(self.process.stderr, stderr_chunks, False), daemon=True),
+        ]
+        for reader in readers:
+            reader.start()
+
+        self.send_prompt(prompt)
+        try:
+            returncode = self.process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self.kill()
+            raise
+        finally:
+            for reader in readers:
+                reader.join(timeout=5)
+
+        self._stop_monitor(returncode)
+        return (
+            b''.join(stdout_chunks).decode('utf-8', errors='replace'),
+            b''.join(stderr_chunks).decode('utf-8', errors='replace'),
+            returncode,
+        )
+
+    def kill(self):
+        """Mata el proceso y los hijos que haya lanzado (p.ej. servidores MCP)."""
+        descendants = self.monitor.descendants() if self.monitor else ()
+        if self.is_alive():
+            self.process.kill()
+        kill_tree(self.pid, descendants)
+        self.process.wait()
+        self.close_streams()
+        self._stop_monitor(self.process.returncode)
+
+    def _stop_monitor(self, returncode: Optional[int]):
+        if self.monitor is not None:
+            self.monitor.note_returncode(returncode)
+            self.monitor.stop()
+
+    def close_streams(self):
+        for transport in self._transports:
+            transport.close()
+        self._transports.clear()
+
+
+class ClaudeWorkerPool:
+    """
+    Mantiene `size` procesos Claude CLI arrancados y listos para recibir un prompt.
+
+    Con `size=0` el pool no pre-arranca nada y cada `acquire()` lanza el proceso
+    en frío, lo que permite comparar el time-to-first-byte con y sin pool.
+    """
+
+    def __init__(
+        self,
+        base_args: Sequence[str],
+        cwd: str,
+        env: Optional[dict] = None,
+        size: int = 2,
+        idle_ttl: float = 300.0,
+        limits: Optional[ResourceLimits] = None,
+        session_ids: bool = False,
+    ):
+        self.base_args = tuple(base_args)
+        self.cwd = cwd
+        self.env = env
+        self.size = max(0, size)
+        self.idle_ttl = idle_ttl
+        self.limits = limits or ResourceLimits()
+        self.session_ids = session_ids
+
+        self._idle: list[PooledWorker] = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        # Estadísticas de time-to-first-byte: {'warm': [n, total, last], 'cold': [...]}
+        self._ttfb = {'warm': [0, 0.0, None], 'cold': [0, 0.0, None]}
+        self._evicted = 0
+
+    # ---------- Ciclo de vida ----------
+
+    def start(self):
+        """Arranca el hilo que repone y expira workers."""
+        if self.size == 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._maintain, name='claude-worker-pool', daemon=True)
+        self._thread.start()
+        logger.info(f"[Pool] Iniciado con {self.size} worker(s), idle TTL {self.idle_ttl:.0f}s")
+
+    def shutdown(self):
+        """Detiene el mantenimiento y mata los workers en espera."""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            try:
+                worker.kill()
+            except Exception as e:
+                logger.debug(f"[Pool] Error matando worker {worker.pid}: {e}")
+
+    # ---------- API ----------
+
+    def acquire(self, args: Optional[Sequence[str]] = None) -> PooledWorker:
+        """
+        Entrega un worker para `args` (por defecto el comando base).
+
+        Si hay uno pre-arrancado y vivo se entrega al instante; si no, se lanza uno en frío.
+
+        Raises:
+            FileNotFoundError: si el ejecutable del CLI no existe
+        """
+        args = tuple(args) if args is not None else self.base_args
+        worker = None
+
+        if args == self.base_args:
+            with self._lock:
+                while self._idle:
+                    candidate = self._idle.pop(0)
+                    if candidate.is_alive():
+                        worker = candidate
+                        break
+                    logger.warning(f"[Pool] Worker {candidate.pid} murió en espera (código {candidate.returncode})")
+            # Reponer el hueco cuanto antes
+            self._wakeup.set()
+
+        if worker is None:
+            worker = self._spawn(args, warm=False)
+
+        worker.acquired_at = time.monotonic()
+        worker.start_monitor(self.limits)
+        return worker
+
+    def release(self, worker: PooledWorker):
+        """Registra las métricas de un worker ya usado (no vuelve al pool)."""
+        ttfb = worker.ttfb
+        if ttfb is None:
+            return
+        kind = 'warm' if worker.warm else 'cold'
+        with self._lock:
+            entry = self._ttfb[kind]
+            entry[0] += 1
+            entry[1] += ttfb
+            entry[2] = ttfb
+        logger.info(f"[Pool] TTFB {ttfb:.2f}s ({kind}, pid {worker.pid})")
+
+    def stats(self) -> dict:
+        """Estado del pool y time-to-first-byte medio con y sin worker pre-arrancado."""
+        with self._lock:
+            idle = sum(1 for w in self._idle if w.is_alive())
+            ttfb = {
+                kind: {
+                    'count': count,
+                    'avg': (total / count) if count else None,
+                    'last': last,
+                }
+                for kind, (count, total, last) in self._ttfb.items()
+            }
+            evicted = self._evicted
+        return {
+            'size': self.size,
+            'idle': idle,
+            'idle_ttl': self.idle_ttl,
+            'evicted': evicted,
+            'ttfb': ttfb,
+        }
+
+    def format_stats(self) -> str:
+        """Resumen de una línea para los comandos de estado de los bots."""
+        stats = self.stats()
+
+        def fmt(kind):
+            entry = stats['ttfb'][kind]
+            if not entry['count']:
+                return f"{kind} -"
+            return f"{kind} {entry['avg']:.2f}s (n={entry['count']})"
+
+        return f"{stats['idle']}/{stats['size']} listos · TTFB {fmt('warm')}, {fmt('cold')}"
+
+    # ---------- Interno ----------
+
+    def _spawn(self, args: tuple, warm: bool) -> PooledWorker:
+        argv = list(args)
+        session_id = None
+        if self.session_ids and args == self.base_args:
+            session_id = str(uuid.uuid4())
+            # Antes de `-p` si está: el ejecutable puede ir precedido del intérprete
+            at = argv.index('-p') if '-p' in argv else len(argv)
+            argv[at:at] = ['--session-id', session_id]
+        process = subprocess.Popen(
+            self.limits.wrap_command(argv),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=self.cwd,
+            env=self.env,
+        )
+        return PooledWorker(process, args, warm=warm, session_id=session_id)
+
+    def _maintain(self):
+        check_interval = min(5.0, max(self.idle_ttl / 4, 0.5))
+        while not self._stopped.is_set():
+            self._evict_idle()
+            self._refill()
+            self._wakeup.wait(timeout=check_interval)
+            self._wakeup.clear()
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            keep = []
+            for worker in self._idle:
+                if not worker.is_alive() or now - worker.spawned_at > self.idle_ttl:
+                    expired.append(worker)
+                else:
+                    keep.append(worker)
+            self._idle = keep
+            self._evicted += len(expired)
+        for worker in expired:
+            logger.debug(f"[Pool] Reciclando worker inactivo {worker.pid}")
+            try:
+                worker.kill()
+            except Exception as e:
+                logger.debug(f"[Pool] Error matando worker {worker.pid}: {e}")
+
+    def _refill(self):
+        while not self._stopped.is_set():
+            with self._lock:
+                missing = self.size - len(self._idle)
+            if missing <= 0:
+                return
+            try:
+                worker = self._spawn(self.base_args, warm=True)
+            except Exception as e:
+                logger.error(f"[Pool] No se pudo pre-arrancar worker: {e}")
+                return
+            with self._lock:
+                self._idle.append(worker)
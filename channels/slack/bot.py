@@ -6,23 +6,43 @@ Permite ejecutar comandos y MCPs desde Slack como si fuera la terminal local.
 Soporta:
 - DMs directos al bot
 - Menciones en canales (@Claudio ...)
+
+Usa Bolt async: eventos, comandos, llamadas a la Web API y ejecuciones del CLI
+comparten un único event loop, con la concurrencia limitada por `message_executor`.
 """
 
 import os
-import subprocess
 import logging
 import asyncio
 import re
 import tempfile
 import sys
 import atexit
-import time
+import signal
 from typing import Optional, Callable
 from dotenv import load_dotenv
 
-# Slack Bolt
-from slack_bolt import App
-from slack_bolt.adapter.socket_mode import SocketModeHandler
+# Slack Bolt (async: todos los mensajes comparten el event loop)
+from slack_bolt.async_app import AsyncApp
+from slack_bolt.adapter.socket_mode.async_handler import AsyncSocketModeHandler
+from slack_sdk.web.async_client import AsyncWebClient
+
+# Módulos compartidos entre canales (channels/common)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from channels.common.admission import DEFAULT_MAX_CONCURRENT, AdmissionCancelled, AdmissionScheduler
+from channels.common.attachments import attachment_filename, output_buffer, should_attach, summarize_output
+from channels.common.bounded_executor import BoundedExecutor, QueueFull
+from channels.common.chunker import MarkdownChunker, split_markdown
+from channels.common.job_queue import Job, JobCancelled, UserJobQueue
+from channels.common.line_decoder import read_lines
+from channels.common.metrics import EXECUTOR_METRICS, ExecutionRecord, start_http_server
+from channels.common.rate_limit import RateLimiter
+from channels.common.resource_limits import ResourceLimits
+from channels.common.response_cache import ResponseCache, split_bypass
+from channels.common.sessions import RESUME_FLAG, SessionStore, resume_args
+from channels.common.stream_json import STREAM_JSON_FLAGS, StreamEvent, StreamJsonParser
+from channels.common.thread_context import ThreadContextCache
+from channels.common.worker_pool import ClaudeWorkerPool
 
 # OpenAI para transcripción de voz (opcional)
 try:
@@ -53,6 +73,8 @@ logger = logging.getLogger(__name__)
 # Tokens de Slack
 SLACK_BOT_TOKEN = os.getenv('SLACK_BOT_TOKEN')  # xoxb-...
 SLACK_APP_TOKEN = os.getenv('SLACK_APP_TOKEN')  # xapp-...
+# URL base de la Web API (GovSlack o la API falsa de benchmarks/bench_channels.py)
+SLACK_API_URL = os.getenv('SLACK_API_URL', 'https://slack.com/api/')
 
 # Claude CLI
 CLAUDE_CLI_PATH = os.getenv('CLAUDE_CLI_PATH', 'claude')
@@ -60,14 +82,66 @@ WORKSPACE_PATH = os.getenv('WORKSPACE_PATH', os.getcwd())
 
 # Límites de Slack
 MAX_MESSAGE_LENGTH = 3000  # Slack tiene límite de ~4000, dejamos margen
+# Salidas de más caracteres se envían como resumen + snippet en vez de en decenas de mensajes (0 = nunca)
+OUTPUT_ATTACHMENT_THRESHOLD = int(os.getenv('OUTPUT_ATTACHMENT_THRESHOLD', '8000'))
+# Respuesta en vivo: segundos mínimos entre ediciones de cada mensaje y ediciones
+# por minuto entre todas las conversaciones (chat.update es Tier 3, ~50/min)
+SLACK_UPDATE_INTERVAL = float(os.getenv('SLACK_UPDATE_INTERVAL', '1.5'))
+SLACK_UPDATES_PER_MINUTE = int(os.getenv('SLACK_UPDATES_PER_MINUTE', '50'))
 
 # Seguridad
 COMMAND_TIMEOUT = float(os.getenv('COMMAND_TIMEOUT', '1800'))  # 30 min default
+STREAM_READ_SIZE = int(os.getenv('STREAM_READ_SIZE', '65536'))  # Bytes por lectura del CLI
+# Formato de salida del CLI: text o stream-json (eventos NDJSON)
+CLAUDE_OUTPUT_FORMAT = os.getenv('CLAUDE_OUTPUT_FORMAT', 'text').lower()
 MAX_INPUT_LENGTH = int(os.getenv('MAX_INPUT_LENGTH', '10000'))
 
+# Pool de procesos Claude CLI pre-arrancados (0 = desactivado)
+WORKER_POOL_SIZE = int(os.getenv('WORKER_POOL_SIZE', '2'))
+WORKER_POOL_IDLE_TTL = float(os.getenv('WORKER_POOL_IDLE_TTL', '300'))
+
+# Cola de ejecuciones por usuario: serialize, supersede o parallel
+JOB_QUEUE_MODE = os.getenv('JOB_QUEUE_MODE', 'serialize').lower()
+JOB_QUEUE_MAX_PARALLEL = int(os.getenv('JOB_QUEUE_MAX_PARALLEL', '2'))
+
+# Mensajes (menciones, DMs y /claudio) que se procesan a la vez, y mensajes que
+# pueden esperar hueco (con la cola llena se contesta "ocupado"). Al recibir SIGTERM se espera hasta
+# SHUTDOWN_TIMEOUT segundos a que terminen los que están en proceso y en cola
+MESSAGE_WORKERS = int(os.getenv('MESSAGE_WORKERS', '8'))
+MESSAGE_QUEUE_MAX = int(os.getenv('MESSAGE_QUEUE_MAX', '32'))
+SHUTDOWN_TIMEOUT = float(os.getenv('SHUTDOWN_TIMEOUT', '300'))
+
+# Contexto de los hilos en memoria: hilos guardados (LRU) y mensajes por hilo
+THREAD_CONTEXT_MAX_THREADS = int(os.getenv('THREAD_CONTEXT_MAX_THREADS', '500'))
+THREAD_CONTEXT_MAX_MESSAGES = int(os.getenv('THREAD_CONTEXT_MAX_MESSAGES', '500'))
+
+# Sesión del CLI de cada hilo (se retoma con --resume); vacío = no persistir entre reinicios
+SESSIONS_PATH = os.getenv('SESSIONS_PATH', '~/.claudio/sessions-slack.json').strip() or None
+
+# Caché de respuestas para preguntas repetidas (solo sesiones nuevas, "!nocache" la salta)
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'false').lower() == 'true'
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', '3600'))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', '5000000'))
+
+# Límite de procesos Claude CLI en todo el host, compartido con Telegram, web y crons
+# (0 = sin límite). Prioridad: DM/slash command > mención > reportes batch
+ADMISSION_MAX_CONCURRENT = int(os.getenv('ADMISSION_MAX_CONCURRENT', str(DEFAULT_MAX_CONCURRENT)))
+ADMISSION_STATE_DIR = os.getenv('ADMISSION_STATE_DIR') or None
+
+# Límites de recursos por ejecución (CLI + servidores MCP; 0 = sin límite).
+# Al superarlos se mata el árbol de procesos y el resultado lleva returncode -4
+CLAUDE_MAX_MEMORY_MB = int(os.getenv('CLAUDE_MAX_MEMORY_MB', '0'))
+CLAUDE_MAX_CPU_SECONDS = int(os.getenv('CLAUDE_MAX_CPU_SECONDS', '0'))
+CLAUDE_MAX_CHILDREN = int(os.getenv('CLAUDE_MAX_CHILDREN', '0'))
+
+# Métricas del executor (formato Prometheus) en http://METRICS_HOST:METRICS_PORT/metrics (0 = desactivado)
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9102'))
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+
 # Rate limiting
 RATE_LIMIT_REQUESTS = int(os.getenv('RATE_LIMIT_REQUESTS', '10'))
 RATE_LIMIT_WINDOW = float(os.getenv('RATE_LIMIT_WINDOW', '60'))
+RATE_LIMIT_DB = os.getenv('RATE_LIMIT_DB', '').strip() or None  # SQLite; vacío = solo en memoria
 
 # Usuarios permitidos (Slack User IDs)
 # Formato: "U1234567890,U0987654321" o vacío para permitir todos
@@ -86,11 +160,31 @@ OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', '').strip()
 
 # ============== ESTADO GLOBAL ==============
 
-# Sesiones por usuario
-user_sessions = {}
+# Session id del CLI de cada conversación: el hilo o, en slash commands, el usuario
+user_sessions = SessionStore(SESSIONS_PATH)
 
-# Rate limiting tracker
-rate_limit_tracker = {}
+# Rate limiting por usuario (GCRA, expulsa a los usuarios inactivos)
+rate_limiter = RateLimiter(RATE_LIMIT_REQUESTS, RATE_LIMIT_WINDOW, RATE_LIMIT_DB)
+
+# Mensajes ya formateados de cada hilo (solo se descargan las respuestas nuevas)
+thread_contexts = ThreadContextCache(THREAD_CONTEXT_MAX_THREADS, THREAD_CONTEXT_MAX_MESSAGES)
+
+# Ediciones intermedias de las respuestas en vivo, compartidas por todas las conversaciones
+update_limiter = RateLimiter(SLACK_UPDATES_PER_MINUTE, 60)
+
+# Cola de ejecuciones por usuario (permite /claudio-cancel)
+job_queue = UserJobQueue(JOB_QUEUE_MODE, JOB_QUEUE_MAX_PARALLEL)
+
+# Concurrencia limitada para todos los mensajes (tareas en el event loop del bot)
+message_executor = BoundedExecutor(MESSAGE_WORKERS, MESSAGE_QUEUE_MAX, name='slack')
+
+# Scheduler de admisión del host
+admission = AdmissionScheduler(ADMISSION_MAX_CONCURRENT, ADMISSION_STATE_DIR)
+
+# Caché de respuestas (None si está desactivada)
+response_cache = ResponseCache(
+    WORKSPACE_PATH, ttl=RESPONSE_CACHE_TTL, max_bytes=RESPONSE_CACHE_MAX_BYTES
+) if RESPONSE_CACHE_ENABLED else None
 
 # Lock file
 LOCK_FILE_PATH = os.path.join(tempfile.gettempdir(), 'slack_claude_bot.lock')
@@ -167,234 +261,509 @@ def is_user_authorized(user_id: str) -> bool:
     return user_id in ALLOWED_USER_IDS
 
 
-def check_rate_limit(user_id: str) -> tuple[bool, float]:
-    """Verifica rate limiting para un usuario."""
-    current_time = time.time()
-    
-    if user_id in rate_limit_tracker:
-        rate_limit_tracker[user_id] = [
-            ts for ts in rate_limit_tracker[user_id]
-            if current_time - ts < RATE_LIMIT_WINDOW
-        ]
+def format_quota(user_id: str) -> str:
+    """Mensajes que le quedan al usuario en la ventana actual."""
+    if RATE_LIMIT_REQUESTS <= 0:
+        return "sin límite"
+    remaining = rate_limiter.remaining(user_id)
+    text = f"{remaining} de {RATE_LIMIT_REQUESTS} mensajes"
+    if not remaining:
+        text += f" (siguiente en {rate_limiter.retry_after(user_id):.0f}s)"
+    return text
+
+
+def session_key(user_id: str, channel: Optional[str] = None, thread_ts: Optional[str] = None) -> str:
+    """Conversación del CLI: cada hilo tiene la suya; sin hilo (slash commands), la del usuario."""
+    return f"{channel}:{thread_ts}" if channel and thread_ts else user_id
+
+
+def format_thread_message(msg: dict) -> Optional[str]:
+    """Mensaje del hilo tal como va en el contexto ("Claudio: ..." / "Usuario <@U…>: ...")."""
+    text = msg.get("text", "").strip()
+    if not text:
+        return None
+    # Las respuestas del bot van como Claudio
+    if msg.get("bot_id"):
+        sender = "Claudio"
     else:
-        rate_limit_tracker[user_id] = []
-    
-    request_count = len(rate_limit_tracker[user_id])
-    
-    if request_count >= RATE_LIMIT_REQUESTS:
-        oldest_timestamp = min(rate_limit_tracker[user_id])
-        time_until_reset = RATE_LIMIT_WINDOW - (current_time - oldest_timestamp)
-        return False, max(0, time_until_reset)
-    
-    rate_limit_tracker[user_id].append(current_time)
-    return True, 0
+        sender = f"Usuario <@{msg.get('user', 'desconocido')}>"
+    # Limpiar menciones del bot del texto
+    if BOT_USER_ID:
+        text = re.sub(f'<@{BOT_USER_ID}>', '@Claudio', text)
+    return f"{sender}: {text}"
 
 
-def fetch_thread_context(channel: str, thread_ts: str, current_ts: str = None) -> str:
+async def fetch_thread_context(
+    channel: str,
+    thread_ts: str,
+    current_ts: str = None,
+    max_chars: Optional[int] = None
+) -> str:
     """Recupera los mensajes previos del hilo para dar contexto a Claude.
 
+    Solo se descargan las respuestas nuevas desde el turno anterior
+    (`thread_contexts`); si la descarga falla se usa lo que haya en la caché.
+
     Args:
         channel: ID del canal
         thread_ts: Timestamp del hilo (mensaje padre)
         current_ts: Timestamp del mensaje actual (para excluirlo)
+        max_chars: Longitud máxima del contexto: si no cabe, se omiten los mensajes más antiguos
 
     Returns:
         String con el contexto del hilo formateado, o cadena vacía si no hay contexto.
     """
     try:
-        result = app.client.conversations_replies(
-            channel=channel,
-            ts=thread_ts,
-            limit=50  # Últimos 50 mensajes del hilo
-        )
-
-        messages = result.get("messages", [])
-        if len(messages) <= 1:
-            # Solo está el mensaje padre o el actual, no hay contexto adicional
-            return ""
-
-        context_parts = []
-        for msg in messages:
-            msg_ts = msg.get("ts", "")
-            # Excluir el mensaje actual (se enviará como prompt principal)
-            if current_ts and msg_ts == current_ts:
-                continue
-
-            # Excluir mensajes del bot (respuestas de Claudio)
-            if msg.get("bot_id"):
-                sender = "Claudio"
-            else:
-                sender = f"Usuario <@{msg.get('user', 'desconocido')}>"
-
-            text = msg.get("text", "").strip()
-            if text:
-                # Limpiar menciones del bot del texto
-                if BOT_USER_ID:
-                    text = re.sub(f'<@{BOT_USER_ID}>', '@Claudio', text)
-                context_parts.append(f"{sender}: {text}")
-
-        if not context_parts:
-            return ""
-
-        return (
-            "--- CONTEXTO DEL HILO DE SLACK ---\n"
-            "Los siguientes son los mensajes previos en este hilo. "
-            "Úsalos como contexto para responder al último mensaje.\n\n"
-            + "\n\n".join(context_parts)
-            + "\n--- FIN DEL CONTEXTO ---\n\n"
-        )
-
+        messages = await thread_contexts.refresh(app.client, channel, thread_ts, format_thread_message)
     except Exception as e:
         logger.warning(f"Error recuperando contexto del hilo: {e}")
+        messages = thread_contexts.messages(channel, thread_ts)
+
+    # Excluir el mensaje actual (se enviará como prompt principal)
+    context_parts = [text for ts, text in messages if ts != current_ts]
+    if not context_parts:
         return ""
 
+    header = (
+        "--- CONTEXTO DEL HILO DE SLACK ---\n"
+        "Los siguientes son los mensajes previos en este hilo. "
+        "Úsalos como contexto para responder al último mensaje.\n\n"
+    )
+    footer = "\n--- FIN DEL CONTEXTO ---\n\n"
+
+    # Los mensajes más recientes que quepan en `max_chars`
+    if max_chars is not None:
+        budget = max_chars - len(header) - len(footer) - 60  # Margen para el aviso de omitidos
+        kept = 0
+        for text in reversed(context_parts):
+            budget -= len(text) + 2
+            if budget < 0:
+                break
+            kept += 1
+        omitted = len(context_parts) - kept
+        if omitted:
+            context_parts = context_parts[omitted:]
+            header += f"(Mensajes anteriores omitidos: {omitted})\n\n"
+            if not context_parts:
+                return ""
+
+    return header + "\n\n".join(context_parts) + footer
+
 
 def split_message(text: str, max_length: int = MAX_MESSAGE_LENGTH) -> list:
-    """Divide un mensaje largo en partes."""
-    if len(text) <= max_length:
-        return [text]
+    """Divide un mensaje largo en partes, cerrando y reabriendo bloques y marcadores en cada corte."""
+    # mrkdwn de Slack: *negrita*, _cursiva_, ~tachado~
+    return list(split_markdown(text, max_length, '*_~')) or [text]
+
+
+async def send_output(text: str, say, channel: str, thread_ts: Optional[str], processing_ts: Optional[str]):
+    """
+    Envía la salida en el hilo: en el mensaje de "procesando" y tantos
+    mensajes como hagan falta o, pasado `OUTPUT_ATTACHMENT_THRESHOLD`, un
+    resumen y la salida completa como snippet.
+    """
+    if should_attach(len(text), OUTPUT_ATTACHMENT_THRESHOLD):
+        try:
+            await app.client.files_upload_v2(
+                channel=channel,
+                thread_ts=thread_ts,
+                file=output_buffer(text),
+                filename=attachment_filename(),
+                title="Respuesta de Claudio",
+            )
+            parts = [summarize_output(text, '*_~')]
+        except Exception as e:
+            logger.warning(f"No se pudo subir la salida como snippet, se envía en mensajes: {e}")
+            parts = split_message(text)
+    else:
+        parts = split_message(text)
     
-    parts = []
-    current = text
+    # Actualizar mensaje de "procesando" con la primera parte
+    if processing_ts:
+        try:
+            await app.client.chat_update(channel=channel, ts=processing_ts, text=parts[0])
+        except Exception as e:
+            logger.error(f"Error actualizando mensaje: {e}")
+            await say(text=parts[0], thread_ts=thread_ts)
+    else:
+        await say(text=parts[0], thread_ts=thread_ts)
     
-    while len(current) > max_length:
-        split_pos = current.rfind('\n', 0, max_length)
-        if split_pos == -1:
-            split_pos = max_length
-        
-        parts.append(current[:split_pos])
-        current = current[split_pos:].lstrip()
+    # Enviar partes adicionales
+    for part in parts[1:]:
+        await say(text=part, thread_ts=thread_ts)
+
+
+class LiveReply:
+    """
+    Respuesta que se edita en el hilo de Slack a medida que llega la salida del CLI.
+
+    El mensaje "⏳ Procesando..." se actualiza con `chat_update` como mucho
+    cada `interval` segundos y solo si el texto cambió; las ediciones
+    intermedias de todas las conversaciones comparten `update_limiter` para no
+    pasar del Tier de chat.update (si no hay cuota, se reintenta más tarde).
+    La salida pasa por un `MarkdownChunker`: al llenarse un mensaje se cierra
+    con el Markdown balanceado y la salida sigue en un mensaje nuevo del hilo.
+    Pasado `OUTPUT_ATTACHMENT_THRESHOLD` la salida deja de mostrarse y
+    `finish()` la sube como snippet.
+    """
+    
+    def __init__(
+        self,
+        channel: str,
+        thread_ts: Optional[str],
+        ts: Optional[str],
+        say,
+        interval: float = SLACK_UPDATE_INTERVAL,
+        max_length: int = MAX_MESSAGE_LENGTH
+    ):
+        """
+        Args:
+            channel: Canal de la conversación
+            thread_ts: Hilo donde van los mensajes nuevos
+            ts: Mensaje a editar (el de "⏳ Procesando..."; None = enviar uno nuevo)
+            say: Función async de Bolt para responder (si falla la edición)
+            interval: Segundos mínimos entre ediciones
+            max_length: Caracteres máximos por mensaje
+        """
+        self.channel = channel
+        self.thread_ts = thread_ts
+        self.ts = ts
+        self.say = say
+        self.interval = interval
+        self.attached = False     # La salida superó el umbral e irá como snippet
+        self.length = 0
+        self.updates = 0
+        self._chunker = MarkdownChunker(max_length, '*_~')
+        self._output = []         # Salida completa (para el snippet)
+        self._ready = []          # Mensajes completos pendientes de mostrar
+        self._shown = None        # Último texto enviado al mensaje actual
+        self._next_edit = 0.0     # Instante (loop.time) a partir del cual se puede editar
+        self._task = None
+        self._lock = asyncio.Lock()
+    
+    @property
+    def started(self) -> bool:
+        """True si ya se mostró salida (el mensaje dejó de ser el de estado)."""
+        return self.updates > 0
+    
+    async def append(self, text: str):
+        """Agrega salida y programa una edición si no hay una pendiente."""
+        if not text:
+            return
+        self._output.append(text)
+        self.length += len(text)
+        if not self.attached and should_attach(self.length, OUTPUT_ATTACHMENT_THRESHOLD):
+            # A partir de aquí no se envían más mensajes: todo irá en el snippet
+            self.attached = True
+            self._ready.clear()
+        if not self.attached:
+            self._ready.extend(self._chunker.feed(text))
+        if self._task is None or self._task.done():
+            self._schedule(self._next_edit - asyncio.get_running_loop().time())
+    
+    async def finish(self) -> str:
+        """Muestra todo lo pendiente (o sube el snippet) y devuelve la salida completa."""
+        self.cancel()
+        await self._render(final=True)
+        return ''.join(self._output)
     
-    if current:
-        parts.append(current)
+    def cancel(self):
+        """Descarta la edición pendiente (p.ej. si la ejecución falla)."""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
     
-    return parts
+    def _schedule(self, delay: float):
+        self._task = asyncio.create_task(self._render_after(max(0.0, delay)))
+    
+    async def _render_after(self, delay: float):
+        try:
+            await asyncio.sleep(delay)
+            await self._render(final=False)
+        except asyncio.CancelledError:
+            pass
+    
+    async def _render(self, final: bool):
+        async with self._lock:
+            if self.attached:
+                if final:
+                    await send_output(''.join(self._output).strip(), self.say, self.channel, self.thread_ts, self.ts)
+                    self.updates += 1
+                else:
+                    await self._show("📎 Respuesta larga: se subirá como archivo al terminar...", throttled=True)
+                return
+            if final:
+                self._ready.extend(self._chunker.flush())
+            while self._ready:
+                chunk = self._ready.pop(0)
+                await self._show(chunk, throttled=False)
+                # La última parte se queda en el mensaje actual
+                if final and not self._ready:
+                    return
+                # Cerrar el mensaje lleno y seguir en uno nuevo
+                self.ts = None
+                self._shown = None
+            
+            current = self._chunker.current
+            if not final and current.strip():
+                await self._show(current, throttled=True)
+    
+    async def _show(self, text: str, throttled: bool):
+        if text == self._shown:
+            return
+        # Las ediciones del mensaje en curso respetan la cuota compartida (se
+        # reintentan cuando haya cuota); los mensajes completos nunca se saltan
+        if throttled and self.ts:
+            allowed, retry_after = update_limiter.check('chat_update')
+            if not allowed:
+                self._schedule(max(retry_after, self.interval))
+                return
+        try:
+            if self.ts:
+                await app.client.chat_update(channel=self.channel, ts=self.ts, text=text)
+            else:
+                response = await app.client.chat_postMessage(channel=self.channel, text=text, thread_ts=self.thread_ts)
+                self.ts = response["ts"]
+            self._shown = text
+            self.updates += 1
+        except Exception as e:
+            if throttled:
+                # Una edición intermedia perdida se recupera en la siguiente
+                logger.debug(f"No se pudo actualizar la respuesta en vivo: {e}")
+            else:
+                # Un mensaje completo o la parte final no se puede perder (p.ej.
+                # /claudio en un canal donde el bot no está): responder con `say`
+                logger.warning(f"No se pudo enviar la respuesta en vivo, se usa say: {e}")
+                try:
+                    await self.say(text=text, thread_ts=self.thread_ts)
+                    self._shown = text
+                    self.updates += 1
+                except Exception as e:
+                    logger.error(f"No se pudo enviar la respuesta: {e}")
+        self._next_edit = asyncio.get_running_loop().time() + self.interval
 
 
 # ============== CLAUDE CODE EXECUTOR ==============
 
+def format_limit_exceeded(reason: str, resources: Optional[dict]) -> str:
+    """Aviso para el usuario cuando una ejecución se mata por superar un límite."""
+    names = {
+        'memory': f"memoria ({CLAUDE_MAX_MEMORY_MB} MB)",
+        'cpu': f"CPU ({CLAUDE_MAX_CPU_SECONDS}s)",
+        'children': f"procesos hijos ({CLAUDE_MAX_CHILDREN})",
+    }
+    resources = resources or {}
+    return (
+        f"🧯 *Límite de recursos superado:* {names.get(reason, reason)}\n"
+        f"Pico {resources.get('peak_rss_mb', '?')} MB, {resources.get('cpu_seconds', '?')}s de CPU, "
+        f"{resources.get('peak_children', '?')} procesos hijos."
+    )
+
+
 class ClaudeCodeExecutor:
     """Ejecutor de comandos Claude Code CLI."""
     
-    def __init__(self, workspace_path: str = None):
+    def __init__(self, workspace_path: str = None, pool: ClaudeWorkerPool = None):
         self.workspace_path = workspace_path or WORKSPACE_PATH
         self.claude_path = CLAUDE_CLI_PATH
+        self.pool = pool
         self.active_processes = []
     
     def cleanup_processes(self):
         """Mata procesos activos de Claude CLI."""
         for process_info in self.active_processes[:]:
             try:
-                pid, process = process_info
-                if process.returncode is None:
+                pid, worker = process_info
+                if worker.is_alive():
                     logger.warning(f"Killing orphaned Claude CLI process (PID: {pid})")
-                    process.kill()
-                    process.wait()
+                    worker.kill()
             except Exception as e:
                 logger.debug(f"Error cleaning up process: {e}")
         self.active_processes.clear()
     
+    def build_command(self, conversation: Optional[str], continue_session: bool) -> list:
+        """
+        Construye el comando del CLI. El prompt se envía por stdin (evita el bug de -p con MCPs).
+        
+        `conversation` es la clave de `session_key()`: se retoma su sesión por id.
+        """
+        cmd = [self.claude_path]
+        
+        session_id = user_sessions.get(conversation) if continue_session and conversation else None
+        if session_id:
+            cmd.extend(resume_args(session_id))
+            logger.info(f"[{conversation}] Continuando sesión {session_id}")
+        
+        if SKIP_PERMISSIONS:
+            cmd.append('--dangerously-skip-permissions')
+        elif ALLOWED_TOOLS and ALLOWED_TOOLS != '*':
+            cmd.extend(['--allowedTools', ALLOWED_TOOLS])
+        
+        if CLAUDE_OUTPUT_FORMAT == 'stream-json':
+            cmd.extend(STREAM_JSON_FLAGS)
+        
+        cmd.append('-p')
+        return cmd
+    
+    @EXECUTOR_METRICS.instrument('slack')
     async def execute_streaming(
         self, 
         query: str, 
         user_id: str, 
         continue_session: bool,
         output_callback: Callable[[str], None],
-        error_callback: Optional[Callable[[str], None]] = None
+        error_callback: Optional[Callable[[str], None]] = None,
+        job: Optional[Job] = None,
+        event_callback: Optional[Callable[[StreamEvent], None]] = None,
+        use_cache: bool = True,
+        priority: str = 'interactive',
+        on_admission_wait: Optional[Callable[[int], None]] = None,
+        record: Optional[ExecutionRecord] = None,
+        conversation: Optional[str] = None
     ) -> dict:
-        """Ejecuta comando en Claude Code CLI con streaming."""
+        """
+        Ejecuta comando en Claude Code CLI con streaming. Cancelar `job` mata el proceso.
+        
+        Con continue_session se retoma la sesión de `conversation` (por defecto el
+        usuario); el resultado trae el 'session_id' usado.
+        
+        Con CLAUDE_OUTPUT_FORMAT=stream-json, `event_callback` recibe los eventos
+        tipados y output_callback solo los deltas de texto del asistente.
+        Las sesiones nuevas pasan por la caché de respuestas salvo con use_cache=False.
+        Antes de lanzar el CLI espera hueco en el scheduler del host con `priority`;
+        `on_admission_wait` recibe la posición mientras espera. `record` lo pasa
+        el decorador de métricas.
+        """
+        ticket = None
         try:
-            cmd = [self.claude_path]
+            cmd = self.build_command(conversation or user_id, continue_session)
             
-            if continue_session and user_id in user_sessions:
-                cmd.append('-c')
-                logger.info(f"[Usuario {user_id}] Continuando sesión anterior")
+            cache = response_cache if use_cache and RESUME_FLAG not in cmd else None
+            if cache is not None:
+                cached = cache.get(query)
+                if cached is not None:
+                    logger.info(f"[Usuario {user_id}] Respuesta desde caché ({len(cached)} chars)")
+                    await output_callback(cached)
+                    return {'success': True, 'returncode': 0, 'cached': True}
+            captured = []
+            had_errors = False
             
-            if SKIP_PERMISSIONS:
-                cmd.append('--dangerously-skip-permissions')
-            elif ALLOWED_TOOLS and ALLOWED_TOOLS != '*':
-                cmd.extend(['--allowedTools', ALLOWED_TOOLS])
-            
-            cmd.extend(['-p', query])
-            
-            env = os.environ.copy()
-            env['PWD'] = self.workspace_path
+            async def emit(text: str):
+                if cache is not None:
+                    captured.append(text)
+                await output_callback(text)
             
             logger.info(f"[Usuario {user_id}] Ejecutando: {' '.join(cmd[:3])}...")
             
-            process = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-                cwd=self.workspace_path,
-                env=env
+            ticket = await admission.acquire_async(
+                priority,
+                f"slack:{user_id}",
+                on_position=on_admission_wait,
+                cancelled=(lambda: job.cancelled) if job is not None else None
             )
             
-            process_pid = process.pid
-            self.active_processes.append((process_pid, process))
+            pool = self.pool or get_worker_pool()
+            if record is not None:
+                record.spawn_started()
+            worker = pool.acquire(cmd)
+            if job is not None:
+                job.attach(worker)
+            await asyncio.get_running_loop().run_in_executor(None, worker.send_prompt, query)
+            if record is not None:
+                record.spawned(worker)
+            stdout, stderr = await worker.open_streams()
+            
+            process_pid = worker.pid
+            self.active_processes.append((process_pid, worker))
+            
+            parser = StreamJsonParser() if CLAUDE_OUTPUT_FORMAT == 'stream-json' else None
+            usage = {}
+            
+            async def handle_event(event: StreamEvent):
+                nonlocal had_errors
+                if event.kind in ('text_delta', 'raw'):
+                    await emit(event.text if event.kind == 'text_delta' else event.text + '\n')
+                elif event.kind == 'result':
+                    had_errors = had_errors or event.is_error
+                elif event.kind == 'usage':
+                    usage.update(event.data)
+                if event_callback:
+                    await event_callback(event)
             
             async def read_stream(stream, is_error=False):
-                buffer = b''
-                while True:
-                    chunk = await stream.read(1024)
-                    if not chunk:
-                        break
-                    buffer += chunk
-                    try:
-                        text = buffer.decode('utf-8', errors='replace')
-                        while '\n' in text:
-                            line, text = text.split('\n', 1)
-                            cleaned = remove_ansi_codes(line)
-                            if cleaned.strip():
-                                if is_error:
-                                    logger.warning(f"[Usuario {user_id}] STDERR: {cleaned[:100]}")
-                                    if error_callback:
-                                        await error_callback(cleaned)
-                                else:
-                                    await output_callback(cleaned + '\n')
-                        buffer = text.encode('utf-8', errors='replace')
-                    except Exception as e:
-                        logger.error(f"[Usuario {user_id}] Error decodificando: {e}")
-                
-                if buffer:
-                    try:
-                        text = buffer.decode('utf-8', errors='replace')
-                        cleaned = remove_ansi_codes(text)
-                        if cleaned.strip():
-                            if is_error and error_callback:
-                                await error_callback(cleaned)
-                            elif not is_error:
-                                await output_callback(cleaned)
-                    except Exception as e:
-                        logger.error(f"[Usuario {user_id}] Error buffer final: {e}")
+                nonlocal had_errors
+                on_data = None if is_error else worker.note_output
+                async for line, terminated in read_lines(stream, STREAM_READ_SIZE, on_data):
+                    if parser and not is_error:
+                        for event in parser.feed_line(line):
+                            await handle_event(event)
+                        continue
+                    cleaned = remove_ansi_codes(line)
+                    if not cleaned.strip():
+                        continue
+                    if is_error:
+                        had_errors = True
+                        logger.warning(f"[Usuario {user_id}] STDERR: {cleaned[:100]}")
+                        if error_callback:
+                            await error_callback(cleaned)
+                    else:
+                        await emit(cleaned + '\n' if terminated else cleaned)
             
             try:
                 await asyncio.wait_for(
                     asyncio.gather(
-                        read_stream(process.stdout, is_error=False),
-                        read_stream(process.stderr, is_error=True)
+                        read_stream(stdout, is_error=False),
+                        read_stream(stderr, is_error=True)
                     ),
                     timeout=COMMAND_TIMEOUT
                 )
-                returncode = await process.wait()
+                returncode = await worker.wait()
             except asyncio.TimeoutError:
                 logger.warning(f"[Usuario {user_id}] TIMEOUT: {COMMAND_TIMEOUT}s")
                 try:
-                    process.kill()
-                    await process.wait()
+                    worker.kill()
                     self.active_processes = [p for p in self.active_processes if p[0] != process_pid]
                 except Exception as kill_error:
                     logger.error(f"Error matando proceso: {kill_error}")
                 
-                return {'success': False, 'returncode': -2, 'timeout': True}
+                return {'success': False, 'returncode': -2, 'timeout': True, 'resources': worker.usage()}
+            
+            self.active_processes = [p for p in self.active_processes if p[0] != process_pid]
+            pool.release(worker)
+            resources = worker.usage()
+            logger.info(f"[Usuario {user_id}] Recursos: {resources}")
+            
+            if worker.limit_exceeded:
+                logger.warning(f"[Usuario {user_id}] Límite de recursos superado: {worker.limit_exceeded}")
+                return {
+                    'success': False,
+                    'returncode': -4,
+                    'limit_exceeded': worker.limit_exceeded,
+                    'resources': resources
+                }
+            
+            if job is not None and job.cancelled:
+                logger.info(f"[Usuario {user_id}] Cancelado (código: {returncode})")
+                return {'success': False, 'returncode': -3, 'cancelled': True}
             
             success = returncode == 0
             logger.info(f"[Usuario {user_id}] Completado con código: {returncode}")
+            if cache is not None and success and not had_errors:
+                cache.put(query, ''.join(captured))
             
-            self.active_processes = [p for p in self.active_processes if p[0] != process_pid]
-            
-            return {'success': success, 'returncode': returncode}
+            result = {
+                'success': success,
+                'returncode': returncode,
+                'resources': resources,
+                'session_id': (parser.session_id if parser else None) or worker.session_id
+                    or (cmd[cmd.index(RESUME_FLAG) + 1] if RESUME_FLAG in cmd else None)
+            }
+            if parser:
+                result['usage'] = usage
+            return result
             
+        except AdmissionCancelled:
+            logger.info(f"[Usuario {user_id}] Cancelado esperando hueco en el host")
+            return {'success': False, 'returncode': -3, 'cancelled': True}
         except FileNotFoundError:
             error_msg = f'Claude CLI no encontrado en: {self.claude_path}'
             logger.error(f"[Usuario {user_id}] {error_msg}")
@@ -407,6 +776,9 @@ class ClaudeCodeExecutor:
             if error_callback:
                 await error_callback(error_msg)
             return {'success': False, 'returncode': -1}
+        finally:
+            if ticket is not None:
+                await asyncio.get_running_loop().run_in_executor(None, admission.release, ticket)
 
 
 # ============== SLACK APP ==============
@@ -418,16 +790,38 @@ for var in ['SLACK_CLIENT_ID', 'SLACK_CLIENT_SECRET']:
         del os.environ[var]
 
 # Inicializar app de Slack con token directo
-app = App(token=SLACK_BOT_TOKEN)
+app = AsyncApp(client=AsyncWebClient(token=SLACK_BOT_TOKEN, base_url=SLACK_API_URL))
 
 # Executor global
 executor = ClaudeCodeExecutor()
 
+# Pool global de workers pre-arrancados (se arranca en main())
+worker_pool = None
 
-def get_bot_user_id():
+
+def get_worker_pool() -> ClaudeWorkerPool:
+    """Devuelve el pool global de workers, creándolo la primera vez."""
+    global worker_pool
+    
+    if worker_pool is None:
+        env = os.environ.copy()
+        env['PWD'] = WORKSPACE_PATH
+        worker_pool = ClaudeWorkerPool(
+            executor.build_command(None, continue_session=False),
+            cwd=WORKSPACE_PATH,
+            env=env,
+            size=WORKER_POOL_SIZE,
+            idle_ttl=WORKER_POOL_IDLE_TTL,
+            limits=ResourceLimits(CLAUDE_MAX_MEMORY_MB, CLAUDE_MAX_CPU_SECONDS, CLAUDE_MAX_CHILDREN),
+            session_ids=True
+        )
+    return worker_pool
+
+
+async def get_bot_user_id():
     """Obtiene el User ID del bot."""
     try:
-        response = app.client.auth_test()
+        response = await app.client.auth_test()
         return response["user_id"]
     except Exception as e:
         logger.error(f"Error obteniendo bot user ID: {e}")
@@ -437,305 +831,191 @@ def get_bot_user_id():
 BOT_USER_ID = None  # Se inicializa en main()
 
 
-async def process_message(user_id: str, text: str, say, channel: str, thread_ts: str = None, event_ts: str = None):
-    """Procesa un mensaje y ejecuta en Claude CLI."""
+async def process_message(
+    user_id: str,
+    text: str,
+    say,
+    channel: str,
+    thread_ts: str = None,
+    event_ts: str = None,
+    priority: str = 'interactive'
+):
+    """
+    Procesa un mensaje (mención, DM o /claudio) y muestra la respuesta en vivo.
+    
+    `priority` es la clase en el scheduler del host: 'interactive' para DMs y
+    slash commands, 'mention' para menciones en canales.
+    """
+    text, skip_cache = split_bypass(text)
 
     # Verificar autorización
     if not is_user_authorized(user_id):
         logger.warning(f"[SEGURIDAD] Usuario no autorizado: {user_id}")
-        say(
-            text="❌ *Acceso denegado*\n\nNo estás autorizado para usar este bot.",
-            thread_ts=thread_ts
-        )
+        await say(text="❌ *Acceso denegado*\n\nNo estás autorizado para usar este bot.", thread_ts=thread_ts)
         return
 
     # Rate limiting
-    is_allowed, time_until_reset = check_rate_limit(user_id)
+    is_allowed, time_until_reset = rate_limiter.check(user_id)
     if not is_allowed:
         logger.warning(f"[SEGURIDAD] Rate limit excedido: {user_id}")
-        say(
-            text=f"⏱️ *Rate limit excedido*\n\nEspera {int(time_until_reset)} segundos.",
-            thread_ts=thread_ts
-        )
+        await say(text=f"⏱️ *Rate limit excedido*\n\nEspera {int(time_until_reset)} segundos.", thread_ts=thread_ts)
         return
 
     # Recuperar contexto del hilo si el mensaje viene de un thread
     thread_context = ""
     if thread_ts:
-        thread_context = fetch_thread_context(channel, thread_ts, current_ts=event_ts)
+        thread_context = await fetch_thread_context(
+            channel, thread_ts, current_ts=event_ts, max_chars=MAX_INPUT_LENGTH - len(text)
+        )
         if thread_context:
             logger.info(f"[Usuario {user_id}] Contexto de hilo recuperado ({len(thread_context)} chars)")
 
     # Construir prompt con contexto del hilo
     full_prompt = thread_context + text if thread_context else text
 
-    # Validar longitud
+    # Validar longitud (después de agregar contexto)
     if len(full_prompt) > MAX_INPUT_LENGTH:
-        say(
-            text=f"❌ *Mensaje demasiado largo*\n\nMáximo: {MAX_INPUT_LENGTH:,} caracteres.",
-            thread_ts=thread_ts
-        )
+        await say(text=f"❌ *Mensaje demasiado largo*\n\nMáximo: {MAX_INPUT_LENGTH:,} caracteres.", thread_ts=thread_ts)
         return
 
     logger.info(f"[Usuario {user_id}] Procesando: {text[:100]}...")
-
-    # Mostrar que está procesando
-    result = app.client.chat_postMessage(
-        channel=channel,
-        text="⏳ Procesando...",
-        thread_ts=thread_ts
-    )
-    processing_ts = result["ts"]
-
-    # Acumular output
-    all_output = []
+    
+    # Registrar la ejecución en la cola del usuario
+    job = job_queue.submit(user_id, text[:50])
+    conversation = session_key(user_id, channel, thread_ts)
+    
+    # Mostrar que está procesando (o la posición en cola)
+    if job.position:
+        processing_text = f"⏳ En cola (posición {job.position}). Usa `/claudio-cancel` para cancelar."
+    else:
+        processing_text = "⏳ Procesando..."
+    try:
+        response = await app.client.chat_postMessage(channel=channel, text=processing_text, thread_ts=thread_ts)
+        processing_ts = response["ts"]
+    except Exception as e:
+        logger.error(f"Error enviando mensaje de procesando: {e}")
+        processing_ts = None
+    
+    # La respuesta se muestra editando el mensaje de estado a medida que llega
+    live = LiveReply(channel, thread_ts, processing_ts, say)
     has_received_output = False
-
-    async def handle_output(text_chunk: str):
-        nonlocal all_output, has_received_output
-        if text_chunk.strip():
-            has_received_output = True
-            all_output.append(text_chunk)
-
-    async def handle_error(error_text: str):
-        nonlocal all_output, has_received_output
-        if error_text.strip():
-            has_received_output = True
-            all_output.append(f"⚠️ {error_text}\n")
-
-    # Ejecutar
-    continue_session = user_id in user_sessions
-
-    result = await executor.execute_streaming(
-        full_prompt,
-        user_id,
-        continue_session,
-        handle_output,
-        handle_error
-    )
+    result_text = None
     
-    # Enviar respuesta
-    if all_output:
-        combined = ''.join(all_output)
-        cleaned = remove_ansi_codes(combined)
-        
-        if cleaned.strip():
-            parts = split_message(cleaned)
-            
-            # Actualizar mensaje de "procesando" con la primera parte
+    async def update_status(msg: str):
+        """Reemplaza el mensaje de 'procesando' (o responde en el hilo si ya muestra la respuesta)."""
+        if processing_ts and not live.started:
             try:
-                app.client.chat_update(
-                    channel=channel,
-                    ts=processing_ts,
-                    text=parts[0]
-                )
+                await app.client.chat_update(channel=channel, ts=processing_ts, text=msg)
+                return
             except Exception as e:
                 logger.error(f"Error actualizando mensaje: {e}")
-                say(text=parts[0], thread_ts=thread_ts)
-            
-            # Enviar partes adicionales
-            for part in parts[1:]:
-                say(text=part, thread_ts=thread_ts)
+        await say(text=msg, thread_ts=thread_ts)
     
-    elif result.get('timeout'):
+    async def show_progress(msg: str):
+        """Estado intermedio (posición, herramienta en uso) mientras no hay respuesta."""
+        if not processing_ts or live.started:
+            return
         try:
-            app.client.chat_update(
-                channel=channel,
-                ts=processing_ts,
-                text=f"⏱️ *Timeout alcanzado*\n\nEl comando excedió {COMMAND_TIMEOUT}s."
-            )
-        except:
-            say(text=f"⏱️ *Timeout*\nComando excedió {COMMAND_TIMEOUT}s.", thread_ts=thread_ts)
+            await app.client.chat_update(channel=channel, ts=processing_ts, text=msg)
+        except Exception as e:
+            logger.debug(f"[Usuario {user_id}] No se pudo actualizar el estado: {e}")
     
-    elif not result['success']:
-        try:
-            app.client.chat_update(
-                channel=channel,
-                ts=processing_ts,
-                text=f"❌ *Error* (código: {result['returncode']})"
-            )
-        except:
-            say(text=f"❌ Error (código: {result['returncode']})", thread_ts=thread_ts)
+    async def handle_output(text_chunk: str):
+        nonlocal has_received_output
+        if text_chunk:
+            has_received_output = has_received_output or bool(text_chunk.strip())
+            await live.append(text_chunk)
     
-    else:
-        try:
-            app.client.chat_update(
-                channel=channel,
-                ts=processing_ts,
-                text="✅ Comando ejecutado exitosamente."
+    async def handle_error(error_text: str):
+        nonlocal has_received_output
+        if error_text.strip():
+            has_received_output = True
+            await live.append(f"⚠️ {error_text}\n")
+    
+    async def handle_event(event: StreamEvent):
+        nonlocal result_text
+        if event.kind == 'tool_use_start' and event.tool and not has_received_output:
+            await show_progress(f"⏳ Procesando... 🔧 {event.tool}")
+        elif event.kind == 'result' and event.text:
+            result_text = event.text
+    
+    async def handle_admission_wait(position: int):
+        await show_progress(
+            f"⏳ Servidor ocupado, en cola (posición {position})..." if position else "⏳ Procesando..."
+        )
+    
+    try:
+        # Ejecutar (esperando turno en la cola del usuario)
+        async with job_queue.run(user_id, job=job):
+            if job.position:
+                await show_progress("⏳ Procesando...")
+            result = await executor.execute_streaming(
+                full_prompt,
+                user_id,
+                True,
+                handle_output,
+                handle_error,
+                job=job,
+                event_callback=handle_event,
+                use_cache=not skip_cache,
+                priority=priority,
+                on_admission_wait=handle_admission_wait,
+                conversation=conversation
             )
-        except:
-            pass
+        
+        # Sin deltas (p.ej. el CLI solo devolvió el resultado final)
+        if not has_received_output and result_text:
+            await live.append(result_text)
+        await live.finish()
+        logger.info(
+            f"[Usuario {user_id}] Respuesta mostrada en {live.updates} actualización(es)"
+            f"{' + snippet' if live.attached else ''}"
+        )
+        
+        if result.get('cancelled'):
+            await update_status("🛑 Ejecución cancelada.")
+        elif result.get('timeout'):
+            await update_status(f"⏱️ *Timeout*\n\nEl comando excedió {COMMAND_TIMEOUT}s.")
+        elif result.get('limit_exceeded'):
+            await update_status(format_limit_exceeded(result['limit_exceeded'], result.get('resources')))
+        elif not live.started:
+            await update_status("✅ Listo." if result['success'] else f"❌ *Error* (código: {result['returncode']})")
+        
+        # Guardar la sesión del hilo para retomarla en el siguiente mensaje
+        # (una respuesta de la caché no abre sesión)
+        if result['success'] and not result.get('cached'):
+            user_sessions.set(conversation, result.get('session_id'))
     
-    # Marcar sesión activa
-    if result['success']:
-        user_sessions[user_id] = True
-
-
-# ============== SYNC PROCESS MESSAGE ==============
-
-def process_message_sync(user_id: str, text: str, say, channel: str, thread_ts: str = None, event_ts: str = None):
-    """Procesa un mensaje usando subprocess - igual que Telegram."""
-    import threading
-
-    # Verificar autorización
-    if not is_user_authorized(user_id):
-        logger.warning(f"[SEGURIDAD] Usuario no autorizado: {user_id}")
-        say(text="❌ *Acceso denegado*\n\nNo estás autorizado para usar este bot.", thread_ts=thread_ts)
-        return
-
-    # Rate limiting
-    is_allowed, time_until_reset = check_rate_limit(user_id)
-    if not is_allowed:
-        say(text=f"⏱️ *Rate limit excedido*\n\nEspera {int(time_until_reset)} segundos.", thread_ts=thread_ts)
-        return
-
-    # Recuperar contexto del hilo si el mensaje viene de un thread
-    thread_context = ""
-    if thread_ts:
-        thread_context = fetch_thread_context(channel, thread_ts, current_ts=event_ts)
-        if thread_context:
-            logger.info(f"[Usuario {user_id}] Contexto de hilo recuperado ({len(thread_context)} chars)")
-
-    # Construir prompt con contexto del hilo
-    full_prompt = thread_context + text if thread_context else text
+    except JobCancelled:
+        logger.info(f"[Usuario {user_id}] Ejecución cancelada antes de empezar")
+        await update_status("🛑 Ejecución cancelada.")
+    except Exception as e:
+        logger.error(f"[Usuario {user_id}] Error: {e}", exc_info=True)
+        live.cancel()
+        await update_status(f"❌ Error: {str(e)}")
+    finally:
+        live.cancel()
+        # Si otro mensaje del hilo descargó la respuesta a medio editar, volver a pedirla
+        if thread_ts and processing_ts:
+            thread_contexts.forget_since(channel, thread_ts, processing_ts)
 
-    # Validar longitud (después de agregar contexto)
-    if len(full_prompt) > MAX_INPUT_LENGTH:
-        say(text=f"❌ *Mensaje demasiado largo*\n\nMáximo: {MAX_INPUT_LENGTH:,} caracteres.", thread_ts=thread_ts)
-        return
 
-    logger.info(f"[Usuario {user_id}] Procesando: {text[:100]}...")
-    
-    # Mostrar que está procesando
+async def submit_message(user_id: str, text: str, say, channel: str, thread_ts: str = None, **kwargs):
+    """Encola `process_message` en `message_executor` (o contesta "ocupado" si la cola está llena)."""
     try:
-        result = app.client.chat_postMessage(
-            channel=channel,
-            text="⏳ Procesando...",
+        message_executor.submit(process_message, user_id, text, say, channel, thread_ts, **kwargs)
+    except QueueFull as e:
+        logger.warning(f"[Usuario {user_id}] Cola de mensajes llena ({e}), mensaje rechazado")
+        await say(
+            text="🚦 *Bot ocupado*\n\nHay demasiados mensajes en cola. Inténtalo de nuevo en unos minutos.",
             thread_ts=thread_ts
         )
-        processing_ts = result["ts"]
-    except Exception as e:
-        logger.error(f"Error enviando mensaje de procesando: {e}")
-        processing_ts = None
-    
-    def run_claude():
-        """Ejecuta Claude CLI en un thread separado."""
-        try:
-            # Construir comando
-            # IMPORTANTE: NO usar -p porque tiene un bug con MCPs
-            # En su lugar, usamos pipe input (echo | claude)
-            cmd = [CLAUDE_CLI_PATH]
-            
-            # Continuar sesión si existe
-            if user_id in user_sessions:
-                cmd.append('-c')
-                logger.info(f"[Usuario {user_id}] Continuando sesión anterior")
-            
-            # Agregar flags para aprobar automáticamente herramientas/MCPs
-            if SKIP_PERMISSIONS:
-                cmd.append('--dangerously-skip-permissions')
-            elif ALLOWED_TOOLS and ALLOWED_TOOLS != '*':
-                cmd.extend(['--allowedTools', ALLOWED_TOOLS])
-            
-            # NO agregar -p, usaremos pipe input
-            
-            # Configurar entorno
-            env = os.environ.copy()
-            env['PWD'] = WORKSPACE_PATH
-            
-            logger.info(f"[Usuario {user_id}] Ejecutando: {' '.join(cmd)}...")
-            
-            # Ejecutar Claude CLI usando pipe input en vez de -p
-            # Esto evita el bug de -p con MCPs
-            start_time = time.time()
-            logger.info(f"[Usuario {user_id}] Iniciando subprocess con pipe input...")
-            
-            process_result = subprocess.run(
-                cmd,
-                input=full_prompt,  # Pipe input con contexto del hilo
-                capture_output=True,
-                text=True,
-                timeout=COMMAND_TIMEOUT,
-                cwd=WORKSPACE_PATH,
-                env=env
-            )
-            
-            elapsed = time.time() - start_time
-            logger.info(f"[Usuario {user_id}] subprocess.run() terminó en {elapsed:.2f}s")
-            
-            output = process_result.stdout or ""
-            stderr = process_result.stderr or ""
-            
-            logger.info(f"[Usuario {user_id}] stdout: {len(output)} chars, stderr: {len(stderr)} chars")
-            
-            # Limpiar output
-            cleaned_output = remove_ansi_codes(output).strip()
-            
-            if stderr:
-                logger.warning(f"[Usuario {user_id}] STDERR: {stderr[:500]}")
-                # Incluir stderr en el output si hay error
-                if process_result.returncode != 0 and not cleaned_output:
-                    cleaned_output = f"⚠️ {remove_ansi_codes(stderr).strip()}"
-            
-            logger.info(f"[Usuario {user_id}] Completado con código: {process_result.returncode}")
-            
-            # Enviar respuesta
-            if cleaned_output:
-                parts = split_message(cleaned_output)
-                
-                if processing_ts:
-                    try:
-                        app.client.chat_update(channel=channel, ts=processing_ts, text=parts[0])
-                    except Exception as e:
-                        logger.error(f"Error actualizando mensaje: {e}")
-                        say(text=parts[0], thread_ts=thread_ts)
-                else:
-                    say(text=parts[0], thread_ts=thread_ts)
-                
-                for part in parts[1:]:
-                    say(text=part, thread_ts=thread_ts)
-            else:
-                if processing_ts:
-                    try:
-                        app.client.chat_update(channel=channel, ts=processing_ts, text="✅ Listo.")
-                    except:
-                        pass
-            
-            # Marcar sesión activa
-            if process_result.returncode == 0:
-                user_sessions[user_id] = True
-                
-        except subprocess.TimeoutExpired:
-            logger.warning(f"[Usuario {user_id}] TIMEOUT: {COMMAND_TIMEOUT}s")
-            msg = f"⏱️ *Timeout*\n\nEl comando excedió {COMMAND_TIMEOUT}s."
-            if processing_ts:
-                try:
-                    app.client.chat_update(channel=channel, ts=processing_ts, text=msg)
-                except:
-                    say(text=msg, thread_ts=thread_ts)
-            else:
-                say(text=msg, thread_ts=thread_ts)
-        except Exception as e:
-            logger.error(f"[Usuario {user_id}] Error: {e}", exc_info=True)
-            msg = f"❌ Error: {str(e)}"
-            if processing_ts:
-                try:
-                    app.client.chat_update(channel=channel, ts=processing_ts, text=msg)
-                except:
-                    say(text=msg, thread_ts=thread_ts)
-            else:
-                say(text=msg, thread_ts=thread_ts)
-    
-    # Ejecutar en thread para no bloquear el event loop de Slack
-    thread = threading.Thread(target=run_claude)
-    thread.start()
 
 
 # ============== EVENT HANDLERS ==============
 
 @app.event("app_mention")
-def handle_mention(event, say):
+async def handle_mention(event, say):
     """Maneja menciones en canales (@Claudio ...)"""
     user_id = event.get("user")
     text = event.get("text", "")
@@ -747,7 +1027,7 @@ def handle_mention(event, say):
         text = re.sub(f'<@{BOT_USER_ID}>', '', text).strip()
     
     if not text:
-        say(
+        await say(
             text="👋 ¡Hola! Soy Claudio. ¿En qué puedo ayudarte?\n\nEscribe tu pregunta después de mencionarme.",
             thread_ts=thread_ts
         )
@@ -756,12 +1036,11 @@ def handle_mention(event, say):
     event_ts = event.get("ts")
     logger.info(f"[Mención] Usuario {user_id} en canal {channel}: {text[:50]}...")
 
-    # Ejecutar de forma síncrona
-    process_message_sync(user_id, text, say, channel, thread_ts, event_ts=event_ts)
+    await submit_message(user_id, text, say, channel, thread_ts, event_ts=event_ts, priority='mention')
 
 
 @app.event("message")
-def handle_dm(event, say):
+async def handle_dm(event, say):
     """Maneja mensajes directos (DMs)"""
     # Ignorar mensajes del bot mismo
     if event.get("bot_id"):
@@ -788,70 +1067,93 @@ def handle_dm(event, say):
     event_ts = event.get("ts")
     logger.info(f"[DM] Usuario {user_id}: {text[:50]}...")
 
-    # Ejecutar de forma síncrona
-    process_message_sync(user_id, text, say, channel, thread_ts, event_ts=event_ts)
+    await submit_message(user_id, text, say, channel, thread_ts, event_ts=event_ts)
 
 
 # ============== COMANDOS SLASH (opcional) ==============
 
 @app.command("/claudio")
-def handle_slash_command(ack, respond, command):
+async def handle_slash_command(ack, respond, command):
     """Maneja el comando /claudio"""
-    ack()  # Acknowledge inmediatamente
+    await ack()  # Acknowledge inmediatamente
     
     user_id = command.get("user_id")
     text = command.get("text", "").strip()
     channel = command.get("channel_id")
     
     if not text:
-        respond("👋 Soy Claudio. Usa `/claudio [tu pregunta]` para interactuar conmigo.")
+        await respond("👋 Soy Claudio. Usa `/claudio [tu pregunta]` para interactuar conmigo.")
         return
     
     logger.info(f"[Slash] Usuario {user_id}: {text[:50]}...")
     
     # Para slash commands, usamos respond en vez de say
-    def say_wrapper(text, thread_ts=None):
-        respond(text)
+    async def say_wrapper(text, thread_ts=None):
+        await respond(text)
     
-    asyncio.run(process_message(user_id, text, say_wrapper, channel))
+    await submit_message(user_id, text, say_wrapper, channel)
 
 
 @app.command("/claudio-new")
-def handle_new_conversation(ack, respond, command):
+async def handle_new_conversation(ack, respond, command):
     """Inicia una nueva conversación (limpia contexto)"""
-    ack()
+    await ack()
     
     user_id = command.get("user_id")
     
-    if user_id in user_sessions:
-        del user_sessions[user_id]
+    # Los hilos ya son conversaciones separadas: se olvida la de los slash commands
+    user_sessions.pop(session_key(user_id))
     
-    respond("✨ Nueva conversación iniciada. El contexto anterior ha sido limpiado.")
+    await respond(
+        "✨ Nueva conversación iniciada. El contexto anterior ha sido limpiado.\n"
+        "Cada hilo mantiene su propia conversación: escribe en un mensaje nuevo para empezar otra."
+    )
     logger.info(f"[Usuario {user_id}] Nueva conversación iniciada")
 
 
+@app.command("/claudio-cancel")
+async def handle_cancel(ack, respond, command):
+    """Cancela las ejecuciones en curso y en cola del usuario"""
+    await ack()
+    
+    user_id = command.get("user_id")
+    cancelled = job_queue.cancel(user_id)
+    
+    if cancelled:
+        logger.info(f"[Usuario {user_id}] {cancelled} ejecución(es) cancelada(s)")
+        await respond(f"🛑 {cancelled} ejecución(es) cancelada(s).")
+    else:
+        await respond("No hay ninguna ejecución en curso.")
+
+
 @app.command("/claudio-status")
-def handle_status(ack, respond, command):
+async def handle_status(ack, respond, command):
     """Muestra el estado del bot"""
-    ack()
+    await ack()
     
     user_id = command.get("user_id")
     
     # Verificar Claude CLI
     try:
-        result = subprocess.run(
-            [CLAUDE_CLI_PATH, '--version'],
-            capture_output=True,
-            timeout=5,
+        process = await asyncio.create_subprocess_exec(
+            CLAUDE_CLI_PATH, '--version',
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
             cwd=WORKSPACE_PATH
         )
+        try:
+            stdout, _ = await asyncio.wait_for(process.communicate(), timeout=5)
+        except asyncio.TimeoutError:
+            process.kill()
+            raise
         claude_status = "✅ Disponible"
-        if result.stdout:
-            claude_status += f" ({result.stdout.decode().strip()})"
+        if stdout:
+            claude_status += f" ({stdout.decode().strip()})"
     except Exception:
         claude_status = "❌ No disponible"
     
     is_authorized = is_user_authorized(user_id)
+    running, queued = job_queue.status(user_id)
     
     status_text = (
         f"📊 *Estado del Bot Claudio*\n\n"
@@ -859,47 +1161,29 @@ def handle_status(ack, respond, command):
         f"*Workspace:* `{WORKSPACE_PATH}`\n"
         f"*Tu User ID:* `{user_id}`\n"
         f"*Autorizado:* {'✅ Sí' if is_authorized else '❌ No'}\n"
-        f"*Sesión activa:* {'Sí' if user_id in user_sessions else 'No'}\n"
+        f"*Sesión activa:* {'Sí' if session_key(user_id) in user_sessions else 'No'}\n"
+        f"*Pool CLI:* {get_worker_pool().format_stats()}\n"
+        f"*Ejecuciones:* {running} en curso, {queued} en cola (modo {JOB_QUEUE_MODE})\n"
+        f"*Mensajes:* {message_executor.format_stats()}\n"
+        f"*Caché:* {response_cache.format_stats() if response_cache else 'desactivada'}\n"
+        f"*CLI en el host:* {admission.format_stats()}\n"
+        f"*Tu cuota:* {format_quota(user_id)}\n"
+        f"*Rate limit:* {rate_limiter.format_stats()}\n"
+        f"*Sesiones:* {user_sessions.format_stats()}\n"
+        f"*Contexto de hilos:* {thread_contexts.format_stats()}\n"
     )
     
-    respond(status_text)
+    await respond(status_text)
 
 
 # ============== MAIN ==============
 
-def main():
-    """Función principal."""
+async def run_bot():
+    """Conecta por Socket Mode y atiende eventos hasta recibir SIGTERM o Ctrl+C."""
     global BOT_USER_ID
     
-    # Prevenir múltiples instancias
-    if not acquire_lock():
-        print("\n" + "="*70)
-        print("❌ ERROR: Otra instancia del bot está ejecutándose")
-        print("="*70)
-        print("Solo puede haber una instancia del bot ejecutándose a la vez.")
-        print("\nPara solucionarlo:")
-        print("1. Busca procesos con: ps aux | grep slack.*bot")
-        print("2. Mata procesos duplicados con: kill <PID>")
-        print("="*70 + "\n")
-        sys.exit(1)
-    
-    # Validar tokens
-    if not SLACK_BOT_TOKEN:
-        logger.error("SLACK_BOT_TOKEN no configurado en .env")
-        print("\n❌ ERROR: SLACK_BOT_TOKEN no está configurado.")
-        print("Obtén tu token en: https://api.slack.com/apps")
-        release_lock()
-        sys.exit(1)
-    
-    if not SLACK_APP_TOKEN:
-        logger.error("SLACK_APP_TOKEN no configurado en .env")
-        print("\n❌ ERROR: SLACK_APP_TOKEN no está configurado.")
-        print("Habilita Socket Mode en tu Slack App y genera un App Token.")
-        release_lock()
-        sys.exit(1)
-    
     # Obtener Bot User ID
-    BOT_USER_ID = get_bot_user_id()
+    BOT_USER_ID = await get_bot_user_id()
     if BOT_USER_ID:
         logger.info(f"✅ Bot User ID: {BOT_USER_ID}")
     else:
@@ -922,20 +1206,83 @@ def main():
     print("\nEl bot escucha:")
     print("  - DMs directos")
     print("  - Menciones (@Claudio) en canales")
-    print("  - Comandos: /claudio, /claudio-new, /claudio-status")
+    print("  - Comandos: /claudio, /claudio-new, /claudio-cancel, /claudio-status")
     print("\nPresiona Ctrl+C para detener.")
     print("="*50 + "\n")
     
+    # Pre-arrancar procesos Claude CLI para reducir la latencia del primer mensaje
+    get_worker_pool().start()
+    
+    # Exponer las métricas del executor para Prometheus
+    if METRICS_PORT:
+        try:
+            start_http_server(METRICS_PORT, METRICS_HOST)
+        except OSError as e:
+            logger.error(f"No se pudo abrir el puerto de métricas {METRICS_HOST}:{METRICS_PORT}: {e}")
+    
+    # SIGTERM (systemd, docker stop) y Ctrl+C: salir por el `finally`, que drena los mensajes
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass  # Windows: Ctrl+C llega como KeyboardInterrupt
+    
     # Iniciar Socket Mode
+    handler = AsyncSocketModeHandler(app, SLACK_APP_TOKEN)
     try:
-        handler = SocketModeHandler(app, SLACK_APP_TOKEN)
-        handler.start()
-    except KeyboardInterrupt:
-        logger.info("Bot detenido por el usuario.")
+        await handler.connect_async()
+        await stop.wait()
+        logger.info("Señal recibida, deteniendo el bot...")
     except Exception as e:
         logger.error(f"Error en el bot: {e}", exc_info=True)
     finally:
+        # Dejar de recibir eventos y terminar lo que está en proceso y en cola
+        try:
+            await handler.close_async()
+        except Exception as e:
+            logger.debug(f"Error cerrando Socket Mode: {e}")
+        await message_executor.shutdown(SHUTDOWN_TIMEOUT)
         executor.cleanup_processes()
+        get_worker_pool().shutdown()
+        rate_limiter.close()
+
+
+def main():
+    """Función principal."""
+    # Prevenir múltiples instancias
+    if not acquire_lock():
+        print("\n" + "="*70)
+        print("❌ ERROR: Otra instancia del bot está ejecutándose")
+        print("="*70)
+        print("Solo puede haber una instancia del bot ejecutándose a la vez.")
+        print("\nPara solucionarlo:")
+        print("1. Busca procesos con: ps aux | grep slack.*bot")
+        print("2. Mata procesos duplicados con: kill <PID>")
+        print("="*70 + "\n")
+        sys.exit(1)
+    
+    # Validar tokens
+    if not SLACK_BOT_TOKEN:
+        logger.error("SLACK_BOT_TOKEN no configurado en .env")
+        print("\n❌ ERROR: SLACK_BOT_TOKEN no está configurado.")
+        print("Obtén tu token en: https://api.slack.com/apps")
+        release_lock()
+        sys.exit(1)
+    
+    if not SLACK_APP_TOKEN:
+        logger.error("SLACK_APP_TOKEN no configurado en .env")
+        print("\n❌ ERROR: SLACK_APP_TOKEN no está configurado.")
+        print("Habilita Socket Mode en tu Slack App y genera un App Token.")
+        release_lock()
+        sys.exit(1)
+    
+    try:
+        asyncio.run(run_bot())
+    except KeyboardInterrupt:
+        logger.info("Bot detenido por el usuario.")
+    finally:
         release_lock()
 
 
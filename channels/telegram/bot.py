@@ -4,23 +4,43 @@ Bot de Telegram que conecta con Claude Code CLI local.
 Permite ejecutar comandos y MCPs desde Telegram como si fuera la terminal local.
 """
 
+import io
 import os
 import subprocess
 import logging
 import asyncio
 import re
+import secrets
 import tempfile
 import sys
 import atexit
 from typing import Optional, Callable
 from dotenv import load_dotenv
 from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, ContextTypes, filters
-try:
-    from openai import OpenAI
-    OPENAI_AVAILABLE = True
-except ImportError:
-    OPENAI_AVAILABLE = False
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+from telegram.ext import Application, BaseUpdateProcessor, CommandHandler, MessageHandler, ContextTypes, filters
+
+# Módulos compartidos entre canales (channels/common)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from channels.common.admission import DEFAULT_MAX_CONCURRENT, AdmissionCancelled, AdmissionScheduler
+from channels.common.audio_preprocess import FFMPEG_AVAILABLE, AudioPreprocessor
+from channels.common.attachments import attachment_filename, output_buffer, should_attach, summarize_output
+from channels.common.chunker import MarkdownChunker, split_markdown
+from channels.common.job_queue import Job, JobCancelled, UserJobQueue
+from channels.common.line_decoder import read_lines
+from channels.common.metrics import EXECUTOR_METRICS, ExecutionRecord, start_http_server
+from channels.common.rate_limit import RateLimiter
+from channels.common.resource_limits import ResourceLimits
+from channels.common.response_cache import ResponseCache, split_bypass
+from channels.common.send_queue import SendQueue
+from channels.common.sessions import RESUME_FLAG, SessionStore, resume_args
+from channels.common.stream_json import STREAM_JSON_FLAGS, StreamEvent, StreamJsonParser
+from channels.common.transcription import (
+    FASTER_WHISPER_AVAILABLE, OPENAI_AVAILABLE, LocalWhisperBackend, OpenAIWhisperBackend,
+    TranscriptionCache, TranscriptionError, TranscriptionPool
+)
+from channels.common.update_order import KeyedOrdering, release_order
+from channels.common.worker_pool import ClaudeWorkerPool
 
 # File locking para prevenir múltiples instancias
 try:
@@ -44,37 +64,127 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Verificar disponibilidad de OpenAI (ya se verificó arriba, solo loguear si falta)
-if not OPENAI_AVAILABLE:
-    logger.warning("OpenAI no está instalado. La transcripción de voz no funcionará. Instala con: pip install openai")
-
 # Variables de configuración
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 CLAUDE_CLI_PATH = os.getenv('CLAUDE_CLI_PATH', 'claude')  # Ruta al ejecutable de Claude CLI
 WORKSPACE_PATH = os.getenv('WORKSPACE_PATH', os.getcwd())  # Directorio de trabajo
 MAX_MESSAGE_LENGTH = 4096  # Límite de Telegram
-BUFFER_TIMEOUT = float(os.getenv('BUFFER_TIMEOUT', '1.5'))  # Segundos para acumular salida antes de enviar
+# Salidas de más caracteres se envían como resumen + documento en vez de en decenas de mensajes (0 = nunca)
+OUTPUT_ATTACHMENT_THRESHOLD = int(os.getenv('OUTPUT_ATTACHMENT_THRESHOLD', '8000'))
+BUFFER_TIMEOUT = float(os.getenv('BUFFER_TIMEOUT', '1.5'))  # Segundos mínimos entre ediciones de la respuesta en vivo
 # SEGURIDAD: Timeout máximo para ejecución de comandos (en segundos)
 # Previene que comandos maliciosos bloqueen el bot indefinidamente
 COMMAND_TIMEOUT = float(os.getenv('COMMAND_TIMEOUT', '1800'))  # Por defecto 30 minutos (1800 segundos)
+STREAM_READ_SIZE = int(os.getenv('STREAM_READ_SIZE', '65536'))  # Bytes por lectura de stdout/stderr del CLI
+# Formato de salida del CLI: text (stdout plano) o stream-json (eventos NDJSON:
+# deltas de texto, herramientas, resultado y uso de tokens)
+CLAUDE_OUTPUT_FORMAT = os.getenv('CLAUDE_OUTPUT_FORMAT', 'text').lower()
 # SEGURIDAD: Longitud máxima de input para prevenir DoS por mensajes gigantes
 # Previene que usuarios envíen mensajes extremadamente largos que consuman recursos
 MAX_INPUT_LENGTH = int(os.getenv('MAX_INPUT_LENGTH', '10000'))  # Por defecto 10,000 caracteres
 
+# Pool de procesos Claude CLI pre-arrancados (0 = desactivado, cada mensaje arranca en frío)
+WORKER_POOL_SIZE = int(os.getenv('WORKER_POOL_SIZE', '2'))
+WORKER_POOL_IDLE_TTL = float(os.getenv('WORKER_POOL_IDLE_TTL', '300'))  # Segundos antes de reciclar un worker sin usar
+
+# Cola de ejecuciones por usuario: serialize (una a la vez), supersede (un mensaje
+# nuevo cancela el anterior) o parallel (hasta JOB_QUEUE_MAX_PARALLEL a la vez)
+JOB_QUEUE_MODE = os.getenv('JOB_QUEUE_MODE', 'serialize').lower()
+JOB_QUEUE_MAX_PARALLEL = int(os.getenv('JOB_QUEUE_MAX_PARALLEL', '2'))
+
+# Sesión del CLI de cada usuario (se retoma con --resume); vacío = no persistir entre reinicios
+SESSIONS_PATH = os.getenv('SESSIONS_PATH', '~/.claudio/sessions-telegram.json').strip() or None
+
+# Caché de respuestas para preguntas repetidas (solo sesiones nuevas, sin --resume).
+# Un mensaje que empieza por "!nocache" se ejecuta siempre.
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'false').lower() == 'true'
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', '3600'))  # Segundos
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', '5000000'))
+
+# Control de admisión compartido por todos los canales y crons del host:
+# máximo de procesos Claude CLI ejecutando a la vez (0 = sin límite).
+# Prioridad: DM (interactive) > grupo (mention) > reportes de cron (batch)
+ADMISSION_MAX_CONCURRENT = int(os.getenv('ADMISSION_MAX_CONCURRENT', str(DEFAULT_MAX_CONCURRENT)))
+ADMISSION_STATE_DIR = os.getenv('ADMISSION_STATE_DIR') or None  # Por defecto ~/.claudio
+
+# SEGURIDAD: Límites de recursos por ejecución (CLI + servidores MCP que lanza; 0 = sin límite).
+# Si se superan, se mata el árbol de procesos y el resultado lleva returncode -4
+CLAUDE_MAX_MEMORY_MB = int(os.getenv('CLAUDE_MAX_MEMORY_MB', '0'))  # RSS total
+CLAUDE_MAX_CPU_SECONDS = int(os.getenv('CLAUDE_MAX_CPU_SECONDS', '0'))
+CLAUDE_MAX_CHILDREN = int(os.getenv('CLAUDE_MAX_CHILDREN', '0'))  # Procesos hijos vivos a la vez
+
+# Métricas del executor en formato Prometheus: listener HTTP en METRICS_HOST:METRICS_PORT/metrics
+# (0 = desactivado). Por defecto solo escucha en localhost
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9101'))
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+
+# Cola de envíos salientes: ritmo por chat y global para no recibir 429 (RetryAfter).
+# Límites de Telegram: ~30 mensajes/s en total, ~1/s por chat privado y 20/min por grupo
+TELEGRAM_SEND_RATE = float(os.getenv('TELEGRAM_SEND_RATE', '25'))
+TELEGRAM_CHAT_SEND_RATE = float(os.getenv('TELEGRAM_CHAT_SEND_RATE', '1'))
+TELEGRAM_GROUP_SEND_RATE = float(os.getenv('TELEGRAM_GROUP_SEND_RATE', '0.33'))
+TELEGRAM_SEND_RETRIES = int(os.getenv('TELEGRAM_SEND_RETRIES', '5'))
+
+# Recepción de updates: polling (getUpdates) o webhook (servidor HTTP embebido)
+TELEGRAM_MODE = os.getenv('TELEGRAM_MODE', 'polling').lower()
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org/').rstrip('/') + '/'
+# URL pública (https) en la que Telegram entrega los updates; el bot escucha en LISTEN:PORT/PATH
+TELEGRAM_WEBHOOK_URL = os.getenv('TELEGRAM_WEBHOOK_URL', '').rstrip('/')
+TELEGRAM_WEBHOOK_LISTEN = os.getenv('TELEGRAM_WEBHOOK_LISTEN', '127.0.0.1')
+TELEGRAM_WEBHOOK_PORT = int(os.getenv('TELEGRAM_WEBHOOK_PORT', '8443'))
+TELEGRAM_WEBHOOK_PATH = os.getenv('TELEGRAM_WEBHOOK_PATH', 'telegram').strip('/')
+# SEGURIDAD: Telegram envía este secreto en cada petición y el servidor rechaza las que no lo traen.
+# Si no se configura se genera uno aleatorio en cada arranque
+TELEGRAM_WEBHOOK_SECRET = os.getenv('TELEGRAM_WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+# Descartar los mensajes recibidos mientras el bot estaba parado (por defecto solo en polling)
+TELEGRAM_DROP_PENDING_UPDATES = os.getenv(
+    'TELEGRAM_DROP_PENDING_UPDATES', 'true' if TELEGRAM_MODE == 'polling' else 'false'
+).lower() == 'true'
+# Updates procesados a la vez (los de un mismo usuario siguen en orden de llegada)
+TELEGRAM_CONCURRENT_UPDATES = int(os.getenv('TELEGRAM_CONCURRENT_UPDATES', '64'))
+
 # SEGURIDAD: Rate limiting para prevenir spam/DoS
 # Máximo número de requests permitidas por ventana de tiempo
 RATE_LIMIT_REQUESTS = int(os.getenv('RATE_LIMIT_REQUESTS', '10'))  # Por defecto 10 requests
 RATE_LIMIT_WINDOW = float(os.getenv('RATE_LIMIT_WINDOW', '60'))  # Por defecto 60 segundos (1 minuto)
+# Fichero SQLite para que los límites sobrevivan a un reinicio (vacío = solo en memoria)
+RATE_LIMIT_DB = os.getenv('RATE_LIMIT_DB', '').strip() or None
 
 # Configuración de transcripción de voz
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', '').strip()  # API key de OpenAI para Whisper
 USE_WHISPER_API = os.getenv('USE_WHISPER_API', 'true').lower() == 'true'  # Usar API o modelo local
+# Modelo local (USE_WHISPER_API=false): faster-whisper en CPU, cargado una vez al arrancar
+LOCAL_WHISPER_MODEL = os.getenv('LOCAL_WHISPER_MODEL', 'base')  # tiny, base, small... o ruta a un modelo
+LOCAL_WHISPER_COMPUTE_TYPE = os.getenv('LOCAL_WHISPER_COMPUTE_TYPE', 'int8')
+LOCAL_WHISPER_THREADS = int(os.getenv('LOCAL_WHISPER_THREADS', '0'))  # Hilos por transcripción (0 = automático)
+WHISPER_LANGUAGE = os.getenv('WHISPER_LANGUAGE', 'es').strip()
+if WHISPER_LANGUAGE.lower() == 'none':
+    WHISPER_LANGUAGE = ''
+# Las transcripciones corren en un pool de hilos para no bloquear al resto de usuarios
+TRANSCRIPTION_WORKERS = int(os.getenv('TRANSCRIPTION_WORKERS', '2'))
+TRANSCRIPTION_TIMEOUT = float(os.getenv('TRANSCRIPTION_TIMEOUT', '120'))  # Segundos por audio
+TRANSCRIPTION_MAX_PENDING = int(os.getenv('TRANSCRIPTION_MAX_PENDING', '16'))  # Audios en curso o en espera
+VOICE_MAX_BYTES = int(os.getenv('VOICE_MAX_BYTES', str(20 * 1024 * 1024)))  # La Bot API no descarga más de 20 MB
+# Preprocesado con ffmpeg: 16 kHz mono, sin silencios en los extremos y, si es larga, en trozos paralelos
+VOICE_PREPROCESS = os.getenv('VOICE_PREPROCESS', 'true').lower() == 'true'
+VOICE_SPLIT_SECONDS = float(os.getenv('VOICE_SPLIT_SECONDS', '60'))  # Duración máxima por trozo (0 = no dividir)
+VOICE_SILENCE_DB = float(os.getenv('VOICE_SILENCE_DB', '-40'))  # Nivel por debajo del cual hay silencio
+VOICE_MIN_PAUSE = float(os.getenv('VOICE_MIN_PAUSE', '0.5'))  # Segundos de pausa para poder cortar
+VOICE_OPUS_BITRATE = os.getenv('VOICE_OPUS_BITRATE', '16k')  # Bitrate de los trozos que se suben
+# Caché de transcripciones por file_unique_id (0 = desactivada); con ruta, persiste entre reinicios
+TRANSCRIPTION_CACHE_SIZE = int(os.getenv('TRANSCRIPTION_CACHE_SIZE', '256'))
+TRANSCRIPTION_CACHE_PATH = os.getenv('TRANSCRIPTION_CACHE_PATH') or None
 
 # Log inicial de configuración
-if OPENAI_API_KEY:
-    logger.info(f"OpenAI API key configurada: {OPENAI_API_KEY[:10]}...{OPENAI_API_KEY[-4:]}")
-else:
-    logger.warning("OPENAI_API_KEY no configurada. La transcripción de voz no funcionará.")
+if USE_WHISPER_API:
+    if not OPENAI_AVAILABLE:
+        logger.warning("OpenAI no está instalado. La transcripción de voz no funcionará. Instala con: pip install openai")
+    if OPENAI_API_KEY:
+        logger.info(f"OpenAI API key configurada: {OPENAI_API_KEY[:10]}...{OPENAI_API_KEY[-4:]}")
+    else:
+        logger.warning("OPENAI_API_KEY no configurada. La transcripción de voz no funcionará.")
+elif not FASTER_WHISPER_AVAILABLE:
+    logger.warning("faster-whisper no está instalado. La transcripción local no funcionará. Instala con: pip install faster-whisper")
 
 # Herramientas permitidas automáticamente (para MCPs y herramientas sin prompts)
 # Por defecto permite todas las herramientas. Puedes restringir con: "Read,Edit,Bash"
@@ -93,15 +203,61 @@ ALLOWED_USER_IDS = [
     if uid.strip()
 ]
 
-# Almacenar conversaciones por usuario
-user_sessions = {}
+# Session id del CLI de cada usuario (persistido en SESSIONS_PATH)
+user_sessions = SessionStore(SESSIONS_PATH)
+# Veces que cada usuario ha hecho /new: una ejecución que empezó antes de un /new
+# no vuelve a guardar su sesión al terminar
+session_resets = {}
 
 # Almacenar procesos activos por usuario (para modo interactivo)
 active_processes = {}
 
-# SEGURIDAD: Rate limiting - rastrear timestamps de requests por usuario
-# Estructura: {user_id: [timestamp1, timestamp2, ...]}
-rate_limit_tracker = {}
+# Cola de ejecuciones por usuario (permite /cancel)
+job_queue = UserJobQueue(JOB_QUEUE_MODE, JOB_QUEUE_MAX_PARALLEL)
+
+# Scheduler de admisión del host (estado compartido en ADMISSION_STATE_DIR)
+admission = AdmissionScheduler(ADMISSION_MAX_CONCURRENT, ADMISSION_STATE_DIR)
+
+# Caché de respuestas (None si está desactivada)
+response_cache = ResponseCache(
+    WORKSPACE_PATH, ttl=RESPONSE_CACHE_TTL, max_bytes=RESPONSE_CACHE_MAX_BYTES
+) if RESPONSE_CACHE_ENABLED else None
+
+def telegram_retry_delay(error: Exception, attempt: int) -> Optional[float]:
+    """Segundos antes de reintentar un envío fallido, o None si no se reintenta."""
+    if isinstance(error, RetryAfter):
+        retry_after = error.retry_after
+        return retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else float(retry_after)
+    if isinstance(error, BadRequest):
+        return None
+    if isinstance(error, (TimedOut, NetworkError)):
+        return min(2 ** attempt, 30)
+    return None
+
+
+# Cola de envíos salientes (los chats de grupo tienen id negativo)
+send_queue = SendQueue(
+    global_rate=TELEGRAM_SEND_RATE,
+    global_burst=max(1, int(TELEGRAM_SEND_RATE)),
+    chat_limits=lambda chat_id: (TELEGRAM_GROUP_SEND_RATE if chat_id < 0 else TELEGRAM_CHAT_SEND_RATE, 3),
+    retry_delay=telegram_retry_delay,
+    max_retries=TELEGRAM_SEND_RETRIES
+)
+
+# SEGURIDAD: Rate limiting por usuario (GCRA, expulsa a los usuarios inactivos)
+rate_limiter = RateLimiter(RATE_LIMIT_REQUESTS, RATE_LIMIT_WINDOW, RATE_LIMIT_DB)
+
+# Pool global de workers pre-arrancados (se crea en get_worker_pool() y arranca en main())
+worker_pool = None
+
+# Pool global de transcripción (se crea en get_transcription_pool())
+transcription_pool = None
+
+# Transcripciones ya hechas: una nota reenviada no se vuelve a transcribir
+transcription_cache = (
+    TranscriptionCache(TRANSCRIPTION_CACHE_SIZE, TRANSCRIPTION_CACHE_PATH)
+    if TRANSCRIPTION_CACHE_SIZE > 0 else None
+)
 
 # Lock file para prevenir múltiples instancias
 LOCK_FILE_PATH = os.path.join(tempfile.gettempdir(), 'telegram_claude_bot.lock')
@@ -192,81 +348,260 @@ def remove_ansi_codes(text: str) -> str:
     return ansi_escape.sub('', text)
 
 
-class OutputBuffer:
-    """Buffer inteligente que acumula salida y la envía después de un timeout."""
+class LiveMessage:
+    """
+    Respuesta que se edita en Telegram a medida que llega la salida del CLI.
+
+    Las ediciones se limitan a una cada `interval` segundos (Telegram
+    limita las ediciones por chat) y se omiten si el texto no cambió. La
+    salida pasa por un `MarkdownChunker`: al llenarse un mensaje se cierra con
+    sus bloques y marcadores balanceados (ya con Markdown) y la salida sigue en
+    uno nuevo. Las ediciones del mensaje en curso van en texto plano (el
+    Markdown a medias no se puede parsear); `finish()` aplica Markdown a la
+    última parte.
+    Si la salida pasa de `attach_threshold` caracteres deja de mostrarse y, al
+    terminar, se envía un resumen y la salida completa como documento.
+    Todo pasa por `send_queue`: una edición aún no enviada se sustituye por la
+    siguiente del mismo mensaje.
+    """
     
-    def __init__(self, callback: Callable, timeout: float = BUFFER_TIMEOUT):
-        self.buffer = ""
-        self.callback = callback
-        self.timeout = timeout
-        self.last_update = None
-        self.task = None
-        self.lock = asyncio.Lock()
+    def __init__(
+        self,
+        message,
+        reply: Callable,
+        interval: float = BUFFER_TIMEOUT,
+        max_length: int = MAX_MESSAGE_LENGTH,
+        reply_document: Optional[Callable] = None,
+        attach_threshold: int = OUTPUT_ATTACHMENT_THRESHOLD
+    ):
+        """
+        Args:
+            message: Mensaje a editar (el de "⏳ Procesando...")
+            reply: Función async que envía un mensaje nuevo y lo devuelve
+            interval: Segundos mínimos entre ediciones
+            max_length: Caracteres máximos por mensaje
+            reply_document: Función async que envía un documento (sin ella no hay adjuntos)
+            attach_threshold: Caracteres a partir de los que la salida va como documento (0 = nunca)
+        """
+        self.message = message
+        self.chat_id = message.chat_id
+        self.reply = reply
+        self.interval = interval
+        self.max_length = max_length
+        self.reply_document = reply_document
+        self.attach_threshold = attach_threshold if reply_document else 0
+        self.attached = False     # La salida superó el umbral e irá como documento
+        self.length = 0
+        self.edits = 0
+        self._output = []         # Salida completa (solo si puede acabar en un documento)
+        self._chunker = MarkdownChunker(max_length, '*_')
+        self._ready = []          # Mensajes completos pendientes de mostrar
+        self._shown = None        # Último texto enviado al mensaje actual
+        self._next_edit = 0.0     # Instante (loop.time) a partir del cual se puede editar
+        self._task = None
+        self._lock = asyncio.Lock()
+    
+    @property
+    def started(self) -> bool:
+        """True si ya se mostró salida (el mensaje dejó de ser el de estado)."""
+        return self.edits > 0
     
     async def append(self, text: str):
-        """Agrega texto al buffer y programa el envío."""
-        async with self.lock:
-            self.buffer += text
-            self.last_update = asyncio.get_event_loop().time()
-            
-            # Cancelar task anterior si existe
-            if self.task and not self.task.done():
-                self.task.cancel()
-            
-            # Programar nuevo envío
-            self.task = asyncio.create_task(self._send_after_timeout())
-    
-    async def _send_after_timeout(self):
-        """Espera el timeout y envía el buffer."""
+        """Agrega salida y programa una edición si no hay una pendiente."""
+        if self.attach_threshold:
+            self._output.append(text)
+            self.length += len(text)
+            if not self.attached and should_attach(self.length, self.attach_threshold):
+                # A partir de aquí no se envían más mensajes: todo irá en el documento
+                self.attached = True
+                self._ready.clear()
+        if not self.attached:
+            self._ready.extend(self._chunker.feed(text))
+        if self._task is None or self._task.done():
+            delay = max(0.0, self._next_edit - asyncio.get_running_loop().time())
+            self._task = asyncio.create_task(self._render_after(delay))
+    
+    async def finish(self):
+        """Muestra todo lo pendiente y aplica el formato Markdown a la última parte."""
+        self.cancel()
+        await self._render(final=True)
+    
+    def cancel(self):
+        """Descarta la edición pendiente (p.ej. si la ejecución falla)."""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+    
+    async def _render_after(self, delay: float):
         try:
-            await asyncio.sleep(self.timeout)
-            async with self.lock:
-                if self.buffer:
-                    text = self.buffer
-                    self.buffer = ""
-                    await self.callback(text)
+            await asyncio.sleep(delay)
+            await self._render(final=False)
         except asyncio.CancelledError:
             pass
     
-    async def flush(self):
-        """Fuerza el envío inmediato del buffer."""
-        async with self.lock:
-            if self.task and not self.task.done():
-                self.task.cancel()
-            if self.buffer:
-                text = self.buffer
-                self.buffer = ""
-                await self.callback(text)
+    async def _render(self, final: bool):
+        async with self._lock:
+            if self.attached:
+                await self._render_attachment(final)
+                return
+            if final:
+                self._ready.extend(self._chunker.flush())
+            while self._ready:
+                chunk = self._ready.pop(0)
+                await self._show(chunk, markdown=True)
+                # La última parte se queda en el mensaje actual
+                if final and not self._ready:
+                    return
+                # Cerrar el mensaje lleno y seguir en uno nuevo
+                self.message = None
+                self._shown = None
+            
+            current = self._chunker.current
+            if current.strip():
+                await self._show(current, markdown=False)
+    
+    async def _render_attachment(self, final: bool):
+        if not final:
+            await self._show("📎 Respuesta larga: se enviará como archivo al terminar...", markdown=False)
+            return
+        output = ''.join(self._output)
+        await self._show(summarize_output(output, '*_'), markdown=True)
+        filename = attachment_filename()
+        try:
+            # Buffer nuevo en cada intento: un reintento de la cola no lo encuentra ya leído
+            await send_queue.submit(
+                self.chat_id,
+                lambda: self.reply_document(document=output_buffer(output), filename=filename)
+            )
+        except Exception as e:
+            logger.warning(f"No se pudo enviar la salida como documento, se envía en mensajes: {e}")
+            for chunk in split_markdown(output, self.max_length, '*_'):
+                self.message = None
+                self._shown = None
+                await self._show(chunk, markdown=True)
+    
+    async def _show(self, text: str, markdown: bool):
+        if text == self._shown and not markdown:
+            return
+        try:
+            if self.message is None:
+                self.message = await self._send(text, markdown)
+            else:
+                await self._edit(text, markdown)
+            self._shown = text
+            self.edits += 1
+        except Exception as e:
+            logger.debug(f"No se pudo actualizar el mensaje en vivo: {e}")
+        self._next_edit = asyncio.get_running_loop().time() + self.interval
+    
+    async def _send(self, text: str, markdown: bool):
+        if markdown:
+            try:
+                return await send_queue.submit(self.chat_id, lambda: self.reply(text, parse_mode='Markdown'))
+            except BadRequest:
+                pass
+        return await send_queue.submit(self.chat_id, lambda: self.reply(text))
+    
+    async def _edit(self, text: str, markdown: bool):
+        message = self.message
+        key = ('edit', message.message_id)
+        if not markdown:
+            await send_queue.submit(self.chat_id, lambda: message.edit_text(text), key=key)
+            return
+        try:
+            await send_queue.submit(self.chat_id, lambda: message.edit_text(text, parse_mode='Markdown'), key=key)
+        except BadRequest as e:
+            if 'not modified' in str(e).lower():
+                return
+            # Markdown inválido (p.ej. un bloque cortado): dejar el texto plano
+            if text != self._shown:
+                await send_queue.submit(self.chat_id, lambda: message.edit_text(text), key=key)
+
+
+async def queued_reply(update: Update, text: str, **kwargs):
+    """Responde al mensaje del usuario a través de la cola de envíos."""
+    return await send_queue.submit(update.effective_chat.id, lambda: update.message.reply_text(text, **kwargs))
+
+
+async def queued_edit(message, text: str, **kwargs):
+    """Edita un mensaje a través de la cola (sustituye una edición pendiente del mismo mensaje)."""
+    return await send_queue.submit(
+        message.chat_id, lambda: message.edit_text(text, **kwargs), key=('edit', message.message_id)
+    )
+
+
+def format_limit_exceeded(result: dict) -> str:
+    """Mensaje para el usuario cuando una ejecución se mata por superar un límite."""
+    names = {
+        'memory': f"memoria ({CLAUDE_MAX_MEMORY_MB} MB)",
+        'cpu': f"CPU ({CLAUDE_MAX_CPU_SECONDS}s)",
+        'children': f"procesos hijos ({CLAUDE_MAX_CHILDREN})",
+    }
+    resources = result.get('resources') or {}
+    return (
+        f"🧯 *Límite de recursos superado:* {names.get(result['limit_exceeded'], result['limit_exceeded'])}\n\n"
+        f"La ejecución se detuvo (pico {resources.get('peak_rss_mb', '?')} MB, "
+        f"{resources.get('cpu_seconds', '?')}s de CPU, {resources.get('peak_children', '?')} procesos hijos)."
+    )
 
 
 class ClaudeCodeExecutor:
     """Ejecutor de comandos Claude Code CLI con lectura en tiempo real."""
     
-    def __init__(self, workspace_path: str = None):
+    def __init__(self, workspace_path: str = None, pool: ClaudeWorkerPool = None):
         self.workspace_path = workspace_path or WORKSPACE_PATH
         self.claude_path = CLAUDE_CLI_PATH
+        self.pool = pool  # Por defecto usa el pool global
         self.active_processes = []  # Track procesos activos para cleanup
     
     def cleanup_processes(self):
         """Mata todos los procesos activos de Claude CLI."""
         for process_info in self.active_processes[:]:
             try:
-                pid, process = process_info
-                if process.returncode is None:  # Proceso aún corriendo
+                pid, worker = process_info
+                if worker.is_alive():  # Proceso aún corriendo
                     logger.warning(f"Killing orphaned Claude CLI process (PID: {pid})")
-                    process.kill()
-                    process.wait()
+                    worker.kill()
             except Exception as e:
                 logger.debug(f"Error cleaning up process: {e}")
         self.active_processes.clear()
     
+    def build_command(self, user_id: int, continue_session: bool) -> list:
+        """Construye el comando del CLI. La query se envía por stdin (-p sin argumento)."""
+        cmd = [self.claude_path]
+        
+        # Retomar la sesión del usuario por id (con -c se retomaría la última del workspace, de cualquiera)
+        session_id = user_sessions.get(user_id) if continue_session else None
+        if session_id:
+            cmd.extend(resume_args(session_id))
+            logger.info(f"[Usuario {user_id}] Continuando sesión {session_id}")
+        
+        # Agregar flags para aprobar automáticamente herramientas/MCPs
+        if SKIP_PERMISSIONS:
+            cmd.append('--dangerously-skip-permissions')
+        elif ALLOWED_TOOLS and ALLOWED_TOOLS != '*':
+            cmd.extend(['--allowedTools', ALLOWED_TOOLS])
+        
+        if CLAUDE_OUTPUT_FORMAT == 'stream-json':
+            cmd.extend(STREAM_JSON_FLAGS)
+        
+        # -p para modo no interactivo; la query llega por stdin
+        cmd.append('-p')
+        return cmd
+    
+    @EXECUTOR_METRICS.instrument('telegram')
     async def execute_streaming(
         self, 
         query: str, 
         user_id: int, 
         continue_session: bool,
         output_callback: Callable[[str], None],
-        error_callback: Optional[Callable[[str], None]] = None
+        error_callback: Optional[Callable[[str], None]] = None,
+        job: Optional[Job] = None,
+        event_callback: Optional[Callable[[StreamEvent], None]] = None,
+        use_cache: bool = True,
+        priority: str = 'interactive',
+        on_admission_wait: Optional[Callable[[int], None]] = None,
+        record: Optional[ExecutionRecord] = None
     ) -> dict:
         """
         Ejecuta un comando en Claude Code CLI con lectura en tiempo real.
@@ -274,113 +609,131 @@ class ClaudeCodeExecutor:
         Args:
             query: El mensaje/comando a ejecutar
             user_id: ID del usuario para mantener sesiones separadas
-            continue_session: Si True, continúa la conversación anterior usando -c
+            continue_session: Si True, retoma la sesión del usuario con --resume
             output_callback: Función async que se llama con cada fragmento de salida
             error_callback: Función async opcional para manejar errores
+            job: Job de la cola del usuario; cancelarlo mata el proceso
+            event_callback: Función async opcional que recibe los `StreamEvent`
+                (solo con CLAUDE_OUTPUT_FORMAT=stream-json). Los deltas de texto
+                llegan además a output_callback
+            use_cache: Si False, no consulta la caché de respuestas
+            priority: Clase de prioridad en el scheduler del host
+                ('interactive', 'mention' o 'batch')
+            on_admission_wait: Función async opcional que recibe la posición
+                en la cola del host mientras no hay hueco libre
+            record: Mediciones de la ejecución (lo pasa el decorador de métricas)
             
         Returns:
-            dict con 'success', 'returncode'
+            dict con 'success', 'returncode' (y 'cancelled' si se canceló;
+            'cached' si la respuesta vino de la caché; 'usage' en modo
+            stream-json). 'session_id' es la sesión del CLI usada, para
+            retomarla en el siguiente mensaje. 'resources' trae el pico de RSS, la CPU y
+            los procesos hijos de la ejecución; 'limit_exceeded' indica qué
+            límite se superó (returncode -4)
         """
+        ticket = None
         try:
-            # Construir comando
-            cmd = [self.claude_path]
+            cmd = self.build_command(user_id, continue_session)
             
-            # Si hay una sesión previa y queremos continuarla, usar -c (continue)
-            if continue_session and user_id in user_sessions:
-                cmd.append('-c')
-                logger.info(f"[Usuario {user_id}] Continuando sesión anterior")
+            # Solo se cachean sesiones nuevas: al retomar, la respuesta depende del historial
+            cache = response_cache if use_cache and RESUME_FLAG not in cmd else None
+            if cache is not None:
+                cached = cache.get(query)
+                if cached is not None:
+                    logger.info(f"[Usuario {user_id}] Respuesta servida desde caché ({len(cached)} chars)")
+                    await output_callback(cached)
+                    return {'success': True, 'returncode': 0, 'cached': True}
+            captured = []
+            had_errors = False
             
-            # Agregar flags para aprobar automáticamente herramientas/MCPs
-            if SKIP_PERMISSIONS:
-                cmd.append('--dangerously-skip-permissions')
-            elif ALLOWED_TOOLS and ALLOWED_TOOLS != '*':
-                cmd.extend(['--allowedTools', ALLOWED_TOOLS])
-            
-            # Agregar -p para modo no interactivo y la query
-            cmd.extend(['-p', query])
-            
-            # Configurar entorno
-            env = os.environ.copy()
-            env['PWD'] = self.workspace_path
+            async def emit(text: str):
+                if cache is not None:
+                    captured.append(text)
+                await output_callback(text)
             
             logger.info(f"[Usuario {user_id}] Ejecutando comando: {' '.join(cmd[:3])}... (query: {query[:50]}...)")
             logger.debug(f"[Usuario {user_id}] Comando completo: {' '.join(cmd)}")
             
-            # Ejecutar comando con lectura en tiempo real
-            process = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-                cwd=self.workspace_path,
-                env=env
+            # Esperar hueco en el límite de procesos del host (todos los canales y crons)
+            ticket = await admission.acquire_async(
+                priority,
+                f"telegram:{user_id}",
+                on_position=on_admission_wait,
+                cancelled=(lambda: job.cancelled) if job is not None else None
             )
             
+            # Tomar un proceso pre-arrancado del pool (o lanzarlo en frío) y enviarle la query
+            pool = self.pool or get_worker_pool()
+            if record is not None:
+                record.spawn_started()
+            worker = pool.acquire(cmd)
+            if job is not None:
+                job.attach(worker)
+            await asyncio.get_running_loop().run_in_executor(None, worker.send_prompt, query)
+            if record is not None:
+                record.spawned(worker)
+            stdout, stderr = await worker.open_streams()
+            
             # Track proceso para cleanup
-            process_pid = process.pid
-            self.active_processes.append((process_pid, process))
+            process_pid = worker.pid
+            self.active_processes.append((process_pid, worker))
+            
+            parser = StreamJsonParser() if CLAUDE_OUTPUT_FORMAT == 'stream-json' else None
+            usage = {}
+            
+            async def handle_event(event: StreamEvent):
+                nonlocal had_errors
+                if event.kind in ('text_delta', 'raw'):
+                    await emit(event.text if event.kind == 'text_delta' else event.text + '\n')
+                elif event.kind == 'result':
+                    had_errors = had_errors or event.is_error
+                elif event.kind == 'usage':
+                    usage.update(event.data)
+                elif event.kind in ('tool_use_start', 'tool_use_end'):
+                    logger.info(f"[Usuario {user_id}] Herramienta {event.tool}: {event.kind}")
+                if event_callback:
+                    await event_callback(event)
             
             # Leer stdout y stderr en paralelo
             async def read_stream(stream, is_error=False):
-                buffer = b''
-                while True:
-                    chunk = await stream.read(1024)
-                    if not chunk:
-                        break
-                    buffer += chunk
-                    # Intentar decodificar líneas completas
-                    try:
-                        text = buffer.decode('utf-8', errors='replace')
-                        # Buscar líneas completas
-                        while '\n' in text:
-                            line, text = text.split('\n', 1)
-                            cleaned = remove_ansi_codes(line)
-                            if cleaned.strip():
-                                if is_error:
-                                    logger.warning(f"[Usuario {user_id}] STDERR: {cleaned[:100]}")
-                                    if error_callback:
-                                        await error_callback(cleaned)
-                                else:
-                                    logger.debug(f"[Usuario {user_id}] STDOUT: {cleaned[:100]}")
-                                    await output_callback(cleaned + '\n')
-                        buffer = text.encode('utf-8', errors='replace')
-                    except Exception as e:
-                        logger.error(f"[Usuario {user_id}] Error decodificando stream: {e}")
-                
-                # Procesar buffer restante
-                if buffer:
-                    try:
-                        text = buffer.decode('utf-8', errors='replace')
-                        cleaned = remove_ansi_codes(text)
-                        if cleaned.strip():
-                            if is_error:
-                                logger.warning(f"[Usuario {user_id}] STDERR final: {cleaned[:100]}")
-                                if error_callback:
-                                    await error_callback(cleaned)
-                            else:
-                                logger.debug(f"[Usuario {user_id}] STDOUT final: {cleaned[:100]}")
-                                await output_callback(cleaned)
-                    except Exception as e:
-                        logger.error(f"[Usuario {user_id}] Error decodificando buffer final: {e}")
+                nonlocal had_errors
+                on_data = None if is_error else worker.note_output
+                async for line, terminated in read_lines(stream, STREAM_READ_SIZE, on_data):
+                    if parser and not is_error:
+                        # stream-json: sin códigos ANSI, cada línea es un evento
+                        for event in parser.feed_line(line):
+                            await handle_event(event)
+                        continue
+                    cleaned = remove_ansi_codes(line)
+                    if not cleaned.strip():
+                        continue
+                    if is_error:
+                        had_errors = True
+                        logger.warning(f"[Usuario {user_id}] STDERR: {cleaned[:100]}")
+                        if error_callback:
+                            await error_callback(cleaned)
+                    else:
+                        logger.debug(f"[Usuario {user_id}] STDOUT: {cleaned[:100]}")
+                        await emit(cleaned + '\n' if terminated else cleaned)
             
             # SEGURIDAD: Ejecutar con timeout para prevenir comandos que bloqueen el bot
             try:
                 # Leer ambos streams en paralelo con timeout
                 await asyncio.wait_for(
                     asyncio.gather(
-                        read_stream(process.stdout, is_error=False),
-                        read_stream(process.stderr, is_error=True)
+                        read_stream(stdout, is_error=False),
+                        read_stream(stderr, is_error=True)
                     ),
                     timeout=COMMAND_TIMEOUT
                 )
                 
                 # Esperar a que el proceso termine
-                returncode = await process.wait()
+                returncode = await worker.wait()
             except asyncio.TimeoutError:
                 # Timeout alcanzado - matar el proceso
                 logger.warning(f"[Usuario {user_id}] ⚠️ TIMEOUT: Comando excedió {COMMAND_TIMEOUT}s. Terminando proceso...")
                 try:
-                    process.kill()
-                    await process.wait()
+                    worker.kill()
                     # Remover de procesos activos
                     self.active_processes = [p for p in self.active_processes if p[0] != process_pid]
                 except Exception as kill_error:
@@ -398,20 +751,57 @@ class ClaudeCodeExecutor:
                 return {
                     'success': False,
                     'returncode': -2,  # Código especial para timeout
-                    'timeout': True
+                    'timeout': True,
+                    'resources': worker.usage()
                 }
             
-            success = returncode == 0
-            logger.info(f"[Usuario {user_id}] Comando completado con código: {returncode} (éxito: {success})")
-            
             # Remover de procesos activos
             self.active_processes = [p for p in self.active_processes if p[0] != process_pid]
+            pool.release(worker)
+            resources = worker.usage()
+            logger.info(f"[Usuario {user_id}] Recursos: {resources}")
             
-            return {
+            if worker.limit_exceeded:
+                logger.warning(f"[Usuario {user_id}] ⚠️ Límite de recursos superado: {worker.limit_exceeded}")
+                return {
+                    'success': False,
+                    'returncode': -4,  # Código especial para límite de recursos
+                    'limit_exceeded': worker.limit_exceeded,
+                    'resources': resources
+                }
+            
+            if job is not None and job.cancelled:
+                logger.info(f"[Usuario {user_id}] Ejecución cancelada (código: {returncode})")
+                return {
+                    'success': False,
+                    'returncode': -3,  # Código especial para cancelación
+                    'cancelled': True
+                }
+            
+            success = returncode == 0
+            logger.info(f"[Usuario {user_id}] Comando completado con código: {returncode} (éxito: {success})")
+            if cache is not None and success and not had_errors:
+                cache.put(query, ''.join(captured))
+            
+            result = {
                 'success': success,
-                'returncode': returncode
+                'returncode': returncode,
+                'resources': resources,
+                # El init de stream-json manda; si no, el id asignado al worker o el retomado
+                'session_id': (parser.session_id if parser else None) or worker.session_id
+                    or (cmd[cmd.index(RESUME_FLAG) + 1] if RESUME_FLAG in cmd else None)
             }
+            if parser:
+                result['usage'] = usage
+            return result
             
+        except AdmissionCancelled:
+            logger.info(f"[Usuario {user_id}] Cancelado mientras esperaba hueco en el host")
+            return {
+                'success': False,
+                'returncode': -3,
+                'cancelled': True
+            }
         except FileNotFoundError:
             error_msg = f'Claude CLI no encontrado en: {self.claude_path}'
             logger.error(f"[Usuario {user_id}] {error_msg}")
@@ -430,6 +820,105 @@ class ClaudeCodeExecutor:
                 'success': False,
                 'returncode': -1
             }
+        finally:
+            if ticket is not None:
+                await asyncio.get_running_loop().run_in_executor(None, admission.release, ticket)
+
+
+def update_order_key(update: object) -> Optional[int]:
+    """
+    Clave de orden de un update: el usuario, para sus mensajes de texto y voz.
+    
+    Los comandos (/cancel, /status...) no esperan turno: tienen que responder
+    aunque el usuario tenga mensajes en curso.
+    """
+    if not isinstance(update, Update) or not update.effective_user or not update.message:
+        return None
+    if (update.message.text or '').startswith('/'):
+        return None
+    return update.effective_user.id
+
+
+class UserOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Procesa hasta `max_concurrent_updates` updates a la vez sin desordenar los
+    de un mismo usuario: cada mensaje espera a que el anterior del usuario haya
+    entrado en su cola de ejecuciones (ver `release_order()` en process_query).
+    """
+    
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self.ordering = KeyedOrdering()
+    
+    async def do_process_update(self, update: object, coroutine) -> None:
+        key = update_order_key(update)
+        if key is None:
+            await coroutine
+        else:
+            await self.ordering.run(key, coroutine)
+    
+    async def initialize(self) -> None:
+        pass
+    
+    async def shutdown(self) -> None:
+        pass
+
+
+def get_worker_pool() -> ClaudeWorkerPool:
+    """Devuelve el pool global de workers, creándolo la primera vez."""
+    global worker_pool
+    
+    if worker_pool is None:
+        env = os.environ.copy()
+        env['PWD'] = WORKSPACE_PATH
+        worker_pool = ClaudeWorkerPool(
+            ClaudeCodeExecutor().build_command(0, continue_session=False),
+            cwd=WORKSPACE_PATH,
+            env=env,
+            size=WORKER_POOL_SIZE,
+            idle_ttl=WORKER_POOL_IDLE_TTL,
+            limits=ResourceLimits(CLAUDE_MAX_MEMORY_MB, CLAUDE_MAX_CPU_SECONDS, CLAUDE_MAX_CHILDREN),
+            session_ids=True
+        )
+    return worker_pool
+
+
+def get_transcription_pool() -> Optional[TranscriptionPool]:
+    """Devuelve el pool global de transcripción, o None si no hay backend disponible."""
+    global transcription_pool
+    
+    if transcription_pool is None:
+        try:
+            if USE_WHISPER_API:
+                backend = OpenAIWhisperBackend(OPENAI_API_KEY, timeout=TRANSCRIPTION_TIMEOUT)
+            else:
+                backend = LocalWhisperBackend(
+                    LOCAL_WHISPER_MODEL,
+                    compute_type=LOCAL_WHISPER_COMPUTE_TYPE,
+                    cpu_threads=LOCAL_WHISPER_THREADS
+                )
+        except TranscriptionError as e:
+            logger.error(f"[Transcripción] {e}")
+            return None
+        preprocessor = None
+        if VOICE_PREPROCESS:
+            if FFMPEG_AVAILABLE:
+                preprocessor = AudioPreprocessor(
+                    silence_db=VOICE_SILENCE_DB,
+                    min_pause=VOICE_MIN_PAUSE,
+                    max_chunk_seconds=VOICE_SPLIT_SECONDS,
+                    bitrate=VOICE_OPUS_BITRATE
+                )
+            else:
+                logger.warning("[Transcripción] ffmpeg no disponible: los audios se transcriben sin preprocesar")
+        transcription_pool = TranscriptionPool(
+            backend,
+            max_workers=TRANSCRIPTION_WORKERS,
+            timeout=TRANSCRIPTION_TIMEOUT,
+            max_pending=TRANSCRIPTION_MAX_PENDING,
+            preprocessor=preprocessor
+        )
+    return transcription_pool
 
 
 def is_user_authorized(user_id: int) -> bool:
@@ -450,142 +939,79 @@ def is_user_authorized(user_id: int) -> bool:
     return user_id in ALLOWED_USER_IDS
 
 
-def check_rate_limit(user_id: int) -> tuple[bool, float]:
-    """
-    Verifica si un usuario ha excedido el límite de rate limiting.
-    
-    Args:
-        user_id: ID del usuario de Telegram
-        
-    Returns:
-        Tupla (is_allowed, time_until_reset)
-        - is_allowed: True si el usuario puede hacer la request, False si excedió el límite
-        - time_until_reset: Segundos hasta que se resetee la ventana (0 si está permitido)
-    """
-    import time
-    current_time = time.time()
-    
-    # Limpiar timestamps antiguos (fuera de la ventana)
-    if user_id in rate_limit_tracker:
-        # Mantener solo timestamps dentro de la ventana
-        rate_limit_tracker[user_id] = [
-            ts for ts in rate_limit_tracker[user_id]
-            if current_time - ts < RATE_LIMIT_WINDOW
-        ]
-    else:
-        rate_limit_tracker[user_id] = []
-    
-    # Verificar si excedió el límite
-    request_count = len(rate_limit_tracker[user_id])
-    
-    if request_count >= RATE_LIMIT_REQUESTS:
-        # Calcular tiempo hasta que expire el timestamp más antiguo
-        oldest_timestamp = min(rate_limit_tracker[user_id])
-        time_until_reset = RATE_LIMIT_WINDOW - (current_time - oldest_timestamp)
-        return False, max(0, time_until_reset)
-    
-    # Registrar esta request
-    rate_limit_tracker[user_id].append(current_time)
-    return True, 0
+def format_quota(user_id: int) -> str:
+    """Mensajes que le quedan al usuario en la ventana actual."""
+    if RATE_LIMIT_REQUESTS <= 0:
+        return "sin límite"
+    remaining = rate_limiter.remaining(user_id)
+    text = f"{remaining} de {RATE_LIMIT_REQUESTS} mensajes"
+    if not remaining:
+        text += f" (siguiente en {rate_limiter.retry_after(user_id):.0f}s)"
+    return text
 
 
-async def transcribe_voice_message(voice_file_path: str) -> Optional[str]:
+async def transcribe_voice_message(
+    audio: bytes,
+    filename: str = 'voice.ogg',
+    on_partial: Optional[Callable[[str], None]] = None
+) -> Optional[str]:
     """
-    Transcribe un archivo de audio a texto usando OpenAI Whisper API.
+    Transcribe un audio a texto en el pool de transcripción (sin bloquear el event loop).
     
     Args:
-        voice_file_path: Ruta al archivo de audio
+        audio: Contenido del archivo de audio
+        filename: Nombre del archivo (el backend deduce el formato por la extensión)
+        on_partial: Recibe el texto acumulado a medida que se transcribe (por trozos o segmentos)
         
     Returns:
         Texto transcrito o None si hay error
     """
-    if not OPENAI_AVAILABLE:
-        logger.error("OpenAI no está disponible. Instala: pip install openai")
-        return None
-    
-    if not OPENAI_API_KEY:
-        logger.error("OPENAI_API_KEY no está configurado en .env")
+    pool = get_transcription_pool()
+    if pool is None:
         return None
     
     try:
-        logger.info(f"[Transcripción] Transcribiendo audio: {voice_file_path}")
-        client = OpenAI(api_key=OPENAI_API_KEY)
-        
-        # Obtener idioma de configuración o usar español por defecto
-        language = os.getenv('WHISPER_LANGUAGE', 'es')
-        if language.lower() == 'none' or language == '':
-            language = None
-        
-        with open(voice_file_path, 'rb') as audio_file:
-            transcript = client.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file,
-                language=language
-            )
-        
-        text = transcript.text.strip()
+        text = await pool.transcribe(audio, filename, WHISPER_LANGUAGE or None, on_partial=on_partial)
         logger.info(f"[Transcripción] Transcripción exitosa ({len(text)} caracteres): {text[:100]}...")
         return text
-        
-    except Exception as e:
-        logger.error(f"[Transcripción] Error transcribiendo audio: {e}", exc_info=True)
+    except TranscriptionError as e:
+        logger.error(f"[Transcripción] Error transcribiendo audio: {e}")
         return None
 
 
-async def download_voice_file(voice, context: ContextTypes.DEFAULT_TYPE) -> Optional[str]:
+async def download_voice_file(voice, context: ContextTypes.DEFAULT_TYPE) -> Optional[bytes]:
     """
-    Descarga un archivo de voz de Telegram.
+    Descarga un archivo de voz de Telegram a memoria.
     
     Args:
         voice: Objeto Voice de Telegram
         context: Contexto del bot
         
     Returns:
-        Ruta al archivo descargado o None si hay error
+        Contenido del audio o None si hay error o supera VOICE_MAX_BYTES
     """
     try:
         # Obtener el archivo
         file = await context.bot.get_file(voice.file_id)
+        if file.file_size and file.file_size > VOICE_MAX_BYTES:
+            logger.warning(f"Archivo de voz demasiado grande: {file.file_size} bytes")
+            return None
         
-        # Crear archivo temporal
-        temp_dir = tempfile.gettempdir()
-        temp_file = os.path.join(temp_dir, f"voice_{voice.file_id}.ogg")
-        
-        # Descargar el archivo
-        await file.download_to_drive(temp_file)
-        logger.info(f"Archivo de voz descargado: {temp_file}")
+        # Descargar sin pasar por disco
+        buffer = io.BytesIO()
+        await file.download_to_memory(buffer)
+        if buffer.tell() > VOICE_MAX_BYTES:
+            logger.warning(f"Archivo de voz demasiado grande: {buffer.tell()} bytes")
+            return None
+        logger.info(f"Archivo de voz descargado: {buffer.tell()} bytes")
         
-        return temp_file
+        return buffer.getvalue()
         
     except Exception as e:
         logger.error(f"Error descargando archivo de voz: {e}", exc_info=True)
         return None
 
 
-def split_message(text: str, max_length: int = MAX_MESSAGE_LENGTH) -> list:
-    """Divide un mensaje largo en partes más pequeñas."""
-    if len(text) <= max_length:
-        return [text]
-    
-    parts = []
-    current = text
-    
-    while len(current) > max_length:
-        # Intentar dividir en un salto de línea cercano
-        split_pos = current.rfind('\n', 0, max_length)
-        if split_pos == -1:
-            # Si no hay salto de línea, dividir en el límite
-            split_pos = max_length
-        
-        parts.append(current[:split_pos])
-        current = current[split_pos:].lstrip()
-    
-    if current:
-        parts.append(current)
-    
-    return parts
-
-
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Maneja el comando /start."""
     user_id = update.effective_user.id
@@ -614,6 +1040,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/start - Muestra este mensaje\n"
         "/help - Muestra ayuda detallada\n"
         "/new - Inicia una nueva conversación\n"
+        "/cancel - Cancela la ejecución en curso\n"
         "/status - Muestra el estado del bot\n"
         "/myid - Muestra tu ID de usuario\n\n"
         "Simplemente escribe tu mensaje y se ejecutará en Claude Code."
@@ -663,6 +1090,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/start - Mensaje de bienvenida\n"
         "/help - Esta ayuda\n"
         "/new - Inicia nueva conversación (limpia contexto)\n"
+        "/cancel - Cancela la ejecución en curso y las que estén en cola\n"
         "/status - Estado del bot y configuración\n\n"
         "*Notas:*\n"
         "• Las conversaciones se mantienen por usuario\n"
@@ -681,14 +1109,31 @@ async def new_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     user_id = update.effective_user.id
-    if user_id in user_sessions:
-        del user_sessions[user_id]
+    user_sessions.pop(user_id, None)
+    session_resets[user_id] = session_resets.get(user_id, 0) + 1
     
     await update.message.reply_text(
         "✨ Nueva conversación iniciada. El contexto anterior ha sido limpiado."
     )
 
 
+async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Cancela las ejecuciones en curso y en cola del usuario."""
+    # Verificar autorización
+    if not is_user_authorized(update.effective_user.id):
+        await update.message.reply_text("❌ No estás autorizado para usar este bot.")
+        return
+    
+    user_id = update.effective_user.id
+    cancelled = job_queue.cancel(user_id)
+    
+    if cancelled:
+        logger.info(f"[Usuario {user_id}] {cancelled} ejecución(es) cancelada(s) con /cancel")
+        await update.message.reply_text(f"🛑 {cancelled} ejecución(es) cancelada(s).")
+    else:
+        await update.message.reply_text("No hay ninguna ejecución en curso.")
+
+
 async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Muestra el estado del bot."""
     # Verificar autorización
@@ -698,13 +1143,17 @@ async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     executor = ClaudeCodeExecutor()
     
-    # Verificar si Claude CLI está disponible
+    # Verificar si Claude CLI está disponible (en un hilo: no bloquear al resto de updates)
     try:
-        result = subprocess.run(
-            [executor.claude_path, '--version'],
-            capture_output=True,
-            timeout=5,
-            cwd=WORKSPACE_PATH
+        result = await asyncio.get_running_loop().run_in_executor(
+            None,
+            lambda: subprocess.run(
+                [executor.claude_path, '--version'],
+                capture_output=True,
+                stdin=subprocess.DEVNULL,
+                timeout=5,
+                cwd=WORKSPACE_PATH
+            )
         )
         claude_status = "✅ Disponible"
         if result.stdout:
@@ -714,13 +1163,26 @@ async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Verificar estado de transcripción de voz
     whisper_status = "❌ No disponible"
-    if OPENAI_AVAILABLE:
+    if not USE_WHISPER_API:
+        if FASTER_WHISPER_AVAILABLE:
+            whisper_status = f"✅ Modelo local ({LOCAL_WHISPER_MODEL}, {LOCAL_WHISPER_COMPUTE_TYPE})"
+        else:
+            whisper_status = "❌ faster-whisper no instalado"
+    elif OPENAI_AVAILABLE:
         if OPENAI_API_KEY:
             whisper_status = f"✅ Configurado (key: {OPENAI_API_KEY[:10]}...{OPENAI_API_KEY[-4:]})"
         else:
             whisper_status = "⚠️ OpenAI instalado pero falta API key"
     else:
         whisper_status = "❌ OpenAI no instalado"
+    if transcription_pool is not None:
+        whisper_status += f"\n*Transcripciones:* {transcription_pool.format_stats()}"
+        if transcription_pool.preprocessor is not None:
+            whisper_status += f"\n*Preproceso de voz:* {transcription_pool.preprocessor.format_stats()}"
+    if transcription_cache is not None:
+        whisper_status += f"\n*Caché de voz:* {transcription_cache.format_stats()}"
+    
+    running, queued = job_queue.status(update.effective_user.id)
     
     status_text = (
         "📊 *Estado del Bot*\n\n"
@@ -730,6 +1192,14 @@ async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"*Usuario:* {update.effective_user.first_name}\n"
         f"*Sesión activa:* {'Sí' if update.effective_user.id in user_sessions else 'No'}\n"
         f"*Transcripción de voz:* {whisper_status}\n"
+        f"*Pool CLI:* {get_worker_pool().format_stats()}\n"
+        f"*Ejecuciones:* {running} en curso, {queued} en cola (modo {JOB_QUEUE_MODE})\n"
+        f"*Caché:* {response_cache.format_stats() if response_cache else 'desactivada'}\n"
+        f"*CLI en el host:* {admission.format_stats()}\n"
+        f"*Envíos:* {send_queue.format_stats()}\n"
+        f"*Tu cuota:* {format_quota(update.effective_user.id)}\n"
+        f"*Rate limit:* {rate_limiter.format_stats()}\n"
+        f"*Sesiones:* {user_sessions.format_stats()}\n"
     )
     
     await update.message.reply_text(status_text, parse_mode='Markdown')
@@ -743,7 +1213,8 @@ async def handle_voice_message(update: Update, context: ContextTypes.DEFAULT_TYP
     # Verificar autorización
     if not is_user_authorized(user_id):
         logger.warning(f"[SEGURIDAD] Usuario no autorizado intentó enviar voz: {user_id} (@{username})")
-        await update.message.reply_text(
+        await queued_reply(
+            update,
             "❌ *Acceso denegado*\n\n"
             "No estás autorizado para usar este bot.\n"
             "Contacta al administrador para obtener acceso.",
@@ -752,10 +1223,11 @@ async def handle_voice_message(update: Update, context: ContextTypes.DEFAULT_TYP
         return
     
     # SEGURIDAD: Verificar rate limiting
-    is_allowed, time_until_reset = check_rate_limit(user_id)
+    is_allowed, time_until_reset = rate_limiter.check(user_id)
     if not is_allowed:
         logger.warning(f"[SEGURIDAD] Usuario {user_id} (@{username}) excedió rate limit. Esperar {time_until_reset:.1f}s")
-        await update.message.reply_text(
+        await queued_reply(
+            update,
             f"⏱️ *Rate limit excedido*\n\n"
             f"Has enviado demasiadas solicitudes en poco tiempo.\n"
             f"Por favor espera {int(time_until_reset)} segundos antes de intentar de nuevo.\n\n"
@@ -764,10 +1236,23 @@ async def handle_voice_message(update: Update, context: ContextTypes.DEFAULT_TYP
         )
         return
     
+    # Verificar disponibilidad del modelo local
+    if not USE_WHISPER_API and not FASTER_WHISPER_AVAILABLE:
+        logger.error(f"[Usuario {user_id}] faster-whisper no está instalado")
+        await queued_reply(
+            update,
+            "❌ *Transcripción no disponible*\n\n"
+            "faster-whisper no está instalado.\n"
+            "Instala con: `pip install faster-whisper`",
+            parse_mode='Markdown'
+        )
+        return
+    
     # Verificar disponibilidad de OpenAI
-    if not OPENAI_AVAILABLE:
+    if USE_WHISPER_API and not OPENAI_AVAILABLE:
         logger.error(f"[Usuario {user_id}] OpenAI no está instalado")
-        await update.message.reply_text(
+        await queued_reply(
+            update,
             "❌ *Transcripción no disponible*\n\n"
             "OpenAI no está instalado.\n"
             "Instala con: `pip install openai`",
@@ -776,9 +1261,10 @@ async def handle_voice_message(update: Update, context: ContextTypes.DEFAULT_TYP
         return
     
     # Verificar API key
-    if not OPENAI_API_KEY or not OPENAI_API_KEY.strip():
+    if USE_WHISPER_API and not OPENAI_API_KEY:
         logger.error(f"[Usuario {user_id}] OPENAI_API_KEY no configurada")
-        await update.message.reply_text(
+        await queued_reply(
+            update,
             "❌ *Transcripción no disponible*\n\n"
             "OPENAI_API_KEY no está configurada en el archivo .env.\n"
             "Agrega tu API key y reinicia el bot.",
@@ -786,36 +1272,58 @@ async def handle_voice_message(update: Update, context: ContextTypes.DEFAULT_TYP
         )
         return
     
-    logger.info(f"[Usuario {user_id}] API key encontrada: {OPENAI_API_KEY[:10]}...{OPENAI_API_KEY[-4:]}")
-    
     voice = update.message.voice
     
+    if voice.file_size and voice.file_size > VOICE_MAX_BYTES:
+        await queued_reply(
+            update,
+            f"❌ El audio es demasiado grande (máximo {VOICE_MAX_BYTES // (1024 * 1024)} MB)."
+        )
+        return
+    
     # Mostrar que está procesando
-    processing_msg = await update.message.reply_text("🎤 Transcribiendo audio...")
+    processing_msg = await queued_reply(update, "🎤 Transcribiendo audio...")
     
     try:
-        # Descargar archivo de voz
-        voice_file_path = await download_voice_file(voice, context)
-        if not voice_file_path:
-            await processing_msg.edit_text("❌ Error descargando el archivo de voz.")
-            return
-        
-        # Transcribir audio
-        await processing_msg.edit_text("🔄 Procesando transcripción...")
-        transcribed_text = await transcribe_voice_message(voice_file_path)
-        
-        # Limpiar archivo temporal
-        try:
-            os.remove(voice_file_path)
-        except Exception as e:
-            logger.warning(f"No se pudo eliminar archivo temporal: {e}")
-        
-        if not transcribed_text:
-            await processing_msg.edit_text("❌ Error transcribiendo el audio. Intenta de nuevo.")
-            return
+        # Una nota reenviada o repetida conserva su file_unique_id
+        transcribed_text = transcription_cache.get(voice.file_unique_id) if transcription_cache else None
+        if transcribed_text:
+            logger.info(f"[Usuario {user_id}] Transcripción en caché para {voice.file_unique_id}")
+        else:
+            # Descargar archivo de voz
+            audio = await download_voice_file(voice, context)
+            if not audio:
+                await queued_edit(processing_msg, "❌ Error descargando el archivo de voz.")
+                return
+            
+            # Transcribir audio
+            await queued_edit(processing_msg, "🔄 Procesando transcripción...")
+            
+            async def show_partial(text: str):
+                # La cola sustituye la edición pendiente: no se acumulan ediciones atrasadas
+                try:
+                    await queued_edit(processing_msg, f"🔄 Transcribiendo...\n\n{text[-(MAX_MESSAGE_LENGTH - 100):]}")
+                except Exception as e:
+                    logger.debug(f"No se pudo mostrar la transcripción parcial: {e}")
+            
+            transcribed_text = await transcribe_voice_message(
+                audio,
+                f"voice_{voice.file_unique_id}.ogg",
+                on_partial=lambda text: asyncio.create_task(show_partial(text))
+            )
+            
+            if not transcribed_text:
+                await queued_edit(processing_msg, "❌ Error transcribiendo el audio. Intenta de nuevo.")
+                return
+            
+            if transcription_cache:
+                # put() puede escribir el fichero de persistencia: fuera del event loop
+                await asyncio.get_running_loop().run_in_executor(
+                    None, transcription_cache.put, voice.file_unique_id, transcribed_text
+                )
         
         # Mostrar transcripción
-        await processing_msg.edit_text(f"📝 *Transcripción:*\n\n{transcribed_text}")
+        await queued_edit(processing_msg, f"📝 *Transcripción:*\n\n{transcribed_text}")
         
         # Procesar el texto transcrito como si fuera un mensaje de texto normal
         logger.info(f"[Usuario {user_id} (@{username})] Voz transcrita: {transcribed_text[:100]}...")
@@ -825,7 +1333,7 @@ async def handle_voice_message(update: Update, context: ContextTypes.DEFAULT_TYP
         
     except Exception as e:
         logger.error(f"[Usuario {user_id}] Error procesando voz: {e}", exc_info=True)
-        await processing_msg.edit_text(f"❌ Error procesando voz: {str(e)}")
+        await queued_edit(processing_msg, f"❌ Error procesando voz: {str(e)}")
 
 
 async def process_query(
@@ -845,14 +1353,16 @@ async def process_query(
         user_id: ID del usuario
         username: Username del usuario
     """
+    query, skip_cache = split_bypass(query or '')
     if not query or not query.strip():
-        await update.message.reply_text("Por favor envía un mensaje válido.")
+        await queued_reply(update, "Por favor envía un mensaje válido.")
         return
     
     # SEGURIDAD: Validar longitud máxima de input para prevenir DoS
     if len(query) > MAX_INPUT_LENGTH:
         logger.warning(f"[SEGURIDAD] Usuario {user_id} (@{username}) envió mensaje demasiado largo: {len(query)} caracteres (máximo: {MAX_INPUT_LENGTH})")
-        await update.message.reply_text(
+        await queued_reply(
+            update,
             f"❌ *Mensaje demasiado largo*\n\n"
             f"El mensaje excede el límite máximo permitido de {MAX_INPUT_LENGTH:,} caracteres.\n"
             f"Tu mensaje tiene {len(query):,} caracteres.\n\n"
@@ -864,67 +1374,103 @@ async def process_query(
     logger.info(f"[Usuario {user_id} (@{username})] Procesando query: {query[:100]}...")
     
     # Mostrar que está procesando
-    processing_msg = await update.message.reply_text("⏳ Procesando...")
+    processing_msg = await queued_reply(update, "⏳ Procesando...")
     current_message = processing_msg
     
-    # Acumular toda la salida
-    all_output = []
+    # Registrar la ejecución en la cola del usuario; a partir de aquí la cola
+    # mantiene el orden y el siguiente mensaje del usuario ya puede procesarse
+    job = job_queue.submit(user_id, query[:50])
+    release_order()
+    resets = session_resets.get(user_id, 0)
+    
+    # La respuesta se muestra editando el mensaje de estado a medida que llega
+    live = LiveMessage(processing_msg, update.message.reply_text, reply_document=update.message.reply_document)
     has_received_output = False
     
     async def handle_output_chunk(text: str):
         """Maneja cada fragmento de salida."""
-        nonlocal all_output, has_received_output, current_message
+        nonlocal has_received_output
         
-        if text.strip():
-            has_received_output = True
-            all_output.append(text)
+        # En modo stream-json los deltas pueden ser solo espacios o saltos de línea
+        if text:
+            has_received_output = has_received_output or bool(text.strip())
+            await live.append(text if CLAUDE_OUTPUT_FORMAT == 'stream-json' else remove_ansi_codes(text))
             logger.debug(f"[Usuario {user_id}] Salida recibida: {text[:100]}...")
     
+    async def handle_event(event: StreamEvent):
+        """Muestra qué herramienta está usando Claude mientras no hay respuesta."""
+        if event.kind == 'tool_use_start' and event.tool and not has_received_output:
+            try:
+                await queued_edit(current_message, f"⏳ Procesando... 🔧 {event.tool}")
+            except Exception as e:
+                logger.debug(f"[Usuario {user_id}] No se pudo actualizar el estado: {e}")
+    
     async def handle_error_chunk(text: str):
         """Maneja fragmentos de error."""
-        nonlocal all_output, has_received_output
+        nonlocal has_received_output
         if text.strip():
             has_received_output = True
             logger.warning(f"[Usuario {user_id}] Error recibido: {text[:200]}")
-            all_output.append(f"⚠️ Error: {text}\n")
+            await live.append(f"⚠️ Error: {text}\n")
+    
+    async def handle_admission_wait(position: int):
+        """Avisa de la posición en la cola del host (todos los canales y crons)."""
+        if live.started:
+            return
+        try:
+            if position:
+                await queued_edit(current_message, f"⏳ Servidor ocupado, en cola (posición {position})...")
+            else:
+                await queued_edit(current_message, "⏳ Procesando...")
+        except Exception as e:
+            logger.debug(f"[Usuario {user_id}] No se pudo mostrar posición en el host: {e}")
     
     # Ejecutar comando con streaming
     executor = ClaudeCodeExecutor()
-    continue_session = user_id in user_sessions
+    # Los DMs tienen prioridad sobre los mensajes en grupos
+    priority = 'interactive' if update.effective_chat.type == 'private' else 'mention'
+    
+    if job.position:
+        try:
+            await queued_edit(
+                current_message,
+                f"⏳ En cola (posición {job.position}). Usa /cancel para cancelar."
+            )
+        except Exception as e:
+            logger.debug(f"[Usuario {user_id}] No se pudo mostrar posición en cola: {e}")
     
     try:
-        result = await executor.execute_streaming(
-            query,
-            user_id,
-            continue_session,
-            handle_output_chunk,
-            handle_error_chunk
+        async with job_queue.run(user_id, job=job):
+            if job.position:
+                await queued_edit(current_message, "⏳ Procesando...")
+            # Recalcular: la ejecución anterior en cola pudo abrir la sesión
+            continue_session = user_id in user_sessions
+            result = await executor.execute_streaming(
+                query,
+                user_id,
+                continue_session,
+                handle_output_chunk,
+                handle_error_chunk,
+                job=job,
+                event_callback=handle_event,
+                use_cache=not skip_cache,
+                priority=priority,
+                on_admission_wait=handle_admission_wait
+            )
+        
+        # Mostrar lo que quede pendiente y dar formato a la última parte
+        await live.finish()
+        logger.info(
+            f"[Usuario {user_id}] Respuesta mostrada en {live.edits} edición(es)"
+            f"{' + documento' if live.attached else ''}"
         )
         
-        # Procesar y enviar toda la salida acumulada
-        if all_output:
-            combined = ''.join(all_output)
-            cleaned = remove_ansi_codes(combined)
-            
-            if cleaned.strip():
-                parts = split_message(cleaned)
-                if parts:
-                    try:
-                        await current_message.edit_text(
-                            parts[0],
-                            parse_mode='Markdown'
-                        )
-                        for part in parts[1:]:
-                            await update.message.reply_text(part, parse_mode='Markdown')
-                    except Exception as e:
-                        logger.error(f"[Usuario {user_id}] Error enviando mensaje: {e}")
-                        # Si falla edit, crear nuevo mensaje
-                        try:
-                            await update.message.reply_text(parts[0], parse_mode='Markdown')
-                            for part in parts[1:]:
-                                await update.message.reply_text(part, parse_mode='Markdown')
-                        except Exception as e2:
-                            logger.error(f"[Usuario {user_id}] Error crítico enviando mensaje: {e2}")
+        if result.get('cancelled'):
+            if live.started:
+                await queued_reply(update, "🛑 Ejecución cancelada.")
+            else:
+                await queued_edit(current_message, "🛑 Ejecución cancelada.")
+            return
         
         # Mostrar resultado final solo si no hubo salida
         if not result['success']:
@@ -938,31 +1484,45 @@ async def process_query(
                 )
                 if not has_received_output:
                     try:
-                        await current_message.edit_text(timeout_msg, parse_mode='Markdown')
+                        await queued_edit(current_message, timeout_msg, parse_mode='Markdown')
                     except Exception:
-                        await update.message.reply_text(timeout_msg, parse_mode='Markdown')
+                        await queued_reply(update, timeout_msg, parse_mode='Markdown')
+            elif result.get('limit_exceeded'):
+                limit_msg = format_limit_exceeded(result)
+                try:
+                    if has_received_output:
+                        await queued_reply(update, limit_msg, parse_mode='Markdown')
+                    else:
+                        await queued_edit(current_message, limit_msg, parse_mode='Markdown')
+                except Exception as e:
+                    logger.error(f"[Usuario {user_id}] Error enviando aviso de límite: {e}")
             else:
                 error_msg = f"❌ *Error ejecutando comando (código: {result['returncode']})*"
                 if not has_received_output:
                     try:
-                        await current_message.edit_text(error_msg, parse_mode='Markdown')
+                        await queued_edit(current_message, error_msg, parse_mode='Markdown')
                     except Exception:
-                        await update.message.reply_text(error_msg, parse_mode='Markdown')
+                        await queued_reply(update, error_msg, parse_mode='Markdown')
         elif not has_received_output:
             # Solo mostrar éxito si no hubo ninguna salida
             try:
-                await current_message.edit_text("✅ Comando ejecutado exitosamente.", parse_mode='Markdown')
+                await queued_edit(current_message, "✅ Comando ejecutado exitosamente.", parse_mode='Markdown')
             except Exception as e:
                 logger.debug(f"[Usuario {user_id}] No se pudo editar mensaje de éxito: {e}")
         
-        # Marcar que el usuario tiene una sesión activa
-        if result['success']:
-            user_sessions[user_id] = True
-            logger.info(f"[Usuario {user_id}] Sesión marcada como activa")
+        # Guardar la sesión para retomarla en el siguiente mensaje (salvo que haya hecho /new mientras tanto)
+        if result['success'] and not result.get('cached') and session_resets.get(user_id, 0) == resets:
+            user_sessions.set(user_id, result.get('session_id'))
+            logger.info(f"[Usuario {user_id}] Sesión activa: {result.get('session_id')}")
         
+    except JobCancelled:
+        logger.info(f"[Usuario {user_id}] Ejecución cancelada antes de empezar")
+        await queued_edit(current_message, "🛑 Ejecución cancelada.")
     except Exception as e:
         logger.error(f"[Usuario {user_id}] Error en process_query: {e}", exc_info=True)
-        await update.message.reply_text(f"❌ Error interno: {str(e)}")
+        await queued_reply(update, f"❌ Error interno: {str(e)}")
+    finally:
+        live.cancel()
 
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -973,7 +1533,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Verificar autorización
     if not is_user_authorized(user_id):
         logger.warning(f"[SEGURIDAD] Usuario no autorizado intentó enviar mensaje: {user_id} (@{username})")
-        await update.message.reply_text(
+        await queued_reply(
+            update,
             "❌ *Acceso denegado*\n\n"
             "No estás autorizado para usar este bot.\n"
             "Contacta al administrador para obtener acceso.",
@@ -982,10 +1543,11 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     # SEGURIDAD: Verificar rate limiting
-    is_allowed, time_until_reset = check_rate_limit(user_id)
+    is_allowed, time_until_reset = rate_limiter.check(user_id)
     if not is_allowed:
         logger.warning(f"[SEGURIDAD] Usuario {user_id} (@{username}) excedió rate limit. Esperar {time_until_reset:.1f}s")
-        await update.message.reply_text(
+        await queued_reply(
+            update,
             f"⏱️ *Rate limit excedido*\n\n"
             f"Has enviado demasiadas solicitudes en poco tiempo.\n"
             f"Por favor espera {int(time_until_reset)} segundos antes de intentar de nuevo.\n\n"
@@ -997,13 +1559,41 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.message.text
     
     if not query or not query.strip():
-        await update.message.reply_text("Por favor envía un mensaje válido.")
+        await queued_reply(update, "Por favor envía un mensaje válido.")
         return
     
     # Procesar el mensaje usando la función compartida
     await process_query(update, context, query, user_id, username)
 
 
+def run_application(application: Application):
+    """Recibe updates por polling o por webhook según TELEGRAM_MODE (bloquea hasta detener el bot)."""
+    if TELEGRAM_MODE == 'webhook':
+        webhook_url = f"{TELEGRAM_WEBHOOK_URL}/{TELEGRAM_WEBHOOK_PATH}"
+        logger.info(
+            f"Modo webhook: escuchando en {TELEGRAM_WEBHOOK_LISTEN}:{TELEGRAM_WEBHOOK_PORT}/{TELEGRAM_WEBHOOK_PATH} "
+            f"(público: {webhook_url})"
+        )
+        # PTB levanta un servidor HTTP async que responde 403 si falta el secreto
+        # y registra la URL en Telegram con setWebhook al arrancar
+        application.run_webhook(
+            listen=TELEGRAM_WEBHOOK_LISTEN,
+            port=TELEGRAM_WEBHOOK_PORT,
+            url_path=TELEGRAM_WEBHOOK_PATH,
+            webhook_url=webhook_url,
+            secret_token=TELEGRAM_WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+            drop_pending_updates=TELEGRAM_DROP_PENDING_UPDATES,
+            close_loop=False  # No cerrar el loop al detener
+        )
+    else:
+        application.run_polling(
+            allowed_updates=Update.ALL_TYPES,
+            drop_pending_updates=TELEGRAM_DROP_PENDING_UPDATES,  # Ignorar actualizaciones pendientes al iniciar
+            close_loop=False  # No cerrar el loop al detener
+        )
+
+
 def main():
     """Función principal."""
     # Prevenir múltiples instancias
@@ -1024,6 +1614,16 @@ def main():
         release_lock()
         return
     
+    if TELEGRAM_MODE not in ('polling', 'webhook'):
+        logger.error(f"TELEGRAM_MODE inválido: {TELEGRAM_MODE} (usa polling o webhook)")
+        release_lock()
+        return
+    
+    if TELEGRAM_MODE == 'webhook' and not TELEGRAM_WEBHOOK_URL:
+        logger.error("TELEGRAM_MODE=webhook necesita TELEGRAM_WEBHOOK_URL (URL pública https del bot)")
+        release_lock()
+        return
+    
     # SEGURIDAD: Validar que ALLOWED_USER_IDS esté configurado
     if not ALLOWED_USER_IDS:
         logger.error(
@@ -1050,16 +1650,42 @@ def main():
     # Crear instancia global del executor para cleanup
     global_executor = ClaudeCodeExecutor()
     
+    # Pre-arrancar procesos Claude CLI para reducir la latencia del primer mensaje
+    get_worker_pool().start()
+    
+    # El modelo local tarda en cargar: mejor al arrancar que con la primera nota de voz
+    if not USE_WHISPER_API:
+        get_transcription_pool()
+    
+    # Exponer las métricas del executor para Prometheus
+    if METRICS_PORT:
+        try:
+            start_http_server(METRICS_PORT, METRICS_HOST)
+        except OSError as e:
+            logger.error(f"No se pudo abrir el puerto de métricas {METRICS_HOST}:{METRICS_PORT}: {e}")
+    
     # Crear aplicación
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .base_url(f"{TELEGRAM_API_URL}bot")
+        .base_file_url(f"{TELEGRAM_API_URL}file/bot")
+        .concurrent_updates(UserOrderedUpdateProcessor(TELEGRAM_CONCURRENT_UPDATES))
+        .build()
+    )
     
     # Registrar handlers
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("new", new_conversation))
+    application.add_handler(CommandHandler("cancel", cancel_command))
     application.add_handler(CommandHandler("status", status))
     application.add_handler(CommandHandler("myid", myid_command))
     
+    # Los updates se procesan en paralelo (TELEGRAM_CONCURRENT_UPDATES) para que /cancel
+    # y /status respondan mientras el CLI trabaja; UserOrderedUpdateProcessor mantiene
+    # el orden de los mensajes de cada usuario
+    
     # Handler para mensajes de voz (debe ir antes del handler de texto)
     application.add_handler(MessageHandler(filters.VOICE, handle_voice_message))
     
@@ -1070,11 +1696,7 @@ def main():
     logger.info("Bot iniciado. Presiona Ctrl+C para detener.")
     
     try:
-        application.run_polling(
-            allowed_updates=Update.ALL_TYPES,
-            drop_pending_updates=True,  # Ignorar actualizaciones pendientes al iniciar
-            close_loop=False  # No cerrar el loop al detener
-        )
+        run_application(application)
     except KeyboardInterrupt:
         logger.info("Bot detenido por el usuario.")
     except Exception as e:
@@ -1084,16 +1706,17 @@ def main():
         time.sleep(5)
         # Reintentar
         try:
-            application.run_polling(
-                allowed_updates=Update.ALL_TYPES,
-                drop_pending_updates=True
-            )
+            run_application(application)
         except Exception as e2:
             logger.error(f"Error crítico: {e2}. El bot no puede conectarse.")
     finally:
         # Cleanup: matar procesos huérfanos de Claude CLI
         try:
             global_executor.cleanup_processes()
+            get_worker_pool().shutdown()
+            if transcription_pool is not None:
+                transcription_pool.shutdown()
+            rate_limiter.close()
         except Exception as e:
             logger.debug(f"Error during cleanup: {e}")
         
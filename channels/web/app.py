@@ -8,20 +8,34 @@ import json
 import os
 import re
 import subprocess
+import sys
 import asyncio
 import logging
+import uuid
 from pathlib import Path
 from datetime import datetime
 from typing import Optional, Callable
 
 from fastapi import FastAPI, Request, HTTPException, WebSocket, WebSocketDisconnect
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from dotenv import load_dotenv
 
 load_dotenv(dotenv_path=Path(__file__).resolve().parent.parent.parent / ".env")
 
+# Módulos compartidos entre canales (channels/common)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
+from channels.common.admission import DEFAULT_MAX_CONCURRENT, AdmissionCancelled, AdmissionScheduler
+from channels.common.job_queue import Job, JobCancelled, UserJobQueue
+from channels.common.line_decoder import read_lines
+from channels.common.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, EXECUTOR_METRICS, ExecutionRecord
+from channels.common.resource_limits import ResourceLimits
+from channels.common.response_cache import ResponseCache, split_bypass
+from channels.common.sessions import RESUME_FLAG, SessionStore, resume_args
+from channels.common.stream_json import STREAM_JSON_FLAGS, StreamEvent, StreamJsonParser
+from channels.common.worker_pool import ClaudeWorkerPool
+
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO
@@ -38,7 +52,22 @@ DOCS_PATH = CLAUDIO_ROOT / "docs"
 CLAUDE_CLI_PATH = os.getenv('CLAUDE_CLI_PATH', 'claude')
 WORKSPACE_PATH = os.getenv('WORKSPACE_PATH', str(CLAUDIO_ROOT))
 COMMAND_TIMEOUT = float(os.getenv('COMMAND_TIMEOUT', '1800'))
+STREAM_READ_SIZE = int(os.getenv('STREAM_READ_SIZE', '65536'))
+CLAUDE_OUTPUT_FORMAT = os.getenv('CLAUDE_OUTPUT_FORMAT', 'text').lower()
 SKIP_PERMISSIONS = os.getenv('SKIP_PERMISSIONS', 'true').lower() == 'true'
+WORKER_POOL_SIZE = int(os.getenv('WORKER_POOL_SIZE', '2'))
+WORKER_POOL_IDLE_TTL = float(os.getenv('WORKER_POOL_IDLE_TTL', '300'))
+JOB_QUEUE_MODE = os.getenv('JOB_QUEUE_MODE', 'serialize').lower()
+JOB_QUEUE_MAX_PARALLEL = int(os.getenv('JOB_QUEUE_MAX_PARALLEL', '2'))
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'false').lower() == 'true'
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', '3600'))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', '5000000'))
+ADMISSION_MAX_CONCURRENT = int(os.getenv('ADMISSION_MAX_CONCURRENT', str(DEFAULT_MAX_CONCURRENT)))
+ADMISSION_STATE_DIR = os.getenv('ADMISSION_STATE_DIR') or None
+CLAUDE_MAX_MEMORY_MB = int(os.getenv('CLAUDE_MAX_MEMORY_MB', '0'))
+CLAUDE_MAX_CPU_SECONDS = int(os.getenv('CLAUDE_MAX_CPU_SECONDS', '0'))
+CLAUDE_MAX_CHILDREN = int(os.getenv('CLAUDE_MAX_CHILDREN', '0'))
+SESSIONS_PATH = os.getenv('SESSIONS_PATH', '~/.claudio/sessions-web.json').strip() or None
 
 app = FastAPI(
     title="Claudio Dashboard",
@@ -55,103 +84,188 @@ def remove_ansi_codes(text: str) -> str:
     return ansi_escape.sub('', text)
 
 
-chat_sessions: dict[str, bool] = {}
+# Session id del CLI de cada conversación del chat (la pestaña del navegador)
+chat_sessions = SessionStore(SESSIONS_PATH)
+
+# Id de conversación que envía el navegador en /ws/chat?conversation=...
+CONVERSATION_ID_RE = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+
+# Cola de ejecuciones por conexión WebSocket (permite cancelar)
+job_queue = UserJobQueue(JOB_QUEUE_MODE, JOB_QUEUE_MAX_PARALLEL)
+
+# Límite de procesos del CLI compartido con los bots y los crons del host
+admission = AdmissionScheduler(ADMISSION_MAX_CONCURRENT, ADMISSION_STATE_DIR)
+
+# Caché de respuestas para sesiones nuevas (None si está desactivada)
+response_cache = ResponseCache(
+    WORKSPACE_PATH, ttl=RESPONSE_CACHE_TTL, max_bytes=RESPONSE_CACHE_MAX_BYTES
+) if RESPONSE_CACHE_ENABLED else None
 
 
 class ClaudeCodeExecutor:
     """Ejecutor de Claude Code CLI con streaming via WebSocket."""
 
-    def __init__(self, workspace_path: str = None):
+    def __init__(self, workspace_path: str = None, pool: ClaudeWorkerPool = None):
         self.workspace_path = workspace_path or WORKSPACE_PATH
         self.claude_path = CLAUDE_CLI_PATH
+        self.pool = pool
+
+    def build_command(self, session_id: str, continue_session: bool) -> list:
+        """Comando del CLI; la query se envía por stdin (-p sin argumento)."""
+        cmd = [self.claude_path]
+
+        cli_session = chat_sessions.get(session_id) if continue_session else None
+        if cli_session:
+            cmd.extend(resume_args(cli_session))
+
+        if SKIP_PERMISSIONS:
+            cmd.append('--dangerously-skip-permissions')
+
+        if CLAUDE_OUTPUT_FORMAT == 'stream-json':
+            cmd.extend(STREAM_JSON_FLAGS)
 
+        cmd.append('-p')
+        return cmd
+
+    @EXECUTOR_METRICS.instrument('web')
     async def execute_streaming(
         self,
         query: str,
         session_id: str,
         continue_session: bool,
         output_callback: Callable,
-        error_callback: Optional[Callable] = None
+        error_callback: Optional[Callable] = None,
+        job: Optional[Job] = None,
+        event_callback: Optional[Callable] = None,
+        use_cache: bool = True,
+        on_admission_wait: Optional[Callable] = None,
+        record: Optional[ExecutionRecord] = None
     ) -> dict:
+        ticket = None
         try:
-            cmd = [self.claude_path]
-
-            if continue_session and session_id in chat_sessions:
-                cmd.append('-c')
-
-            if SKIP_PERMISSIONS:
-                cmd.append('--dangerously-skip-permissions')
-
-            cmd.extend(['-p', query])
-
-            env = os.environ.copy()
-            env['PWD'] = self.workspace_path
+            cmd = self.build_command(session_id, continue_session)
+
+            cache = response_cache if use_cache and RESUME_FLAG not in cmd else None
+            if cache is not None:
+                cached = cache.get(query)
+                if cached is not None:
+                    logger.info(f"[Chat {session_id}] Cache hit ({len(cached)} chars)")
+                    await output_callback(cached)
+                    return {'success': True, 'returncode': 0, 'cached': True}
+            captured = []
+            had_errors = False
+
+            async def emit(text: str):
+                if cache is not None:
+                    captured.append(text)
+                await output_callback(text)
 
             logger.info(f"[Chat {session_id}] Ejecutando: {query[:80]}...")
 
-            process = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-                cwd=self.workspace_path,
-                env=env
+            # El chat web es interactivo: prioridad sobre menciones y reportes batch
+            ticket = await admission.acquire_async(
+                'interactive',
+                f"web:{session_id}",
+                on_position=on_admission_wait,
+                cancelled=(lambda: job.cancelled) if job is not None else None
             )
 
+            pool = self.pool or get_worker_pool()
+            if record is not None:
+                record.spawn_started()
+            worker = pool.acquire(cmd)
+            if job is not None:
+                job.attach(worker)
+            await asyncio.get_running_loop().run_in_executor(None, worker.send_prompt, query)
+            if record is not None:
+                record.spawned(worker)
+            stdout, stderr = await worker.open_streams()
+
+            # stream-json: eventos tipados en vez de texto plano con ANSI
+            parser = StreamJsonParser() if CLAUDE_OUTPUT_FORMAT == 'stream-json' else None
+            usage = {}
+
+            async def handle_event(event: StreamEvent):
+                nonlocal had_errors
+                if event.kind in ('text_delta', 'raw'):
+                    await emit(event.text if event.kind == 'text_delta' else event.text + '\n')
+                elif event.kind == 'result':
+                    had_errors = had_errors or event.is_error
+                elif event.kind == 'usage':
+                    usage.update(event.data)
+                if event_callback:
+                    await event_callback(event)
+
             async def read_stream(stream, is_error=False):
-                buffer = b''
-                while True:
-                    chunk = await stream.read(1024)
-                    if not chunk:
-                        break
-                    buffer += chunk
-                    try:
-                        text = buffer.decode('utf-8', errors='replace')
-                        while '\n' in text:
-                            line, text = text.split('\n', 1)
-                            cleaned = remove_ansi_codes(line)
-                            if cleaned.strip():
-                                if is_error and error_callback:
-                                    await error_callback(cleaned)
-                                elif not is_error:
-                                    await output_callback(cleaned + '\n')
-                        buffer = text.encode('utf-8', errors='replace')
-                    except Exception as e:
-                        logger.error(f"[Chat {session_id}] Stream decode error: {e}")
-
-                if buffer:
-                    try:
-                        text = buffer.decode('utf-8', errors='replace')
-                        cleaned = remove_ansi_codes(text)
-                        if cleaned.strip():
-                            if is_error and error_callback:
-                                await error_callback(cleaned)
-                            elif not is_error:
-                                await output_callback(cleaned)
-                    except Exception:
-                        pass
+                nonlocal had_errors
+                on_data = None if is_error else worker.note_output
+                async for line, terminated in read_lines(stream, STREAM_READ_SIZE, on_data):
+                    if parser and not is_error:
+                        for event in parser.feed_line(line):
+                            await handle_event(event)
+                        continue
+                    cleaned = remove_ansi_codes(line)
+                    if not cleaned.strip():
+                        continue
+                    if is_error:
+                        had_errors = True
+                        if error_callback:
+                            await error_callback(cleaned)
+                    else:
+                        await emit(cleaned + '\n' if terminated else cleaned)
 
             try:
                 await asyncio.wait_for(
                     asyncio.gather(
-                        read_stream(process.stdout, is_error=False),
-                        read_stream(process.stderr, is_error=True)
+                        read_stream(stdout, is_error=False),
+                        read_stream(stderr, is_error=True)
                     ),
                     timeout=COMMAND_TIMEOUT
                 )
-                returncode = await process.wait()
+                returncode = await worker.wait()
             except asyncio.TimeoutError:
                 logger.warning(f"[Chat {session_id}] Timeout after {COMMAND_TIMEOUT}s")
-                process.kill()
-                await process.wait()
+                worker.kill()
                 if error_callback:
                     await error_callback(f"Timeout: el comando excedió {int(COMMAND_TIMEOUT)}s")
-                return {'success': False, 'returncode': -2, 'timeout': True}
+                return {'success': False, 'returncode': -2, 'timeout': True, 'resources': worker.usage()}
 
+            pool.release(worker)
+            resources = worker.usage()
+            if worker.limit_exceeded:
+                logger.warning(f"[Chat {session_id}] Resource limit exceeded: {worker.limit_exceeded} {resources}")
+                if error_callback:
+                    await error_callback(f"Límite de recursos superado ({worker.limit_exceeded}); la ejecución se detuvo")
+                return {
+                    'success': False,
+                    'returncode': -4,
+                    'limit_exceeded': worker.limit_exceeded,
+                    'resources': resources
+                }
+            if job is not None and job.cancelled:
+                logger.info(f"[Chat {session_id}] Cancelled (code {returncode})")
+                return {'success': False, 'returncode': -3, 'cancelled': True}
+
+            cli_session = (parser.session_id if parser else None) or worker.session_id \
+                or (cmd[cmd.index(RESUME_FLAG) + 1] if RESUME_FLAG in cmd else None)
             if returncode == 0:
-                chat_sessions[session_id] = True
-
-            return {'success': returncode == 0, 'returncode': returncode}
-
+                chat_sessions.set(session_id, cli_session)
+                if cache is not None and not had_errors:
+                    cache.put(query, ''.join(captured))
+
+            result = {
+                'success': returncode == 0,
+                'returncode': returncode,
+                'resources': resources,
+                'session_id': cli_session
+            }
+            if parser:
+                result['usage'] = usage
+            return result
+
+        except AdmissionCancelled:
+            logger.info(f"[Chat {session_id}] Cancelled while waiting for a host slot")
+            return {'success': False, 'returncode': -3, 'cancelled': True}
         except FileNotFoundError:
             msg = f'Claude CLI no encontrado en: {self.claude_path}'
             logger.error(msg)
@@ -164,6 +278,40 @@ class ClaudeCodeExecutor:
             if error_callback:
                 await error_callback(msg)
             return {'success': False, 'returncode': -1}
+        finally:
+            if ticket is not None:
+                await asyncio.get_running_loop().run_in_executor(None, admission.release, ticket)
+
+
+worker_pool: Optional[ClaudeWorkerPool] = None
+
+
+def get_worker_pool() -> ClaudeWorkerPool:
+    """Pool global de procesos Claude CLI pre-arrancados."""
+    global worker_pool
+    if worker_pool is None:
+        env = os.environ.copy()
+        env['PWD'] = WORKSPACE_PATH
+        worker_pool = ClaudeWorkerPool(
+            ClaudeCodeExecutor().build_command("", continue_session=False),
+            cwd=WORKSPACE_PATH,
+            env=env,
+            size=WORKER_POOL_SIZE,
+            idle_ttl=WORKER_POOL_IDLE_TTL,
+            limits=ResourceLimits(CLAUDE_MAX_MEMORY_MB, CLAUDE_MAX_CPU_SECONDS, CLAUDE_MAX_CHILDREN),
+            session_ids=True
+        )
+    return worker_pool
+
+
+@app.on_event("startup")
+async def start_worker_pool():
+    get_worker_pool().start()
+
+
+@app.on_event("shutdown")
+async def stop_worker_pool():
+    get_worker_pool().shutdown()
 
 
 def load_mcp_config() -> dict:
@@ -364,8 +512,72 @@ def get_workflows() -> list:
 @app.websocket("/ws/chat")
 async def websocket_chat(websocket: WebSocket):
     await websocket.accept()
-    session_id = "web_default"
+    # Cada conexión tiene su propia cola: "cancel" solo afecta a sus ejecuciones
+    connection_id = f"ws_{uuid.uuid4().hex[:8]}"
+    # La conversación la elige el navegador para retomarla al reconectar; sin ella, una por conexión
+    conversation = websocket.query_params.get("conversation", "")
+    session_id = f"web_{conversation}" if CONVERSATION_ID_RE.match(conversation) else connection_id
     executor = ClaudeCodeExecutor()
+    tasks: set[asyncio.Task] = set()
+
+    async def run_query(query: str, use_cache: bool = True):
+        job = job_queue.submit(connection_id, query[:50])
+
+        async def on_output(text: str):
+            await websocket.send_json({"type": "chunk", "content": text})
+
+        async def on_error(text: str):
+            await websocket.send_json({"type": "error", "content": text})
+
+        async def on_admission_wait(position: int):
+            if position:
+                await websocket.send_json({"type": "queued", "position": position, "scope": "host"})
+            else:
+                await websocket.send_json({"type": "start"})
+
+        async def on_event(event: StreamEvent):
+            if event.kind in ('tool_use_start', 'tool_use_end'):
+                await websocket.send_json({
+                    "type": "tool",
+                    "name": event.tool,
+                    "state": "start" if event.kind == 'tool_use_start' else "end",
+                    "is_error": event.is_error
+                })
+
+        try:
+            if job.position:
+                await websocket.send_json({"type": "queued", "position": job.position})
+
+            async with job_queue.run(connection_id, job=job):
+                await websocket.send_json({"type": "start"})
+                continue_session = session_id in chat_sessions
+                result = await executor.execute_streaming(
+                    query, session_id, continue_session, on_output, on_error,
+                    job=job, event_callback=on_event, use_cache=use_cache,
+                    on_admission_wait=on_admission_wait
+                )
+        except JobCancelled:
+            result = {'success': False, 'returncode': -3, 'cancelled': True}
+        except Exception as e:
+            # Normalmente el socket se cerró a mitad de respuesta
+            logger.warning(f"[Chat {session_id}] Query aborted: {e}")
+            job.cancel()
+            job_queue.finish(job)
+            return
+
+        try:
+            await websocket.send_json({
+                "type": "done",
+                "success": result["success"],
+                "returncode": result["returncode"],
+                "cancelled": result.get("cancelled", False),
+                "cached": result.get("cached", False),
+                "limit_exceeded": result.get("limit_exceeded"),
+                "resources": result.get("resources"),
+                "usage": result.get("usage")
+            })
+        except Exception:
+            pass
 
     try:
         while True:
@@ -373,34 +585,25 @@ async def websocket_chat(websocket: WebSocket):
             msg_type = data.get("type", "message")
 
             if msg_type == "new_session":
-                if session_id in chat_sessions:
-                    del chat_sessions[session_id]
+                chat_sessions.pop(session_id)
                 await websocket.send_json({"type": "system", "content": "Nueva conversación iniciada."})
                 continue
 
+            if msg_type == "cancel":
+                cancelled = job_queue.cancel(connection_id)
+                logger.info(f"[Chat {session_id}] {cancelled} job(s) cancelled")
+                continue
+
             if msg_type == "message":
-                query = data.get("content", "").strip()
+                query, skip_cache = split_bypass(data.get("content", "").strip())
                 if not query:
                     continue
+                skip_cache = skip_cache or bool(data.get("no_cache"))
 
-                await websocket.send_json({"type": "start"})
-
-                async def on_output(text: str):
-                    await websocket.send_json({"type": "chunk", "content": text})
-
-                async def on_error(text: str):
-                    await websocket.send_json({"type": "error", "content": text})
-
-                continue_session = session_id in chat_sessions
-                result = await executor.execute_streaming(
-                    query, session_id, continue_session, on_output, on_error
-                )
-
-                await websocket.send_json({
-                    "type": "done",
-                    "success": result["success"],
-                    "returncode": result["returncode"]
-                })
+                # Ejecutar en segundo plano para seguir recibiendo mensajes (p.ej. "cancel")
+                task = asyncio.create_task(run_query(query, use_cache=not skip_cache))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
 
     except WebSocketDisconnect:
         logger.info(f"[Chat {session_id}] WebSocket disconnected")
@@ -410,6 +613,9 @@ async def websocket_chat(websocket: WebSocket):
             await websocket.send_json({"type": "error", "content": str(e)})
         except Exception:
             pass
+    finally:
+        # Nadie va a leer la respuesta: matar lo que quede en marcha
+        job_queue.cancel(connection_id)
 
 
 # ============== ROUTES ==============
@@ -482,6 +688,32 @@ async def check_single_mcp_health(mcp_name: str):
     return await check_mcp_health(mcp_name, mcps[mcp_name])
 
 
+@app.get("/api/pool")
+async def pool_stats():
+    """Estado del pool de workers y time-to-first-byte con y sin pool"""
+    return get_worker_pool().stats()
+
+
+@app.get("/api/cache")
+async def cache_stats():
+    """Aciertos, fallos y tamaño de la caché de respuestas"""
+    if response_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **response_cache.stats()}
+
+
+@app.get("/api/admission")
+async def admission_stats():
+    """Procesos del CLI en uso y en espera en todo el host (bots, web y crons)"""
+    return await asyncio.get_running_loop().run_in_executor(None, admission.stats)
+
+
+@app.get("/metrics")
+async def metrics():
+    """Métricas del executor del chat en formato de texto de Prometheus"""
+    return PlainTextResponse(EXECUTOR_METRICS.registry.render(), media_type=METRICS_CONTENT_TYPE)
+
+
 @app.get("/api/docs/{doc_type}")
 async def get_docs(doc_type: str):
     """Obtiene documentación por tipo (integrations o workflows)"""
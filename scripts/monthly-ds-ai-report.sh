@@ -10,6 +10,13 @@ export PATH="$HOME/.local/bin:$HOME/.nvm/versions/node/$(ls $HOME/.nvm/versions/
 
 WORKSPACE="/Users/ignaciodelacuba/Dev/claudio"
 CLAUDE_BIN="/Users/ignaciodelacuba/.local/bin/claude"
+# Pasa por el límite de procesos del CLI del host (compartido con los bots y la web)
+# con prioridad batch: espera si hay conversaciones interactivas en curso.
+# cron no carga .env: el límite y el directorio de estado se pasan explícitamente
+# y deben coincidir con ADMISSION_MAX_CONCURRENT / ADMISSION_STATE_DIR de los bots
+ADMISSION_MAX_CONCURRENT="${ADMISSION_MAX_CONCURRENT:-4}"
+ADMISSION_STATE_DIR="${ADMISSION_STATE_DIR:-$HOME/.claudio}"
+ADMIT="python3 -m channels.common.admission --priority batch --label monthly-ds-ai-report --max-concurrent $ADMISSION_MAX_CONCURRENT --state-dir $ADMISSION_STATE_DIR --"
 LOG_FILE="$WORKSPACE/scripts/logs/monthly-ds-ai-report.log"
 
 mkdir -p "$WORKSPACE/scripts/logs"
@@ -18,7 +25,7 @@ echo "$(date '+%Y-%m-%d %H:%M:%S') - Starting monthly DS & AI report..." >> "$LO
 
 cd "$WORKSPACE"
 
-$CLAUDE_BIN --dangerously-skip-permissions -p "Genera el reporte mensual de DS & AI del mes anterior completo. Sigue el workflow definido en docs/workflows/monthly-ds-ai-report.md paso a paso:
+$ADMIT $CLAUDE_BIN --dangerously-skip-permissions -p "Genera el reporte mensual de DS & AI del mes anterior completo. Sigue el workflow definido en docs/workflows/monthly-ds-ai-report.md paso a paso:
 
 1. Calcula el rango de fechas del mes anterior automáticamente
 2. Pull Epics del quarter actual desde ClickUp (list 901215396098)
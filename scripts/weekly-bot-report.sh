@@ -10,6 +10,13 @@ export PATH="$HOME/.local/bin:$HOME/.nvm/versions/node/$(ls $HOME/.nvm/versions/
 
 WORKSPACE="/Users/ignaciodelacuba/Dev/claudio"
 CLAUDE_BIN="/Users/ignaciodelacuba/.local/bin/claude"
+# Pasa por el límite de procesos del CLI del host (compartido con los bots y la web)
+# con prioridad batch: espera si hay conversaciones interactivas en curso.
+# cron no carga .env: el límite y el directorio de estado se pasan explícitamente
+# y deben coincidir con ADMISSION_MAX_CONCURRENT / ADMISSION_STATE_DIR de los bots
+ADMISSION_MAX_CONCURRENT="${ADMISSION_MAX_CONCURRENT:-4}"
+ADMISSION_STATE_DIR="${ADMISSION_STATE_DIR:-$HOME/.claudio}"
+ADMIT="python3 -m channels.common.admission --priority batch --label weekly-bot-report --max-concurrent $ADMISSION_MAX_CONCURRENT --state-dir $ADMISSION_STATE_DIR --"
 LOG_FILE="$WORKSPACE/scripts/logs/weekly-bot-report.log"
 
 mkdir -p "$WORKSPACE/scripts/logs"
@@ -18,7 +25,7 @@ echo "$(date '+%Y-%m-%d %H:%M:%S') - Starting weekly bot report..." >> "$LOG_FIL
 
 cd "$WORKSPACE"
 
-$CLAUDE_BIN --dangerously-skip-permissions -p "Genera el reporte semanal del bot de WhatsApp usando los datos del spreadsheet Full Funnel Performance (ID: 1PI2NnSzDhxCrb-NY18WgEiNpQyujgSG0RkPCw4c7IM8, sheet con gid=1481538928 que es 'Full Funnel metrics (ES) v2').
+$ADMIT $CLAUDE_BIN --dangerously-skip-permissions -p "Genera el reporte semanal del bot de WhatsApp usando los datos del spreadsheet Full Funnel Performance (ID: 1PI2NnSzDhxCrb-NY18WgEiNpQyujgSG0RkPCw4c7IM8, sheet con gid=1481538928 que es 'Full Funnel metrics (ES) v2').
 
 Incluye estas métricas para la última semana completa vs la semana anterior (WoW), con delta absoluto y % de cambio:
 1. Nuevos Leads